@@ -1,12 +1,25 @@
-import posixpath
-
-from django.contrib import admin
-from django.shortcuts import get_object_or_404, render, redirect
-from django.db.models import Q
+import datetime, posixpath, re
+from functools import wraps, partial
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.shortcuts import render, redirect
+from django.http import Http404
+from django.db import connections
+from django.db.models import Q, Min, Max
+from django.db.models.query import QuerySet
+from django.utils import timezone
 from django.contrib.staticfiles.storage import staticfiles_storage
 
-from data.models import Application, File, Model, Field, Instance
+from data.models import Application, File, Model, Field, Instance, BulkAction
 from data.forms import form_for_model, form_name_for_field, FieldForm
+from data.schema import get_schema
+from data import index, search, bulk
 
 
 class ApplicationAdmin(admin.ModelAdmin):
@@ -73,6 +86,15 @@ class FieldInline(admin.TabularInline):
     form = FieldForm
 
 
+def queue_bulk_action(model_admin, request, action, instance_ids, params=None, description=None):
+    """Queues a bulk action on the instances, to be run in the background by the run_bulk_actions command."""
+    bulk_action = bulk.create_bulk_action(action, instance_ids, params, request.user)
+    model_admin.message_user(request, u"{count} instances were queued to {description}. Progress is shown in bulk actions.".format(
+        count = bulk_action.instance_count,
+        description = description or action,
+    ))
+
+
 class ModelAdmin(admin.ModelAdmin):
 
     date_hierarchy = "date_modified"
@@ -101,13 +123,31 @@ class ModelAdmin(admin.ModelAdmin):
 
     filter_horizontal = ("admin_users", "admin_groups", "applications",)
 
+    actions = ("publish_instances", "unpublish_instances",)
+
+    def publish_instances(self, request, queryset):
+        queue_bulk_action(self, request, "publish", Instance.objects.filter(
+            model__in = queryset,
+        ).values_list("id", flat=True))
+    publish_instances.short_description = "Publish all instances of selected models in the background"
+
+    def unpublish_instances(self, request, queryset):
+        queue_bulk_action(self, request, "unpublish", Instance.objects.filter(
+            model__in = queryset,
+        ).values_list("id", flat=True))
+    unpublish_instances.short_description = "Unpublish all instances of selected models in the background"
+
 admin.site.register(Model, ModelAdmin)
 
 
+def can_access_all_models(user):
+    # Model admins can see everything.
+    return user.has_perm("data.change_model")
+
+
 def models_for_user(user):
     model_list = Model.objects.all()
-    # Model admins can see everything.
-    if not user.has_perm("data.change_model"):
+    if not can_access_all_models(user):
         model_list = model_list.filter(
             Q(admin_users = user) | Q(admin_groups__user = user),
         ).distinct()
@@ -115,6 +155,115 @@ def models_for_user(user):
     return model_list
 
 
+def memoize_for_request(func):
+    """Caches the result of an admin method for the rest of the request."""
+    @wraps(func)
+    def do_memoize_for_request(self, request, *args):
+        request_cache = request.__dict__.setdefault("_data_admin_cache", {})
+        key = (func.__name__,) + args
+        try:
+            return request_cache[key]
+        except KeyError:
+            value = request_cache[key] = func(self, request, *args)
+            return value
+    return do_memoize_for_request
+
+
+# The estimated number of rows above which the admin changelist stops counting rows exactly.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+# Matches the estimated row count in a PostgreSQL query plan.
+ESTIMATED_ROWS_RE = re.compile(r"rows=(\d+)")
+
+
+def estimate_count(queryset):
+    """
+    Returns the number of rows the query planner expects the queryset to return,
+    or None if the database cannot estimate it.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute("EXPLAIN " + sql, params)
+    match = ESTIMATED_ROWS_RE.search(cursor.fetchone()[0])
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def truncate_datetime(value, kind):
+    """Truncates a datetime to the start of its year, month or day."""
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind in ("year", "month"):
+        value = value.replace(day=1)
+    if kind == "year":
+        value = value.replace(month=1)
+    return value
+
+
+def next_datetime(value, kind):
+    """Returns the start of the year, month or day after a truncated datetime."""
+    if kind == "year":
+        return value.replace(year=value.year + 1)
+    if kind == "month":
+        if value.month == 12:
+            return value.replace(year=value.year + 1, month=1)
+        return value.replace(month=value.month + 1)
+    return value + datetime.timedelta(days=1)
+
+
+class InstanceChangeListQuerySet(QuerySet):
+
+    """
+    The instances listed in the admin changelist.
+
+    Large unfiltered result sets are counted using the query planner estimate on
+    PostgreSQL. Filtered result sets, where the estimate can be far off, and other
+    databases, which cannot estimate counts, are counted exactly. The date hierarchy
+    lists every period between the first and last indexed dates, rather than scanning
+    every instance for distinct dates.
+    """
+
+    def count(self):
+        if self._result_cache is None and not self.query.where:
+            count = estimate_count(self)
+            if count is not None and count >= ESTIMATED_COUNT_THRESHOLD:
+                return count
+        return super(InstanceChangeListQuerySet, self).count()
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        date_range = self.aggregate(
+            first = Min(field_name),
+            last = Max(field_name),
+        )
+        first, last = date_range["first"], date_range["last"]
+        if first is None:
+            return []
+        if settings.USE_TZ:
+            first = timezone.localtime(first, tzinfo)
+            last = timezone.localtime(last, tzinfo)
+        # List each period in the range.
+        datetime_list = []
+        value = truncate_datetime(first, kind)
+        while value <= last:
+            datetime_list.append(value)
+            value = next_datetime(value, kind)
+        if order == "DESC":
+            datetime_list.reverse()
+        return datetime_list
+
+
+class InstanceChangeList(ChangeList):
+
+    def get_queryset(self, request):
+        # Count and list dates without scanning every instance.
+        self.root_queryset = self.root_queryset._clone(klass=InstanceChangeListQuerySet)
+        return super(InstanceChangeList, self).get_queryset(request)
+
+
 class ModelListFilter(admin.SimpleListFilter):
     
     title = "model"
@@ -125,7 +274,7 @@ class ModelListFilter(admin.SimpleListFilter):
         return [
             (unicode(model.id), unicode(model))
             for model
-            in models_for_user(request.user)
+            in model_admin.get_model_list(request)
         ]
         
     def queryset(self, request, queryset):
@@ -147,20 +296,89 @@ class ApplicationListFiler(admin.SimpleListFilter):
         return [
             (unicode(application.id), unicode(application))
             for application
-            in Application.objects.filter(
-                model__in = models_for_user(request.user),
-            ).distinct()
+            in model_admin.get_application_list(request)
         ]
         
     def queryset(self, request, queryset):
         value = self.value()
         if value is not None:
+            # Filter by model, rather than joining every instance to its applications.
             queryset = queryset.filter(
-                model__applications__id = value,
+                model__in = Model.applications.through.objects.filter(
+                    application_id = value,
+                ).values("model_id"),
             )
         return queryset
 
 
+class FieldValueListFilter(admin.ListFilter):
+
+    """Filters instances by field value, using the where[<field>] parameters supported by the API."""
+
+    title = "field value"
+
+    def __init__(self, request, params, model, model_admin):
+        super(FieldValueListFilter, self).__init__(request, params, model, model_admin)
+        self.model_admin = model_admin
+        self.where_params = dict(
+            (param, params.pop(param))
+            for param
+            in list(params)
+            if index.WHERE_PARAM_RE.match(param)
+        )
+
+    def has_output(self):
+        return bool(self.where_params)
+
+    def expected_parameters(self):
+        return list(self.where_params)
+
+    def choices(self, cl):
+        yield {
+            "selected": False,
+            "query_string": cl.get_query_string({}, self.expected_parameters()),
+            "display": "All",
+        }
+        for param, value in sorted(self.where_params.iteritems()):
+            yield {
+                "selected": True,
+                "query_string": cl.get_query_string({}, [param]),
+                "display": u"{param}={value}".format(
+                    param = param[len("where"):],
+                    value = value,
+                ),
+            }
+
+    def queryset(self, request, queryset):
+        field_set = Field.objects.filter(
+            model__in = self.model_admin.get_model_ids(request),
+        )
+        model_id = request.GET.get("model")
+        if model_id is not None:
+            field_set = field_set.filter(
+                model__id = model_id,
+            )
+        try:
+            return index.filter_instances(queryset, index.parse_filters(self.where_params, field_set))
+        except ValidationError as ex:
+            raise IncorrectLookupParameters(u" ".join(ex.messages))
+
+
+class InstanceActionForm(ActionForm):
+
+    """The instance admin action form, with the field value used by the set field value action."""
+
+    field_name = forms.CharField(
+        label = "Field",
+        required = False,
+    )
+
+    field_value = forms.CharField(
+        label = "Value",
+        required = False,
+    )
+
+
 class InstanceAdmin(admin.ModelAdmin):
 
     date_hierarchy = "date_modified"
@@ -169,12 +387,37 @@ class InstanceAdmin(admin.ModelAdmin):
 
     list_display = ("name", "model", "external_id", "is_online", "date_created", "date_modified",)
 
-    list_filter = ("is_online", ModelListFilter, ApplicationListFiler,)
+    list_filter = ("is_online", ModelListFilter, ApplicationListFiler, FieldValueListFilter,)
+
+    list_select_related = ("model",)
+
+    actions = ("publish_instances", "unpublish_instances", "set_field_value", "delete_instances",)
+
+    action_form = InstanceActionForm
+
+    def get_changelist(self, request, **kwargs):
+        return InstanceChangeList
 
     raw_id_fields = ("model",)
 
+    @memoize_for_request
     def get_model_list(self, request):
-        return models_for_user(request.user)
+        """Returns the models the user can access."""
+        return list(models_for_user(request.user))
+
+    @memoize_for_request
+    def get_model_ids(self, request):
+        """Returns the IDs of the models the user can access."""
+        return frozenset(model.id for model in self.get_model_list(request))
+
+    @memoize_for_request
+    def get_application_list(self, request):
+        """Returns the applications of the models the user can access."""
+        return list(Application.objects.filter(
+            id__in = Model.applications.through.objects.filter(
+                model_id__in = self.get_model_ids(request),
+            ).values("application_id"),
+        ))
 
     def get_model_for_request(self, request, obj):
         if obj:
@@ -183,18 +426,96 @@ class InstanceAdmin(admin.ModelAdmin):
             model_id = request.GET["model"]
         except KeyError:
             return None
-        return get_object_or_404(self.get_model_list(request), id=model_id)
+        return self.get_requested_model(request, model_id)
+
+    @memoize_for_request
+    def get_requested_model(self, request, model_id):
+        for model in self.get_model_list(request):
+            if unicode(model.id) == model_id:
+                return model
+        raise Http404("Unknown model {model_id}.".format(
+            model_id = model_id,
+        ))
 
     def get_queryset(self, request):
-        return super(InstanceAdmin, self).get_queryset(request).filter(
-            model__in = self.get_model_list(request),
+        queryset = super(InstanceAdmin, self).get_queryset(request)
+        if can_access_all_models(request.user):
+            return queryset
+        return queryset.filter(
+            model__in = self.get_model_ids(request),
         )
 
+    def get_search_results(self, request, queryset, search_term):
+        search_queryset, use_distinct = super(InstanceAdmin, self).get_search_results(request, queryset, search_term)
+        # Include instances whose data matches the full-text search.
+        if search_term:
+            model_ids = self.get_model_ids(request)
+            model_id = request.GET.get("model")
+            if model_id is not None:
+                model_ids = [model.id for model in self.get_model_list(request) if unicode(model.id) == model_id]
+            instance_ids = search.search_instance_ids(
+                search_term,
+                model_ids,
+                online_only = False,
+            )
+            search_queryset |= queryset.filter(
+                id__in = instance_ids,
+            )
+        return search_queryset, use_distinct
+
+    def publish_instances(self, request, queryset):
+        queue_bulk_action(self, request, "publish", queryset.values_list("id", flat=True))
+    publish_instances.short_description = "Publish selected instances in the background"
+
+    def unpublish_instances(self, request, queryset):
+        queue_bulk_action(self, request, "unpublish", queryset.values_list("id", flat=True))
+    unpublish_instances.short_description = "Unpublish selected instances in the background"
+
+    def set_field_value(self, request, queryset):
+        field_name = request.POST.get("field_name", "")
+        field_value = request.POST.get("field_value", "")
+        # Validate the value for each selected model with the field.
+        values = {}
+        for model in Model.objects.filter(id__in=queryset.values("model_id")):
+            try:
+                values[unicode(model.pk)] = get_schema(model).parse_text_value(field_name, field_value)
+            except KeyError:
+                continue
+            except ValidationError as ex:
+                self.message_user(request, u"{model}: {message}".format(
+                    model = model,
+                    message = u" ".join(ex.messages),
+                ), level=messages.ERROR)
+                return
+        if not values:
+            self.message_user(request, u"None of the selected instances have a field named '{field_name}'.".format(
+                field_name = field_name,
+            ), level=messages.ERROR)
+            return
+        queue_bulk_action(self, request, "set_field", queryset.filter(
+            model__in = [int(model_id) for model_id in values],
+        ).values_list("id", flat=True), {
+            "field_name": field_name,
+            "values": values,
+        }, description=u"set {field_name}".format(
+            field_name = field_name,
+        ))
+    set_field_value.short_description = "Set field value of selected instances in the background"
+
+    def delete_instances(self, request, queryset):
+        if not self.has_delete_permission(request):
+            self.message_user(request, "You do not have permission to delete instances.", level=messages.ERROR)
+            return
+        queue_bulk_action(self, request, "delete", queryset.values_list("id", flat=True))
+    delete_instances.short_description = "Delete selected instances in the background"
+
     def get_form(self, request, obj=None, **kwargs):
         model = self.get_model_for_request(request, obj)
         # Create the appropriate form.
         form = form_for_model(model)
-        return super(InstanceAdmin, self).get_form(request, obj, form=form) 
+        form = super(InstanceAdmin, self).get_form(request, obj, form=form)
+        # Bind the current model to each form.
+        return partial(form, model=model)
 
     def get_fieldsets(self, request, obj=None):
         model = self.get_model_for_request(request, obj)
@@ -207,7 +528,7 @@ class InstanceAdmin(admin.ModelAdmin):
                 "fields": [
                     form_name_for_field(field)
                     for field
-                    in model.field_set.all()
+                    in get_schema(model).field_list
                 ]
             }),
         )
@@ -239,10 +560,10 @@ class InstanceAdmin(admin.ModelAdmin):
         return super(InstanceAdmin, self).response_add(request, obj, post_url_continue)
 
     def has_add_permission(self, request):
-        return super(InstanceAdmin, self).has_add_permission(request) and self.get_model_list(request).exists()
+        return super(InstanceAdmin, self).has_add_permission(request) and bool(self.get_model_ids(request))
 
     def can_access_instance(self, request, obj):
-        return (obj is None) or (obj is not None and self.get_model_list(request).filter(id=obj.model_id).exists())
+        return (obj is None) or (obj.model_id in self.get_model_ids(request))
 
     def has_change_permission(self, request, obj=None):
         return super(InstanceAdmin, self).has_change_permission(request, obj) and self.can_access_instance(request, obj)
@@ -252,3 +573,30 @@ class InstanceAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Instance, InstanceAdmin)
+
+
+class BulkActionAdmin(admin.ModelAdmin):
+
+    list_display = ("action", "get_progress", "status", "user", "date_created", "date_modified",)
+
+    list_filter = ("status", "action",)
+
+    fields = ("action", "model", "get_progress", "status", "user", "params", "error",)
+
+    readonly_fields = fields
+
+    def get_progress(self, obj):
+        return u"{processed} / {count}".format(
+            processed = obj.processed,
+            count = obj.instance_count,
+        )
+    get_progress.short_description = "progress"
+
+    def get_queryset(self, request):
+        # Don't load the instance IDs of every action in the list.
+        return super(BulkActionAdmin, self).get_queryset(request).defer("instance_ids").select_related("user")
+
+    def has_add_permission(self, request):
+        return False
+
+admin.site.register(BulkAction, BulkActionAdmin)
@@ -0,0 +1,123 @@
+"""
+Aggregation of instance field values.
+
+Aggregates are computed in the database from the field value index, over the
+instances matched by an API request, so clients can load summary values
+without loading every instance.
+"""
+
+import collections, datetime, re
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Min, Max, Sum, Avg
+
+
+# Matches an aggregate expression, such as count, sum(Price) or count_by(Category).
+AGGREGATE_RE = re.compile(r"^(count|count_by|min|max|sum|avg)(?:\((.+)\))?$")
+
+
+AGGREGATE_FUNCTIONS = {
+    "min": Min,
+    "max": Max,
+    "sum": Sum,
+    "avg": Avg,
+}
+
+
+# The maximum number of values returned by a count_by aggregate.
+MAX_COUNT_BY_VALUES = 100
+
+
+def parse_aggregates(value, field_set):
+    """
+    Parses a comma-separated list of aggregate expressions.
+
+    The field_set is only evaluated if an expression refers to a field.
+
+    Returns a list of (expression, function, field_name, index_column, model_ids) tuples,
+    where the field details are None for a count. Raises ValidationError if an expression
+    is invalid.
+    """
+    aggregates = []
+    field_list = None
+    for expression in value.split(","):
+        match = AGGREGATE_RE.match(expression)
+        if not match:
+            raise ValidationError(u"Unknown aggregate '{expression}' in parameter 'aggregate'.".format(
+                expression = expression,
+            ))
+        function, field_name = match.groups()
+        if function == "count" and field_name is None:
+            aggregates.append((expression, function, None, None, None))
+            continue
+        if function == "count" or field_name is None:
+            raise ValidationError(u"Invalid aggregate '{expression}' in parameter 'aggregate'.".format(
+                expression = expression,
+            ))
+        if field_list is None:
+            field_list = list(field_set)
+        field_list_for_name = [field for field in field_list if field.name == field_name]
+        if not field_list_for_name:
+            raise ValidationError(u"Unknown field '{field_name}' in parameter 'aggregate'.".format(
+                field_name = field_name,
+            ))
+        # Fields of the same name in different models must be indexed in the same column.
+        index_columns = frozenset(
+            field.get_field_implementation().index_column
+            for field
+            in field_list_for_name
+        )
+        index_column = next(iter(index_columns))
+        if len(index_columns) > 1 or index_column is None or (function in ("sum", "avg") and index_column != "number_value"):
+            raise ValidationError(u"Field '{field_name}' cannot be used in aggregate '{expression}'.".format(
+                field_name = field_name,
+                expression = expression,
+            ))
+        aggregates.append((expression, function, field_name, index_column, [field.model_id for field in field_list_for_name]))
+    return aggregates
+
+
+def format_aggregate_value(value):
+    """Converts an aggregated index column value into a json value."""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    # Numbers are indexed as floats, so restore integers.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def aggregate_instances(instance_set, aggregates):
+    """
+    Computes the parsed aggregates over an instance set, returning a dict of
+    {expression: value}.
+    """
+    from data.models import FieldValue
+    results = collections.OrderedDict()
+    for expression, function, field_name, index_column, model_ids in aggregates:
+        if function == "count":
+            results[expression] = instance_set.count()
+            continue
+        # Values too long to index have no index value.
+        field_values = FieldValue.objects.filter(
+            model_id__in = model_ids,
+            field_name = field_name,
+            instance_id__in = instance_set.values_list("id", flat=True),
+            **{"{index_column}__isnull".format(index_column=index_column): False}
+        )
+        if function == "count_by":
+            results[expression] = [
+                {
+                    "value": format_aggregate_value(row[index_column]),
+                    "count": row["count"],
+                }
+                for row
+                in field_values.values(index_column).annotate(
+                    count = Count("id"),
+                ).order_by("-count", index_column)[:MAX_COUNT_BY_VALUES]
+            ]
+        else:
+            results[expression] = format_aggregate_value(field_values.aggregate(
+                value = AGGREGATE_FUNCTIONS[function](index_column),
+            )["value"])
+    return results
@@ -0,0 +1,538 @@
+"""
+Bulk actions on instances.
+
+Admin actions on many instances are saved as BulkAction rows, and run by the
+run_bulk_actions command in chunks. Each chunk is saved using batched UPDATE
+statements in a single transaction, along with the progress of the action, and
+the index, search, publication and cache updates are made once per chunk,
+rather than once per instance.
+"""
+
+import bisect, collections, traceback
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, reset_queries
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from data import cache, codec, index, publication, search, sync
+from data.fields import fields, load_many_references, FileField, ModelField, MultiModelField
+from data.importer import update_instances, get_instance_name
+from data.schema import get_schema
+
+
+# The number of instances updated in each transaction.
+BULK_ACTION_CHUNK_SIZE = 500
+
+
+def group_by_model(instance_list):
+    """Returns a list of (model, instance_list) pairs for the instances."""
+    model_instances = collections.OrderedDict()
+    for instance in instance_list:
+        model_instances.setdefault(instance.model, []).append(instance)
+    return model_instances.items()
+
+
+def save_instances(instance_list, field_names):
+    """Saves the given fields of the instances, as modified now, and renders their published data."""
+    date_modified = timezone.now()
+    for instance in instance_list:
+        instance.date_modified = date_modified
+        instance.published_data = codec.dumps(instance.get_published_data())
+    update_instances(instance_list, tuple(field_names) + ("date_modified", "published_data",))
+
+
+def save_instance_data(model, instance_list):
+    """Saves the changed data of instances of the model, and updates their index and search documents."""
+    field_list = get_schema(model).field_list
+    for instance in instance_list:
+        instance.name = get_instance_name(instance.data, instance.external_id)
+    save_instances(instance_list, ("name", "data",))
+    index.update_instances(instance_list, field_list)
+    search.update_instances(instance_list, field_list)
+
+
+def touch_models(instance_list):
+    """
+    Marks the models and applications of the instances as modified.
+
+    Taking instances offline or deleting them changes the published data of their
+    models and applications, without changing the date modified of any online instance.
+    """
+    from data.models import Application, Model
+    model_ids = set(instance.model_id for instance in instance_list)
+    if model_ids:
+        date_modified = timezone.now()
+        Model.objects.filter(id__in=model_ids).update(
+            date_modified = date_modified,
+        )
+        Application.objects.filter(model__id__in=model_ids).update(
+            date_modified = date_modified,
+        )
+
+
+# Actions.
+
+def set_online(instance_list, is_online):
+    instance_list = [instance for instance in instance_list if instance.is_online != is_online]
+    for instance in instance_list:
+        instance.is_online = is_online
+    save_instances(instance_list, ("is_online",))
+    for model, model_instance_list in group_by_model(instance_list):
+        publication.update_instances(model, model_instance_list)
+    touch_models(instance_list)
+    return instance_list
+
+
+def publish_instances(instance_list, params):
+    """Takes the instances online."""
+    return set_online(instance_list, True)
+
+
+def unpublish_instances(instance_list, params):
+    """Takes the instances offline."""
+    return set_online(instance_list, False)
+
+
+def set_field_value(instance_list, params):
+    """
+    Sets the value of a field in the instance data.
+
+    The params contain the field_name, and the cleaned values of the field for
+    each model ID. Instances of other models are unchanged.
+    """
+    field_name = params["field_name"]
+    changed_instance_list = []
+    for model, model_instance_list in group_by_model(instance_list):
+        try:
+            value = params["values"][unicode(model.pk)]
+        except KeyError:
+            continue
+        for instance in model_instance_list:
+            instance.data[field_name] = value
+        save_instance_data(model, model_instance_list)
+        changed_instance_list.extend(model_instance_list)
+    return changed_instance_list
+
+
+def get_reference_key(value):
+    """
+    Returns the key of a referenced object in the published data: the external ID of an
+    instance, or the stored name of a file. Other values are returned unchanged.
+    """
+    from data.models import File, Instance
+    if isinstance(value, Instance):
+        return value.external_id
+    if isinstance(value, File):
+        return value.file.name
+    return value
+
+
+def export_field_value(previous_field_implementation, field_implementation, value, references):
+    """
+    Converts a json value of a field into a value of a new field type, before it is cleaned.
+
+    Referenced objects are converted to their keys, using a dict of objects referenced by
+    the previous value. Values of reference fields are converted from keys into their
+    json representation. Raises ValidationError if the value cannot be converted.
+    """
+    from data.models import File
+    try:
+        python_value = previous_field_implementation.deserialize_references(value, references)
+    except (TypeError, ValueError):
+        python_value = None
+    if value is not None and python_value is None:
+        raise ValidationError("Enter a valid value.")
+    if isinstance(python_value, list):
+        # Missing references are not converted.
+        if len(python_value) != len(value):
+            raise ValidationError("Unknown reference.")
+        python_value = [get_reference_key(item) for item in python_value]
+    else:
+        python_value = get_reference_key(python_value)
+    if python_value is None:
+        return None
+    # Multiple values are separated by commas, as in text import formats.
+    if isinstance(field_implementation, MultiModelField):
+        if isinstance(python_value, list):
+            return python_value
+        return field_implementation.parse_text_value(force_text(python_value))
+    if isinstance(python_value, list):
+        python_value = u", ".join(python_value)
+    if isinstance(field_implementation, ModelField):
+        return force_text(python_value)
+    if isinstance(field_implementation, FileField):
+        return File._meta.get_field("file").storage.url(force_text(python_value))
+    return python_value
+
+
+def convert_field_value(field_implementation, form_field, value, references):
+    """
+    Cleans a value exported by export_field_value(), returning its json representation,
+    using a dict of objects referenced by the exported value.
+
+    Raises ValidationError if the value is invalid.
+    """
+    reference_keys = field_implementation.get_references(value)
+    if reference_keys:
+        for reference_key in reference_keys:
+            if reference_key not in references:
+                raise ValidationError(u"Unknown reference '{key}'.".format(
+                    key = reference_key[2],
+                ))
+        return field_implementation.serialize(field_implementation.deserialize_references(value, references))
+    if isinstance(field_implementation, (ModelField, FileField)):
+        return field_implementation.serialize(None)
+    try:
+        return field_implementation.serialize(form_field.clean(value))
+    except (TypeError, ValueError):
+        raise ValidationError("Enter a valid value.")
+
+
+def convert_field_values(previous_field_implementation, field_implementation, value_list):
+    """
+    Converts a list of json values of a field to a new field type, loading referenced
+    objects in bulk.
+
+    Referenced instances and files are converted to and from their external ID and
+    file name, in the same way as the published data. Returns a list containing the
+    converted value, or a ValidationError, for each value.
+    """
+    form_field = field_implementation.form_field(required=False)
+    previous_references = load_many_references(
+        (previous_field_implementation, value)
+        for value
+        in value_list
+    )
+    exported_values = []
+    for value in value_list:
+        try:
+            exported_values.append(export_field_value(previous_field_implementation, field_implementation, value, previous_references))
+        except ValidationError as ex:
+            exported_values.append(ex)
+    references = load_many_references(
+        (field_implementation, value)
+        for value
+        in exported_values
+        if not isinstance(value, ValidationError)
+    )
+    results = []
+    for value in exported_values:
+        if not isinstance(value, ValidationError):
+            try:
+                value = convert_field_value(field_implementation, form_field, value, references)
+            except ValidationError as ex:
+                value = ex
+        results.append(value)
+    return results
+
+
+def migrate_field_values(instance_list, params):
+    """
+    Moves the values of a renamed or retyped field to its current name in the data
+    of the instances, converting them to the current field type. The instances are
+    not saved.
+
+    The params contain the previous and current name, type and type_params of the field.
+    Returns a tuple of (migrated_instance_list, failed_instance_list). Values that cannot
+    be converted are left unchanged.
+    """
+    previous_name = params["previous_name"]
+    name = params["name"]
+    instance_list = [instance for instance in instance_list if previous_name in instance.data]
+    value_list = [instance.data[previous_name] for instance in instance_list]
+    if params["previous_type"] != params["type"]:
+        value_list = convert_field_values(
+            fields[params["previous_type"]](**params["previous_type_params"]),
+            fields[params["type"]](**params["type_params"]),
+            value_list,
+        )
+    migrated_instance_list = []
+    failed_instance_list = []
+    for instance, value in zip(instance_list, value_list):
+        if isinstance(value, ValidationError):
+            failed_instance_list.append(instance)
+            continue
+        del instance.data[previous_name]
+        instance.data[name] = value
+        migrated_instance_list.append(instance)
+    return migrated_instance_list, failed_instance_list
+
+
+def migrate_field(instance_list, params):
+    """
+    Migrates the values of a renamed or retyped field, and saves the instances.
+
+    The IDs of instances with values that cannot be converted are added to the
+    failed_instance_ids param. Instances in the migrated_instance_ids param have
+    already been migrated when they were edited, and are skipped.
+    """
+    migrated_instance_ids = set(params.get("migrated_instance_ids", ()))
+    instance_list = [instance for instance in instance_list if instance.pk not in migrated_instance_ids]
+    instance_list, failed_instance_list = migrate_field_values(instance_list, params)
+    params.setdefault("failed_instance_ids", []).extend(instance.pk for instance in failed_instance_list)
+    for model, model_instance_list in group_by_model(instance_list):
+        field_names = [field.name for field in get_schema(model).field_list]
+        for instance in model_instance_list:
+            # Keep the instance data in field order, as saved by the admin form.
+            instance.data = collections.OrderedDict(sorted(
+                instance.data.iteritems(),
+                key = lambda item: field_names.index(item[0]) if item[0] in field_names else len(field_names),
+            ))
+        save_instance_data(model, model_instance_list)
+    return instance_list
+
+
+def migrate_instance(instance):
+    """
+    Applies the pending field migrations of the model of an instance to its data,
+    if they have not reached the instance yet. The instance is not saved.
+
+    This is used before editing an instance, so saving it doesn't lose values that
+    have not been migrated. The applied migrations are recorded when the instance is
+    saved, by record_migrated_instance().
+    """
+    from data.models import BulkAction
+    instance._migrated_bulk_action_ids = []
+    for bulk_action in BulkAction.objects.filter(
+        action = "migrate_field",
+        model_id = instance.model_id,
+        status__in = (BulkAction.STATUS_PENDING, BulkAction.STATUS_RUNNING),
+    ).order_by("id"):
+        if instance.pk in bulk_action.params.get("migrated_instance_ids", ()):
+            continue
+        # The instance IDs are sorted.
+        position = bisect.bisect_left(bulk_action.instance_ids, instance.pk)
+        if bulk_action.processed <= position < len(bulk_action.instance_ids) and bulk_action.instance_ids[position] == instance.pk:
+            migrate_field_values((instance,), bulk_action.params)
+            instance._migrated_bulk_action_ids.append(bulk_action.pk)
+
+
+def record_migrated_instance(instance):
+    """
+    Records that an instance has been saved with the field migrations applied by
+    migrate_instance(), so they are not applied again by run_bulk_action().
+    """
+    from data.models import BulkAction
+    bulk_action_ids = getattr(instance, "_migrated_bulk_action_ids", ())
+    if not bulk_action_ids:
+        return
+    with transaction.atomic():
+        # Lock the actions, which save their params after each chunk.
+        for bulk_action in BulkAction.objects.select_for_update().filter(pk__in=bulk_action_ids):
+            bulk_action.params.setdefault("migrated_instance_ids", []).append(instance.pk)
+            BulkAction.objects.filter(pk=bulk_action.pk).update(
+                params = bulk_action.params,
+            )
+    instance._migrated_bulk_action_ids = []
+
+
+def delete_model_instances(model_id):
+    """
+    Deletes the instances of a model that is being deleted, without loading them or
+    sending signals for each instance. The tombstones and cache invalidation of the
+    model cover its instances.
+    """
+    from data.models import Instance, FieldValue, SearchDocument, Publication
+    FieldValue.objects.filter(instance__model_id=model_id).delete()
+    SearchDocument.objects.filter(instance__model_id=model_id).delete()
+    Publication.objects.filter(instance__model_id=model_id).delete()
+    quote_name = connection.ops.quote_name
+    connection.cursor().execute(
+        "DELETE FROM {table} WHERE {model} = %s".format(
+            table = quote_name(Instance._meta.db_table),
+            model = quote_name(Instance._meta.get_field("model").column),
+        ),
+        [model_id],
+    )
+
+
+def delete_instances(instance_list, params):
+    """Deletes the instances, recording tombstones for incremental sync."""
+    from data.models import Instance, FieldValue, SearchDocument, Publication
+    instance_ids = [instance.pk for instance in instance_list]
+    sync.record_instances_removed(
+        (instance.model.external_id, instance.external_id)
+        for instance
+        in instance_list
+    )
+    FieldValue.objects.filter(instance_id__in=instance_ids).delete()
+    SearchDocument.objects.filter(instance_id__in=instance_ids).delete()
+    Publication.objects.filter(instance_id__in=instance_ids).delete()
+    # Delete without loading the instances again, or sending signals for each instance.
+    if instance_ids:
+        quote_name = connection.ops.quote_name
+        connection.cursor().execute(
+            "DELETE FROM {table} WHERE {pk} IN ({params})".format(
+                table = quote_name(Instance._meta.db_table),
+                pk = quote_name(Instance._meta.pk.column),
+                params = ", ".join(["%s"] * len(instance_ids)),
+            ),
+            instance_ids,
+        )
+    touch_models(instance_list)
+    return instance_list
+
+
+def reindex_instances(instance_list, params):
+    """
+    Rebuilds the indexed field values and search documents of the instances, after a
+    change to the fields of their model.
+    """
+    for model, model_instance_list in group_by_model(instance_list):
+        field_list = get_schema(model).field_list
+        index.update_instances(model_instance_list, field_list)
+        search.update_instances(model_instance_list, field_list)
+    return instance_list
+
+
+ACTIONS = {
+    "publish": publish_instances,
+    "unpublish": unpublish_instances,
+    "set_field": set_field_value,
+    "delete": delete_instances,
+    "migrate_field": migrate_field,
+    "reindex": reindex_instances,
+}
+
+
+# Running actions.
+
+def invalidate_instances(instance_list):
+    """Invalidates the cached responses for the instances, once for each model."""
+    if not cache.is_enabled():
+        return
+    dependencies = []
+    for model, model_instance_list in group_by_model(instance_list):
+        dependencies.append(("model", model.external_id))
+        dependencies.extend(
+            ("instance", model.external_id, instance.external_id)
+            for instance
+            in model_instance_list
+        )
+        dependencies.extend(cache.get_application_dependencies(cache.get_applications_for_model(model.pk)))
+    cache.invalidate(dependencies)
+
+
+def create_bulk_action(action, instance_ids, params=None, user=None, model_id=None):
+    """
+    Saves a bulk action on the given instances, to be run by the run_bulk_actions command.
+
+    Actions on the fields of a model record the model ID.
+    """
+    from data.models import BulkAction
+    if action not in ACTIONS:
+        raise ValueError("Unknown bulk action {action}.".format(
+            action = action,
+        ))
+    instance_ids = sorted(instance_ids)
+    return BulkAction.objects.create(
+        action = action,
+        params = params or {},
+        instance_ids = instance_ids,
+        instance_count = len(instance_ids),
+        user = user,
+        model_id = model_id,
+    )
+
+
+def create_reindex(model_id):
+    """
+    Queues a rebuild of the indexed field values and search documents of the instances
+    of a model, returning the bulk action, or None if the model has no instances.
+    """
+    from data.models import Instance
+    instance_ids = list(Instance.objects.filter(
+        model_id = model_id,
+    ).values_list("id", flat=True))
+    if not instance_ids:
+        return None
+    return create_bulk_action("reindex", instance_ids, model_id=model_id)
+
+
+def create_field_migration(previous_field, field):
+    """
+    Queues a migration of the instance data of a field that has been renamed or retyped,
+    returning the bulk action, or None if no migration is needed.
+    """
+    from data.models import Instance
+    if (previous_field.name, previous_field.type) == (field.name, field.type):
+        return None
+    return create_bulk_action("migrate_field", Instance.objects.filter(
+        model_id = field.model_id,
+    ).values_list("id", flat=True), {
+        "previous_name": previous_field.name,
+        "previous_type": previous_field.type,
+        "previous_type_params": previous_field.type_params,
+        "name": field.name,
+        "type": field.type,
+        "type_params": field.type_params,
+    }, model_id=field.model_id)
+
+
+def claim_bulk_action(resume=False):
+    """
+    Marks the oldest pending bulk action as running, and returns it, or None if no
+    actions are pending.
+
+    If resume is True, actions left running by an interrupted worker are also claimed.
+    """
+    from data.models import BulkAction
+    statuses = [BulkAction.STATUS_PENDING]
+    if resume:
+        statuses.append(BulkAction.STATUS_RUNNING)
+    for pk, status in BulkAction.objects.filter(status__in=statuses).order_by("id").values_list("id", "status"):
+        # Another worker may claim the same action.
+        if BulkAction.objects.filter(pk=pk, status=status).update(status=BulkAction.STATUS_RUNNING, date_modified=timezone.now()):
+            return BulkAction.objects.get(pk=pk)
+    return None
+
+
+def run_bulk_action(bulk_action, chunk_size=BULK_ACTION_CHUNK_SIZE):
+    """
+    Runs a claimed bulk action, starting after the instances already processed.
+
+    Yields the number of instances processed after each chunk. If the action fails,
+    it is marked as failed and the exception is raised.
+    """
+    from data.models import BulkAction, Instance
+    action_func = ACTIONS[bulk_action.action]
+    bulk_actions = BulkAction.objects.filter(pk=bulk_action.pk)
+    try:
+        while bulk_action.processed < len(bulk_action.instance_ids):
+            chunk_ids = bulk_action.instance_ids[bulk_action.processed:bulk_action.processed + chunk_size]
+            processed = bulk_action.processed + len(chunk_ids)
+            with transaction.atomic():
+                # Reload the params, which are updated by record_migrated_instance().
+                bulk_action.params = bulk_actions.select_for_update().get().params
+                # Instances deleted since the action was created are skipped.
+                instance_list = list(Instance.objects.filter(
+                    id__in = chunk_ids,
+                ).select_related("model").defer("published_data").order_by("id"))
+                changed_instance_list = action_func(instance_list, bulk_action.params)
+                # Actions can record their results in their params.
+                bulk_actions.update(
+                    processed = processed,
+                    params = bulk_action.params,
+                    date_modified = timezone.now(),
+                )
+            bulk_action.processed = processed
+            # Don't accumulate debug query logs over a large action.
+            reset_queries()
+            # Invalidate cached responses once for the chunk, after it has been committed.
+            invalidate_instances(changed_instance_list)
+            yield processed
+    except Exception:
+        bulk_action.status = BulkAction.STATUS_FAILED
+        bulk_action.error = traceback.format_exc()
+        bulk_actions.update(
+            status = bulk_action.status,
+            error = bulk_action.error,
+            date_modified = timezone.now(),
+        )
+        raise
+    bulk_action.status = BulkAction.STATUS_COMPLETE
+    bulk_actions.update(
+        status = bulk_action.status,
+        date_modified = timezone.now(),
+    )
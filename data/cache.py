@@ -0,0 +1,289 @@
+"""
+Server-side caching of API responses.
+
+Cached responses are keyed against a set of dependencies, such as a model or
+an application. Each dependency has a version stored in the cache, and saving
+or deleting a related object invalidates the version, so stale responses are
+never served.
+"""
+
+from __future__ import absolute_import
+
+import hashlib, threading, gzip, collections
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.signals import request_finished
+from django.db import connection
+
+from data import uuid
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+RESPONSE_TIMEOUT = 60 * 60 * 24
+
+
+def compress_gzip(content):
+    buf = BytesIO()
+    with gzip.GzipFile(mode="wb", compresslevel=9, fileobj=buf) as gzip_file:
+        gzip_file.write(content)
+    return buf.getvalue()
+
+
+def compress_brotli(content):
+    return brotli.compress(content)
+
+
+# Content encodings stored with cached responses, in order of preference.
+RESPONSE_ENCODINGS = collections.OrderedDict()
+if brotli is not None:
+    RESPONSE_ENCODINGS["br"] = compress_brotli
+RESPONSE_ENCODINGS["gzip"] = compress_gzip
+
+
+def get_response_encoding(request):
+    """Returns the preferred content encoding accepted by the request, or None."""
+    accepted_encodings = set()
+    for accepted_encoding in request.META.get("HTTP_ACCEPT_ENCODING", "").lower().split(","):
+        encoding, _, params = accepted_encoding.partition(";")
+        name, _, value = params.partition("=")
+        if name.strip() == "q":
+            try:
+                if float(value) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted_encodings.add(encoding.strip())
+    for encoding in RESPONSE_ENCODINGS:
+        if encoding in accepted_encodings:
+            return encoding
+    return None
+
+
+def is_enabled():
+    return getattr(settings, "DATA_RESPONSE_CACHE", None) is not None
+
+
+def get_response_cache():
+    """Returns the cache used for API responses, or None if response caching is disabled."""
+    if not is_enabled():
+        return None
+    return get_cache(settings.DATA_RESPONSE_CACHE)
+
+
+def get_response_max_size():
+    """Returns the maximum size of a cached response, or None if there is no limit."""
+    return getattr(settings, "DATA_RESPONSE_CACHE_MAX_SIZE", None)
+
+
+def make_key(*parts):
+    return "data:{hash}".format(
+        hash = hashlib.md5(u"\0".join(parts).encode("utf-8")).hexdigest(),
+    )
+
+
+def make_version_key(dependency):
+    return make_key(u"version", *dependency)
+
+
+def get_versions(response_cache, dependencies):
+    """Returns the current version of each of the given dependencies."""
+    keys = [make_version_key(dependency) for dependency in dependencies]
+    versions = response_cache.get_many(keys)
+    missing_versions = dict(
+        (key, uuid.generate())
+        for key
+        in keys
+        if key not in versions
+    )
+    if missing_versions:
+        response_cache.set_many(missing_versions, RESPONSE_TIMEOUT)
+        versions.update(missing_versions)
+    return [versions[key] for key in keys]
+
+
+def get_response_key(request, response_cache, dependencies):
+    """Returns the cache key for the response to the given request."""
+    return make_key(u"response", request.get_full_path(), *get_versions(response_cache, dependencies))
+
+
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified",)
+
+
+def get_encoded_key(key, encoding):
+    return "{key}:{encoding}".format(
+        key = key,
+        encoding = encoding,
+    )
+
+
+def get_encoded_headers(headers, encoding):
+    """
+    Returns the headers of a response compressed with the given encoding.
+
+    Each encoding has its own ETag, since the compressed content is different.
+    """
+    return [
+        (header, u'{etag}-{encoding}"'.format(etag=value[:-1], encoding=encoding) if header == "ETag" and value.endswith('"') else value)
+        for header, value
+        in headers
+    ] + [("Content-Encoding", encoding)]
+
+
+def get_cached_response(response_cache, key, encoding=None):
+    """
+    Returns a cached (status, headers, content) tuple for the given key, or None.
+
+    If an encoding is given, the response compressed with that encoding is
+    returned, if available.
+    """
+    if encoding is not None:
+        cached_response = response_cache.get(get_encoded_key(key, encoding))
+        if cached_response is not None:
+            return cached_response
+    return response_cache.get(key)
+
+
+def set_cached_response(response_cache, key, response):
+    """
+    Stores the response in the cache under the given key, along with a compressed
+    copy for each of the RESPONSE_ENCODINGS.
+
+    Streaming responses are stored once they have been sent to the client.
+    Responses larger than DATA_RESPONSE_CACHE_MAX_SIZE are not stored.
+
+    Returns a dict of {encoding: content} for the compressed copies of a
+    non-streaming response.
+    """
+    max_size = get_response_max_size()
+    headers = [
+        (header, response[header])
+        for header
+        in CACHED_HEADERS
+        if response.has_header(header)
+    ]
+    def do_set_cached_response(content):
+        encoded_contents = dict(
+            (encoding, compress(content))
+            for encoding, compress
+            in RESPONSE_ENCODINGS.iteritems()
+        )
+        cached_responses = dict(
+            (get_encoded_key(key, encoding), (response.status_code, get_encoded_headers(headers, encoding), encoded_content))
+            for encoding, encoded_content
+            in encoded_contents.iteritems()
+        )
+        cached_responses[key] = (response.status_code, headers, content)
+        response_cache.set_many(cached_responses, RESPONSE_TIMEOUT)
+        return encoded_contents
+    if response.streaming:
+        response.streaming_content = tee_streaming_content(response.streaming_content, max_size, do_set_cached_response)
+    elif max_size is None or len(response.content) <= max_size:
+        return do_set_cached_response(response.content)
+    return {}
+
+
+def tee_streaming_content(streaming_content, max_size, callback):
+    buf = []
+    buf_size = 0
+    for chunk in streaming_content:
+        if buf is not None:
+            buf.append(chunk)
+            buf_size += len(chunk)
+            if max_size is not None and buf_size > max_size:
+                buf = None
+        yield chunk
+    if buf is not None:
+        callback("".join(buf))
+
+
+# Dependencies.
+
+def get_application_dependencies(application_external_ids):
+    return [
+        ("application", application_external_id)
+        for application_external_id
+        in application_external_ids
+    ]
+
+
+def get_applications(application_ids):
+    from data.models import Application
+    return Application.objects.filter(
+        id__in = application_ids,
+    ).values_list("external_id", flat=True)
+
+
+def get_applications_for_model(model_id):
+    from data.models import Application
+    return Application.objects.filter(
+        model__id = model_id,
+    ).values_list("external_id", flat=True)
+
+
+def get_dependencies(obj):
+    """Returns the cache dependencies invalidated by a change to the given object."""
+    from data.models import Application, Model, Field, Instance
+    if isinstance(obj, Application):
+        return get_application_dependencies((obj.external_id,))
+    if isinstance(obj, Model):
+        return [
+            ("model", obj.external_id),
+            ("schema", obj.external_id),
+        ] + get_application_dependencies(get_applications_for_model(obj.pk))
+    if isinstance(obj, Field):
+        model = Model.objects.filter(pk=obj.model_id).first()
+        if model is None:
+            return []
+        return get_dependencies(model)
+    if isinstance(obj, Instance):
+        model_external_id = Model.objects.filter(pk=obj.model_id).values_list("external_id", flat=True).first()
+        if model_external_id is None:
+            return []
+        return [
+            ("model", model_external_id),
+            ("instance", model_external_id, obj.external_id),
+        ] + get_application_dependencies(get_applications_for_model(obj.model_id))
+    raise TypeError("Unexpected object {obj!r}.".format(
+        obj = obj,
+    ))
+
+
+# Invalidation.
+
+pending_invalidations = threading.local()
+
+
+def invalidate(dependencies):
+    """
+    Invalidates all cached responses for the given dependencies.
+
+    If called within a transaction, the dependencies are invalidated again at the
+    end of the request, so that responses cached before the transaction
+    committed are not served.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return
+    keys = [make_version_key(dependency) for dependency in dependencies]
+    response_cache.delete_many(keys)
+    if connection.in_atomic_block:
+        if not hasattr(pending_invalidations, "keys"):
+            pending_invalidations.keys = set()
+        pending_invalidations.keys.update(keys)
+
+
+def invalidate_pending(**kwargs):
+    keys = getattr(pending_invalidations, "keys", None)
+    if keys:
+        del pending_invalidations.keys
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response_cache.delete_many(list(keys))
+
+request_finished.connect(invalidate_pending)
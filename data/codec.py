@@ -0,0 +1,85 @@
+"""
+Encoding and decoding of JSON data.
+
+The JSON library is configured by the DATA_JSON_CODEC setting. The standard
+library json module is used by default, but faster C-backed libraries can be
+used when they are installed.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+DEFAULT_CODEC = "json"
+
+
+class Codec(object):
+
+    """A JSON library, wrapped to produce compact output."""
+
+    def __init__(self, name):
+        self.name = name
+        self.module = importlib.import_module(name)
+
+    def dumps(self, data):
+        return self.module.dumps(data, separators=(",", ":"))
+
+    def loads(self, value):
+        return self.module.loads(value)
+
+
+class UltraJsonCodec(Codec):
+
+    def dumps(self, data):
+        return self.module.dumps(data, escape_forward_slashes=False)
+
+
+CODECS = {
+    "json": Codec,
+    "simplejson": Codec,
+    "ujson": UltraJsonCodec,
+}
+
+
+def load_codec(name):
+    """Loads the named codec, raising ImportError if its library is not installed."""
+    try:
+        codec_cls = CODECS[name]
+    except KeyError:
+        raise ImproperlyConfigured("Unknown JSON codec {name!r}. Available codecs are {codecs}.".format(
+            name = name,
+            codecs = ", ".join(sorted(CODECS)),
+        ))
+    return codec_cls(name)
+
+
+_codecs = {}
+
+
+def get_codec():
+    """Returns the codec configured by DATA_JSON_CODEC."""
+    name = getattr(settings, "DATA_JSON_CODEC", DEFAULT_CODEC)
+    codec = _codecs.get(name)
+    if codec is None:
+        try:
+            codec = _codecs[name] = load_codec(name)
+        except ImportError as ex:
+            raise ImproperlyConfigured("Could not load JSON codec {name!r}: {ex}".format(
+                name = name,
+                ex = ex,
+            ))
+    return codec
+
+
+def dumps(data):
+    """Encodes the data as a compact JSON string."""
+    return get_codec().dumps(data)
+
+
+def loads(value):
+    """Decodes a JSON string."""
+    return get_codec().loads(value)
@@ -0,0 +1,175 @@
+"""
+Bulk export of published instances to JSON lines and CSV files.
+
+Instances are loaded using the published instance set of the API views, in
+chunks ordered by ID, and written incrementally, so memory use does not grow
+with the size of the export.
+"""
+
+import csv, gzip, os
+from multiprocessing import Pool
+
+from django.db import connection, reset_queries
+from django.http import Http404
+
+from data import codec
+
+
+# The number of instances loaded in each query.
+EXPORT_CHUNK_SIZE = 1000
+
+
+# Targets.
+
+def get_export_view(target):
+    """
+    Returns the API view for an export target, which is either a model ID, or an
+    application ID prefixed by "a/".
+
+    Raises Http404 if the model or application does not exist, or is offline.
+    """
+    from data.views import ApplicationInstanceListView, InstanceListView
+    if target.startswith("a/"):
+        view = ApplicationInstanceListView(kwargs={"application_external_id": target[2:]})
+        view.application
+    else:
+        view = InstanceListView(kwargs={"model_external_id": target})
+        view.model
+    return view
+
+
+def get_export_file_name(target, format, compress):
+    """Returns the file name of an export target."""
+    return u"{name}.{format}{extension}".format(
+        name = target.replace("/", "-"),
+        format = format,
+        extension = ".gz" if compress else "",
+    )
+
+
+def iter_published_data(instance_set, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the published JSON of each instance in the instance set, loading instances in chunks ordered by ID."""
+    instance_set = instance_set.order_by("id")
+    last_pk = None
+    while True:
+        chunk = instance_set
+        if last_pk is not None:
+            chunk = chunk.filter(id__gt=last_pk)
+        row_count = 0
+        for published_data, _, _, pk in chunk[:chunk_size].iterator():
+            yield published_data
+            last_pk = pk
+            row_count += 1
+        reset_queries()
+        if row_count < chunk_size:
+            break
+
+
+# Writers.
+
+def write_jsonl(out, published_data_list, field_names):
+    """Writes the published JSON of each instance as a line, returning the number of instances written."""
+    count = 0
+    for published_data in published_data_list:
+        out.write(published_data)
+        out.write("\n")
+        count += 1
+    return count
+
+
+META_FIELD_NAMES = ("_id", "_model", "_date_created", "_date_modified",)
+
+
+def format_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    # Multiple instance IDs are separated by commas, as accepted by the import_instances command.
+    if isinstance(value, (list, tuple)):
+        return u",".join(value).encode("utf-8")
+    return unicode(value).encode("utf-8")
+
+
+def write_csv(out, published_data_list, field_names):
+    """Writes the published data of each instance as a UTF-8 CSV row, returning the number of instances written."""
+    column_names = list(META_FIELD_NAMES) + list(field_names)
+    writer = csv.writer(out)
+    writer.writerow([column_name.encode("utf-8") for column_name in column_names])
+    count = 0
+    for published_data in published_data_list:
+        instance_data = codec.loads(published_data)
+        writer.writerow([
+            format_csv_value(instance_data.get(column_name))
+            for column_name
+            in column_names
+        ])
+        count += 1
+    return count
+
+
+WRITERS = {
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+}
+
+
+# Export.
+
+def export_instances(target, path, format, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Exports the published instances of a model or application to a file, returning the
+    number of instances written.
+
+    The file is written to a temporary path and renamed when complete, so a partial
+    export never replaces a previous one.
+    """
+    view = get_export_view(target)
+    # Fields shared between models of an application are written once.
+    field_names = []
+    for field_name in view.get_field_set().values_list("name", flat=True):
+        if field_name not in field_names:
+            field_names.append(field_name)
+    temp_path = path + ".tmp"
+    with (gzip.open if compress else open)(temp_path, "wb") as out:
+        count = WRITERS[format](out, iter_published_data(view.get_instance_set(), chunk_size), field_names)
+    os.rename(temp_path, path)
+    return count
+
+
+def export_target(args):
+    """Exports a target for export_many(), returning a (target, count, error) tuple."""
+    try:
+        return args[0], export_instances(*args), None
+    except Http404:
+        return args[0], 0, "Unknown target {target}.".format(
+            target = args[0],
+        )
+
+
+def export_many(targets, output_dir, format, compress=False, chunk_size=EXPORT_CHUNK_SIZE, processes=1):
+    """
+    Exports each target to a file in the output directory, yielding (target, count, error)
+    tuples as each export completes.
+
+    With more than one process, targets are exported in parallel, each with its own
+    database connection.
+    """
+    export_args = [
+        (target, os.path.join(output_dir, get_export_file_name(target, format, compress)), format, compress, chunk_size)
+        for target
+        in targets
+    ]
+    if processes > 1:
+        # Forked processes must not share the database connection.
+        connection.close()
+        pool = Pool(processes)
+        try:
+            for result in pool.imap_unordered(export_target, export_args):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for args in export_args:
+            yield export_target(args)
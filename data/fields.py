@@ -52,6 +52,72 @@ class Field(object):
         """
         return value
 
+    def clean(self, value, form_field):
+        """
+        Validates a json value, returning its canonical json representation.
+
+        The form_field is returned by form_field(), and can be reused between values.
+        Raises ValidationError if the value is invalid.
+        """
+        try:
+            python_value = self.deserialize(value)
+        except (TypeError, ValueError):
+            python_value = None
+        if value is not None and python_value is None:
+            raise ValidationError("Enter a valid value.")
+        return self.serialize(form_field.clean(python_value))
+
+    def get_references(self, value):
+        """
+        Returns the objects referenced by the json value, as (kind, group, key) tuples.
+
+        Referenced objects are loaded in bulk by deserialize_many(). See load_references()
+        for the supported kinds.
+        """
+        return ()
+
+    def deserialize_references(self, value, references):
+        """
+        Unserializes the value from a json representation, using a dict of referenced
+        objects keyed by (kind, group, key).
+        """
+        return self.deserialize(value)
+
+    def parse_query_value(self, value):
+        """
+        Parses a string supplied in an API query into a json representation.
+
+        Raises ValidationError if the string is not a valid value.
+        """
+        return self.serialize(self.form_field(required=False).clean(value))
+
+    def parse_text_value(self, value):
+        """
+        Parses a string supplied in a text import format, such as a CSV column, into a
+        json representation. An empty string is no value.
+
+        Raises ValidationError if the string is not a valid value.
+        """
+        if value == "":
+            return None
+        return self.parse_query_value(value)
+
+    # The FieldValue column used to index values of this field, or None if the field is not indexed.
+    index_column = "text_value"
+
+    # Whether values of this field are included in full-text search.
+    searchable = False
+
+    def index_value(self, value):
+        """Converts a json value into a value for the index column."""
+        return value
+
+    def get_index_values(self, value):
+        """Returns the index column values for a json value of this field."""
+        if value is None:
+            return []
+        return [self.index_value(value)]
+
 
 class RequiredFieldMixin(object):
 
@@ -66,7 +132,7 @@ class RequiredFieldMixin(object):
         type_params["required"] = required
         return type_params
 
-    def __init__(self, required, **type_params):
+    def __init__(self, required=True, **type_params):
         self.required = required
         super(RequiredFieldMixin, self).__init__(**type_params)
 
@@ -120,21 +186,52 @@ class TextField(RequiredFieldMixin, ChoiceFieldMixin, Field):
 
     widget = AdminTextInputWidget
 
+    searchable = True
+
+    def clean(self, value, form_field):
+        # Avoid the form field for values that are already valid.
+        if self.choices is None and isinstance(value, unicode) and value:
+            return value
+        return super(TextField, self).clean(value, form_field)
+
 
 class LongTextField(RequiredFieldMixin, Field):
 
     widget = AdminTextareaWidget
 
+    index_column = None
+
+    searchable = True
+
+    def clean(self, value, form_field):
+        if isinstance(value, unicode) and value:
+            return value
+        return super(LongTextField, self).clean(value, form_field)
+
 
 class IntegerField(RequiredFieldMixin, ChoiceFieldMixin, Field):
 
     form_class = forms.IntegerField
 
+    index_column = "number_value"
+
+    def clean(self, value, form_field):
+        if self.choices is None and type(value) in (int, long):
+            return value
+        return super(IntegerField, self).clean(value, form_field)
+
 
 class FloatField(RequiredFieldMixin, Field):
 
     form_class = forms.FloatField
 
+    index_column = "number_value"
+
+    def clean(self, value, form_field):
+        if type(value) in (int, long, float):
+            return float(value)
+        return super(FloatField, self).clean(value, form_field)
+
 
 class DateField(RequiredFieldMixin, Field):
 
@@ -176,6 +273,11 @@ class DateTimeField(RequiredFieldMixin, Field):
 
     widget = AdminSplitDateTime
 
+    index_column = "datetime_value"
+
+    def index_value(self, value):
+        return dateparse.parse_datetime(value)
+
     @ignores_none
     def deserialize(self, value):
         value = super(DateTimeField, self).deserialize(value)
@@ -191,6 +293,13 @@ class BooleanField(Field):
 
     form_class = forms.BooleanField
 
+    index_column = "number_value"
+
+    def clean(self, value, form_field):
+        if value is True:
+            return value
+        return super(BooleanField, self).clean(value, form_field)
+
     def form_field(self, **kwargs):
         kwargs.setdefault("required", False)
         return super(BooleanField, self).form_field(**kwargs)
@@ -221,25 +330,36 @@ class FileField(RequiredFieldMixin, Field):
         # All done!
         return super(FileField, self).form_field(**kwargs)
 
-    @ignores_none
-    def deserialize(self, value):
+    def get_file_name(self, value):
         from data.models import File
-        value = super(FileField, self).deserialize(value)
         storage = File._meta.get_field("file").storage
         root = storage.url("")
-        try:
-            # HACK: Converting a stored URL into a file name.
-            # Not elegant, but allows a denormalized file to be
-            # stored in the JSON.
-            return File.objects.filter(file=value[len(root):])[0]
-        except IndexError:
+        # HACK: Converting a stored URL into a file name.
+        # Not elegant, but allows a denormalized file to be
+        # stored in the JSON.
+        return value[len(root):]
+
+    def get_references(self, value):
+        if value is None:
+            return ()
+        return (("file", None, self.get_file_name(value)),)
+
+    def deserialize_references(self, value, references):
+        if value is None:
             return None
+        return references.get(("file", None, self.get_file_name(value)))
+
+    def deserialize(self, value):
+        return deserialize_many(((self, value),))[0]
 
     @ignores_none
     def serialize(self, value):
         value = super(FileField, self).serialize(value)
         return value.file.url
 
+    def parse_query_value(self, value):
+        return value
+
 
 # Relations.
 
@@ -305,16 +425,21 @@ class ModelField(RequiredFieldMixin, Field):
     def serialize(self, value):
         return super(ModelField, self).serialize(value.external_id)
 
-    @ignores_none
-    def deserialize(self, value):
-        from data.models import Instance
-        try:
-            return Instance.objects.get(
-                model_id = self.model_id,
-                external_id = super(ModelField, self).deserialize(value),
-            )
-        except Instance.DoesNotExist:
+    def get_references(self, value):
+        if value is None:
+            return ()
+        return (("instance", self.model_id, value),)
+
+    def deserialize_references(self, value, references):
+        if value is None:
             return None
+        return references.get(("instance", self.model_id, value))
+
+    def deserialize(self, value):
+        return deserialize_many(((self, value),))[0]
+
+    def parse_query_value(self, value):
+        return value
 
 
 class MultiModelField(ModelField):
@@ -323,12 +448,86 @@ class MultiModelField(ModelField):
 
     widget = ManyToManyRawIdWidget
 
-    def deserialize(self, value):
-        return filter(None, map(super(MultiModelField, self).deserialize, value or ()))
+    def get_references(self, value):
+        return [("instance", self.model_id, item) for item in value or ()]
+
+    def deserialize_references(self, value, references):
+        return filter(None, (references.get(("instance", self.model_id, item)) for item in value or ()))
 
     def serialize(self, value):
         return filter(None, map(super(MultiModelField, self).serialize, value or ()))
 
+    def get_index_values(self, value):
+        return [self.index_value(item) for item in value or ()]
+
+    def parse_text_value(self, value):
+        # Multiple instance IDs are separated by commas.
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# The maximum number of references loaded in a single query.
+DESERIALIZE_CHUNK_SIZE = 500
+
+
+def load_references(kind, group, keys):
+    """
+    Loads referenced objects, returning (key, obj) pairs.
+
+    The "instance" kind loads instances of the model with ID group by external ID, and
+    the "file" kind loads files by file name.
+    """
+    from data.models import File, Instance
+    keys = list(keys)
+    for index in xrange(0, len(keys), DESERIALIZE_CHUNK_SIZE):
+        chunk = keys[index:index + DESERIALIZE_CHUNK_SIZE]
+        if kind == "instance":
+            for instance in Instance.objects.filter(model_id=group, external_id__in=chunk):
+                yield instance.external_id, instance
+        elif kind == "file":
+            for file in File.objects.filter(file__in=chunk):
+                yield file.file.name, file
+        else:
+            raise ValueError("Unknown reference kind {kind!r}.".format(
+                kind = kind,
+            ))
+
+
+def load_many_references(field_values):
+    """
+    Loads the objects referenced by a list of (field_implementation, value) pairs, as
+    a dict keyed by (kind, group, key).
+
+    Objects referenced by relation and file fields are loaded with one query for each
+    referenced model, and one query for all files.
+    """
+    # Collect the referenced keys for each kind and group.
+    keys = collections.defaultdict(set)
+    for field_implementation, value in field_values:
+        for kind, group, key in field_implementation.get_references(value):
+            keys[(kind, group)].add(key)
+    # Load the referenced objects.
+    references = {}
+    for (kind, group), group_keys in keys.iteritems():
+        for key, obj in load_references(kind, group, group_keys):
+            references[(kind, group, key)] = obj
+    return references
+
+
+def deserialize_many(field_values):
+    """
+    Unserializes a list of (field_implementation, value) pairs from their json representations.
+
+    Referenced objects are loaded in bulk by load_many_references().
+    """
+    field_values = list(field_values)
+    references = load_many_references(field_values)
+    # Unserialize the values.
+    return [
+        field_implementation.deserialize_references(value, references)
+        for field_implementation, value
+        in field_values
+    ]
+
 
 fields = collections.OrderedDict((
     ("text", TextField),
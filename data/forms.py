@@ -1,12 +1,12 @@
-import collections
-
 from django import forms
 from django.forms.models import ModelFormMetaclass, ModelForm, ErrorList
 from django.utils.encoding import force_text
 from django.utils.functional import cached_property
 
-from data.models import Instance, Field
+from data.models import Model, Instance, Field
 from data.fields import fields
+from data.schema import get_schema
+from data.bulk import migrate_instance
 
 
 class FieldForm(ModelForm):
@@ -33,20 +33,39 @@ def form_name_for_field(field):
 
 class InstanceFormBase(ModelForm):
 
+    @classmethod
+    def deserialize_instance_data_list(cls, instance_list):
+        """
+        Returns the initial form data for each of the given instances.
+
+        Instances referenced by relation fields are loaded in bulk for all instances.
+        """
+        return [
+            dict(
+                (form_name_for_field(field), python_values[field.name])
+                for field, _
+                in cls._field_implementations
+            )
+            for python_values
+            in cls._schema.deserialize_many(instance.data for instance in instance_list)
+        ]
+
     @classmethod
     def deserialize_instance_data(cls, instance):
-        instance_data = instance.data
-        return dict(
-            (form_name_for_field(field), field_implementation.deserialize(instance_data.get(field.name, None)))
-            for field, field_implementation
-            in cls._field_implementations
-        )
+        return cls.deserialize_instance_data_list((instance,))[0]
 
     def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
                  initial=None, error_class=ErrorList, label_suffix=':',
-                 empty_permitted=False, instance=None):
+                 empty_permitted=False, instance=None, model=None):
+        # The form class is shared between requests, so the model is passed in for each form.
+        if model is None:
+            model = Model.objects.get(pk=self._schema.model_id)
+        self._model = model
         # Set the initial.
         if instance:
+            # Edit the data as it will be after any pending field migrations.
+            if instance.pk is not None:
+                migrate_instance(instance)
             initial = initial or {}
             initial.update(self.deserialize_instance_data(instance))
         # All done!
@@ -54,11 +73,11 @@ class InstanceFormBase(ModelForm):
 
     @cached_property
     def instance_data(self):
-        return collections.OrderedDict(
-            (field.name, field_implementation.serialize(self.cleaned_data.get(form_name_for_field(field))))
-            for field, field_implementation
+        return self._schema.serialize(dict(
+            (field.name, self.cleaned_data.get(form_name_for_field(field)))
+            for field, _
             in self._field_implementations
-        )
+        ))
 
     def clean(self):
         data = self.cleaned_data
@@ -81,7 +100,7 @@ class InstanceFormBase(ModelForm):
 
     def save(self, commit=True):
         instance = super(InstanceFormBase, self).save(commit=False)
-        instance.model = self._model
+        instance.model_id = self._model.pk
         # Set the instance data.
         instance_data = self.instance_data
         instance.name = force_text(next(iter(instance_data.values()), instance.external_id))
@@ -97,16 +116,28 @@ class InstanceFormBase(ModelForm):
         model = Instance
 
 
+# The cached form classes, keyed by (model ID, schema version, base form).
+form_classes = {}
+
+
 def form_for_model(model, base_form=InstanceFormBase):
-    # Instantiate all field implementations.
-    field_implementations = [
-        (field, field.get_field_implementation())
-        for field
-        in model.field_set.all()
-    ]
+    """
+    Returns the instance form class for a model, which is cached until the schema of the model changes.
+
+    The form class is shared by every version of the model with the same schema, so
+    forms should be created with the current model as their model argument. Otherwise,
+    the model is loaded by each form.
+    """
+    form_class_key = (model.pk, model.schema_version, base_form)
+    form_class = form_classes.get(form_class_key)
+    if form_class is not None:
+        return form_class
+    # Load the compiled field implementations.
+    schema = get_schema(model)
+    field_implementations = schema.field_implementations
     # Start creating the form.
     form_attrs = {
-        "_model": model,
+        "_schema": schema,
         "_field_implementations": field_implementations,
     }
     # Assemble the fields.
@@ -116,4 +147,10 @@ def form_for_model(model, base_form=InstanceFormBase):
         }
         form_attrs[form_name_for_field(field)] = field_impl.form_field(**field_kwargs)
     # Create the form class.
-    return ModelFormMetaclass("InstanceForm", (base_form,), form_attrs)
+    form_class = ModelFormMetaclass("InstanceForm", (base_form,), form_attrs)
+    # Evict the form classes of previous schema versions. The cache is shared between threads.
+    for key in list(form_classes):
+        if key[0] == model.pk and key[2] is base_form:
+            form_classes.pop(key, None)
+    form_classes[(model.pk, schema.version, base_form)] = form_class
+    return form_class
@@ -0,0 +1,222 @@
+"""
+Bulk import of instances from JSON lines and CSV files.
+
+Each row is validated and serialized by the compiled schema of the model, and
+instances are created or updated by external ID in chunks. Each chunk is saved
+in a single transaction, with the published data, field value index, search
+documents and publications of its instances updated in bulk.
+"""
+
+import collections, csv
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction, reset_queries
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from data.schema import get_schema
+from data import uuid, cache, codec, index, publication, search
+
+
+# The number of rows saved in each transaction.
+IMPORT_CHUNK_SIZE = 500
+
+
+# Readers.
+
+def read_jsonl(lines):
+    """Parses lines of JSON objects, yielding (line_number, values) pairs."""
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            values = codec.loads(line)
+        except ValueError:
+            values = None
+        if not isinstance(values, dict):
+            values = ValidationError("Enter a JSON object.")
+        yield line_number, values
+
+
+def read_csv(lines, field_list):
+    """
+    Parses UTF-8 CSV with a header row of field names, yielding (line_number, values)
+    pairs of json values.
+
+    Invalid values are yielded as a ValidationError.
+    """
+    field_implementations = dict(
+        (field.name, field.get_field_implementation())
+        for field
+        in field_list
+    )
+    reader = csv.reader(lines)
+    header = [force_text(name) for name in next(reader, ())]
+    for row in reader:
+        try:
+            values = {}
+            for name, value in zip(header, row):
+                value = force_text(value)
+                if name == "_id":
+                    values[name] = value
+                elif name in field_implementations:
+                    try:
+                        values[name] = field_implementations[name].parse_text_value(value)
+                    except ValidationError as ex:
+                        raise ValidationError(u"{name}: {message}".format(
+                            name = name,
+                            message = u" ".join(ex.messages),
+                        ))
+        except ValidationError as ex:
+            values = ex
+        yield reader.line_num, values
+
+
+READERS = {
+    "jsonl": lambda lines, field_list: read_jsonl(lines),
+    "csv": read_csv,
+}
+
+
+# Import.
+
+def get_instance_name(instance_data, external_id):
+    """Returns the instance name for the instance data, as set by the instance admin form."""
+    return force_text(next(iter(instance_data.values()), external_id))[:200]
+
+
+def update_instances(instance_list, field_names):
+    """Saves the given fields of the instances, using a single batched UPDATE statement."""
+    from data.models import Instance
+    if not instance_list:
+        return
+    fields = [Instance._meta.get_field(field_name) for field_name in field_names]
+    quote_name = connection.ops.quote_name
+    connection.cursor().executemany(
+        "UPDATE {table} SET {assignments} WHERE {pk} = %s".format(
+            table = quote_name(Instance._meta.db_table),
+            assignments = ", ".join("{column} = %s".format(column=quote_name(field.column)) for field in fields),
+            pk = quote_name(Instance._meta.pk.column),
+        ),
+        [
+            [field.get_db_prep_save(getattr(instance, field.attname), connection=connection) for field in fields] + [instance.pk]
+            for instance
+            in instance_list
+        ],
+    )
+
+
+def import_chunk(model, schema, rows):
+    """
+    Saves a chunk of (line_number, values) rows as instances of the model.
+
+    Returns a tuple of (created_external_ids, updated_external_ids, errors).
+    """
+    from data.models import Instance
+    # Load the objects referenced by the chunk.
+    references = schema.get_references(values for _, values in rows if isinstance(values, dict))
+    # Validate the rows. Later rows for the same external ID take precedence.
+    errors = []
+    instance_data_list = collections.OrderedDict()
+    for line_number, values in rows:
+        if isinstance(values, ValidationError):
+            errors.append((line_number, u" ".join(values.messages)))
+            continue
+        try:
+            instance_data = schema.clean(values, references)
+        except ValidationError as ex:
+            errors.append((line_number, u" ".join(ex.messages)))
+            continue
+        external_id = force_text(values.get("_id") or uuid.generate())
+        instance_data_list[external_id] = instance_data
+    # Update existing instances.
+    instance_list = []
+    date_modified = timezone.now()
+    for external_id, pk, date_created, is_online in Instance.objects.filter(
+        model = model,
+        external_id__in = list(instance_data_list.keys()),
+    ).values_list("external_id", "id", "date_created", "is_online"):
+        instance_data = instance_data_list.pop(external_id)
+        instance_list.append(Instance(
+            id = pk,
+            model = model,
+            external_id = external_id,
+            name = get_instance_name(instance_data, external_id),
+            is_online = is_online,
+            date_created = date_created,
+            date_modified = date_modified,
+            data = instance_data,
+        ))
+    updated_external_ids = [instance.external_id for instance in instance_list]
+    for instance in instance_list:
+        instance.published_data = codec.dumps(instance.get_published_data())
+    update_instances(instance_list, ("name", "data", "published_data", "date_modified"))
+    # Create new instances.
+    created_external_ids = list(instance_data_list.keys())
+    Instance.objects.bulk_create([
+        Instance(
+            model = model,
+            external_id = external_id,
+            name = get_instance_name(created_instance_data, external_id),
+            data = created_instance_data,
+        )
+        for external_id, created_instance_data
+        in instance_data_list.iteritems()
+    ])
+    created_instance_list = []
+    for pk, external_id, is_online, date_created, date_modified in Instance.objects.filter(
+        model = model,
+        external_id__in = created_external_ids,
+    ).values_list("id", "external_id", "is_online", "date_created", "date_modified"):
+        instance = Instance(
+            id = pk,
+            model = model,
+            external_id = external_id,
+            is_online = is_online,
+            date_created = date_created,
+            date_modified = date_modified,
+            data = instance_data_list[external_id],
+        )
+        instance.published_data = codec.dumps(instance.get_published_data())
+        created_instance_list.append(instance)
+    update_instances(created_instance_list, ("published_data",))
+    instance_list.extend(created_instance_list)
+    # Update the indexes of the saved instances.
+    index.update_instances(instance_list, schema.field_list)
+    search.update_instances(instance_list, schema.field_list)
+    publication.update_instances(model, instance_list)
+    # All done!
+    return created_external_ids, updated_external_ids, errors
+
+
+def import_instances(model, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports (line_number, values) rows as instances of the model, creating or updating
+    instances by the external ID in the "_id" value. Rows without an "_id" are created
+    with a new external ID.
+
+    Yields a (created, updated, errors) tuple for each chunk of rows, where errors is a
+    list of (line_number, message) for rows that were not imported.
+    """
+    schema = get_schema(model)
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        with transaction.atomic():
+            created, updated, errors = import_chunk(model, schema, chunk)
+        # Don't accumulate debug query logs over a large import.
+        reset_queries()
+        # Invalidate cached responses once for the chunk, after it has been committed.
+        if cache.is_enabled():
+            cache.invalidate([
+                ("model", model.external_id),
+            ] + [
+                ("instance", model.external_id, external_id)
+                for external_id
+                in created + updated
+            ] + cache.get_application_dependencies(cache.get_applications_for_model(model.pk)))
+        yield len(created), len(updated), errors
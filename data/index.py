@@ -0,0 +1,156 @@
+"""
+Secondary index of instance field values.
+
+Each indexed value of an instance is stored as a FieldValue row, in a typed
+column chosen by the field implementation, so that instances can be filtered
+by field value in the database rather than by decoding their data.
+"""
+
+import re, operator
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# The maximum length of a text value stored in the index. Longer values are recorded without an index value.
+INDEX_TEXT_MAX_LENGTH = 255
+
+
+# Matches where[<field>] and where[<field>][<lookup>] query parameters.
+WHERE_PARAM_RE = re.compile(r"^where\[(.+?)\](?:\[(gt|gte|lt|lte)\])?$")
+
+
+def get_field_values(instance, field_list):
+    """Returns unsaved FieldValue rows for the instance data, using the given fields of its model."""
+    from data.models import FieldValue
+    field_values = []
+    for field in field_list:
+        field_implementation = field.get_field_implementation()
+        if field_implementation.index_column is None:
+            continue
+        for index_value in field_implementation.get_index_values(instance.data.get(field.name)):
+            field_value = FieldValue(
+                instance_id = instance.pk,
+                model_id = instance.model_id,
+                field_name = field.name,
+            )
+            # Values too long to index are recorded without an index value, so they
+            # aren't matched by a query for instances without a value.
+            if field_implementation.index_column != "text_value" or len(index_value) <= INDEX_TEXT_MAX_LENGTH:
+                setattr(field_value, field_implementation.index_column, index_value)
+            field_values.append(field_value)
+    return field_values
+
+
+def update_instance(instance):
+    """Replaces the indexed field values of the instance."""
+    from data.models import Field, FieldValue
+    FieldValue.objects.filter(instance_id=instance.pk).delete()
+    FieldValue.objects.bulk_create(get_field_values(instance, Field.objects.filter(model_id=instance.model_id)))
+
+
+def update_instances(instance_list, field_list):
+    """Replaces the indexed field values of the given instances, using the given fields of their model."""
+    from data.models import FieldValue
+    FieldValue.objects.filter(instance_id__in=[instance.pk for instance in instance_list]).delete()
+    field_values = []
+    for instance in instance_list:
+        field_values.extend(get_field_values(instance, field_list))
+    FieldValue.objects.bulk_create(field_values)
+
+
+def remove_field(field):
+    """Removes the indexed values of a deleted field."""
+    from data.models import FieldValue
+    FieldValue.objects.filter(
+        model_id = field.model_id,
+        field_name = field.name,
+    ).delete()
+
+
+def parse_filters(params, field_set):
+    """
+    Parses the where[<field>] and where[<field>][<lookup>] parameters into filters.
+
+    The field_set is only evaluated if a where parameter is present.
+
+    The filters are a dict of {model_id: [(field_name, index_column, lookup, index_value), ...]}.
+    Raises ValidationError if a parameter is invalid.
+    """
+    filters = {}
+    field_list = None
+    for param, value in params.iteritems():
+        match = WHERE_PARAM_RE.match(param)
+        if not match:
+            continue
+        field_name, lookup = match.groups()
+        if field_list is None:
+            field_list = list(field_set)
+        field_list_for_name = [field for field in field_list if field.name == field_name]
+        if not field_list_for_name:
+            raise ValidationError(u"Unknown field '{field_name}' in parameter '{param}'.".format(
+                field_name = field_name,
+                param = param,
+            ))
+        for field in field_list_for_name:
+            field_implementation = field.get_field_implementation()
+            if field_implementation.index_column is None:
+                raise ValidationError(u"Field '{field_name}' cannot be used in parameter '{param}'.".format(
+                    field_name = field_name,
+                    param = param,
+                ))
+            try:
+                query_value = field_implementation.parse_query_value(value)
+            except ValidationError as ex:
+                raise ValidationError(u"Invalid value for parameter '{param}': {message}".format(
+                    param = param,
+                    message = u" ".join(ex.messages),
+                ))
+            if query_value is None:
+                if lookup:
+                    raise ValidationError(u"Invalid value for parameter '{param}': This field is required.".format(
+                        param = param,
+                    ))
+                index_value = None
+            else:
+                index_value = field_implementation.index_value(query_value)
+            if field_implementation.index_column == "text_value" and index_value is not None and len(index_value) > INDEX_TEXT_MAX_LENGTH:
+                raise ValidationError(u"Invalid value for parameter '{param}': Ensure this value has at most {max_length} characters.".format(
+                    param = param,
+                    max_length = INDEX_TEXT_MAX_LENGTH,
+                ))
+            filters.setdefault(field.model_id, []).append((field_name, field_implementation.index_column, lookup or "exact", index_value))
+    return filters
+
+
+def filter_instances(queryset, filters):
+    """
+    Filters an instance queryset to the instances matching all filters for their model.
+
+    Instances of models without filters are excluded. Each filter is an indexed
+    subquery against the FieldValue table. A null value matches instances without
+    a value for the field.
+    """
+    from data.models import FieldValue
+    if not filters:
+        return queryset
+    model_qs = []
+    for model_id, model_filters in filters.iteritems():
+        model_q = Q(model_id=model_id)
+        for field_name, index_column, lookup, index_value in model_filters:
+            field_values = FieldValue.objects.filter(
+                model_id = model_id,
+                field_name = field_name,
+            )
+            # A null query value matches instances without a value for the field.
+            if index_value is None:
+                model_q &= ~Q(id__in=field_values.values("instance_id"))
+            else:
+                model_q &= Q(id__in=field_values.filter(**{
+                    "{index_column}__{lookup}".format(
+                        index_column = index_column,
+                        lookup = lookup,
+                    ): index_value,
+                }).values("instance_id"))
+        model_qs.append(model_q)
+    return queryset.filter(reduce(operator.or_, model_qs))
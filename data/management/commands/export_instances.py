@@ -0,0 +1,67 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data import exporter
+
+
+class Command(BaseCommand):
+
+    args = "<model_id or a/application_id> ..."
+
+    help = "Exports the published instances of models and applications to JSON lines or CSV files."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format",
+            choices = sorted(exporter.WRITERS.keys()),
+            default = "jsonl",
+            help = "The file format.",
+        ),
+        make_option("--output-dir",
+            default = ".",
+            help = "The directory to write the files to.",
+        ),
+        make_option("--gzip",
+            action = "store_true",
+            default = False,
+            help = "Compress the files using gzip.",
+        ),
+        make_option("--parallel",
+            type = "int",
+            default = 1,
+            help = "The number of models or applications to export at the same time.",
+        ),
+        make_option("--chunk-size",
+            type = "int",
+            default = exporter.EXPORT_CHUNK_SIZE,
+            help = "The number of instances loaded in each query.",
+        ),
+    )
+
+    def handle(self, *targets, **options):
+        if not targets:
+            raise CommandError("Usage: export_instances {args}".format(
+                args = self.args,
+            ))
+        verbosity = int(options.get("verbosity", 1))
+        error_count = 0
+        for target, count, error in exporter.export_many(
+            targets,
+            options["output_dir"],
+            options["format"],
+            compress = options["gzip"],
+            chunk_size = options["chunk_size"],
+            processes = options["parallel"],
+        ):
+            if error is not None:
+                self.stderr.write(error)
+                error_count += 1
+            elif verbosity >= 1:
+                self.stdout.write("Exported {count} instances of {target}.".format(
+                    count = count,
+                    target = target,
+                ))
+        if error_count:
+            raise CommandError("{error_count} exports failed.".format(
+                error_count = error_count,
+            ))
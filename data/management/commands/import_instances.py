@@ -0,0 +1,95 @@
+import gzip, sys, time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from data import importer
+from data.schema import get_schema
+from data.models import Model
+
+
+class Command(BaseCommand):
+
+    args = "<model_id> <file>"
+
+    help = "Imports instances of a model from a JSON lines or CSV file, updating existing instances by ID."
+
+    option_list = BaseCommand.option_list + (
+        make_option("--format",
+            choices = sorted(importer.READERS.keys()),
+            help = "The file format. Defaults to the file extension.",
+        ),
+        make_option("--chunk-size",
+            type = "int",
+            default = importer.IMPORT_CHUNK_SIZE,
+            help = "The number of rows saved in each transaction.",
+        ),
+    )
+
+    def get_model(self, model_id):
+        model = Model.objects.filter(external_id=model_id).first()
+        if model is None and model_id.isdigit():
+            model = Model.objects.filter(id=model_id).first()
+        if model is None:
+            raise CommandError("Unknown model {model_id}.".format(
+                model_id = model_id,
+            ))
+        return model
+
+    def get_format(self, path):
+        if path.endswith(".gz"):
+            path = path[:-3]
+        if path.endswith(".csv"):
+            return "csv"
+        if path.endswith((".jsonl", ".json", ".ndjson")):
+            return "jsonl"
+        raise CommandError("Unknown format for {path}, use --format.".format(
+            path = path,
+        ))
+
+    def open_file(self, path):
+        if path == "-":
+            return sys.stdin
+        if path.endswith(".gz"):
+            return gzip.open(path, "rb")
+        return open(path, "rb")
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: import_instances {args}".format(
+                args = self.args,
+            ))
+        model_id, path = args
+        model = self.get_model(model_id)
+        format = options.get("format") or self.get_format(path)
+        verbosity = int(options.get("verbosity", 1))
+        # Import the file.
+        start_time = time.time()
+        row_count = created_count = updated_count = error_count = 0
+        with self.open_file(path) as lines:
+            rows = importer.READERS[format](lines, get_schema(model).field_list)
+            for created, updated, errors in importer.import_instances(model, rows, options["chunk_size"]):
+                for line_number, message in errors:
+                    self.stderr.write(u"Line {line_number}: {message}".format(
+                        line_number = line_number,
+                        message = message,
+                    ))
+                row_count += created + updated + len(errors)
+                created_count += created
+                updated_count += updated
+                error_count += len(errors)
+                if verbosity >= 2:
+                    self.stdout.write("Processed {row_count} rows.".format(
+                        row_count = row_count,
+                    ))
+        # Report the throughput.
+        if verbosity >= 1:
+            duration = time.time() - start_time
+            self.stdout.write("Imported {count} instances ({created} created, {updated} updated, {errors} invalid) in {duration:.1f}s ({rate:.0f} rows/s).".format(
+                count = created_count + updated_count,
+                created = created_count,
+                updated = updated_count,
+                errors = error_count,
+                duration = duration,
+                rate = row_count / duration if duration else 0,
+            ))
@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+
+from data import sync
+
+
+class Command(NoArgsCommand):
+
+    help = "Deletes the tombstones older than the retention period."
+
+    def handle_noargs(self, **options):
+        count = sync.prune_tombstones()
+        if int(options.get("verbosity", 1)) >= 1:
+            self.stdout.write("Pruned {count} tombstones.".format(
+                count = count,
+            ))
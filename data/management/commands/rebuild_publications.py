@@ -0,0 +1,18 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from data import publication
+from data.models import Publication
+
+
+class Command(NoArgsCommand):
+
+    help = "Rebuilds the published instances of all applications."
+
+    def handle_noargs(self, **options):
+        with transaction.atomic():
+            publication.rebuild()
+        if int(options.get("verbosity", 1)) >= 1:
+            self.stdout.write("Rebuilt {count} publications.".format(
+                count = Publication.objects.count(),
+            ))
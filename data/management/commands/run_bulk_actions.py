@@ -0,0 +1,67 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from data import bulk
+
+
+class Command(NoArgsCommand):
+
+    help = "Runs the bulk actions queued from the admin site, in chunks."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option("--chunk-size",
+            type = "int",
+            default = bulk.BULK_ACTION_CHUNK_SIZE,
+            help = "The number of instances updated in each transaction.",
+        ),
+        make_option("--resume",
+            action = "store_true",
+            default = False,
+            help = "Also resume actions left running by an interrupted worker.",
+        ),
+        make_option("--wait",
+            type = "float",
+            help = "Keep running, checking for new actions after the given number of seconds.",
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get("verbosity", 1))
+        resume = options["resume"]
+        error_count = 0
+        while True:
+            bulk_action = bulk.claim_bulk_action(resume)
+            if bulk_action is None:
+                if options["wait"] is None:
+                    break
+                time.sleep(options["wait"])
+                continue
+            # Only resume actions left running when the worker started.
+            resume = False
+            start_time = time.time()
+            try:
+                for processed in bulk.run_bulk_action(bulk_action, options["chunk_size"]):
+                    if verbosity >= 2:
+                        self.stdout.write("Processed {processed} of {count} instances.".format(
+                            processed = processed,
+                            count = bulk_action.instance_count,
+                        ))
+            except Exception as ex:
+                self.stderr.write(u"Failed to {action} instances: {error}".format(
+                    action = bulk_action.action,
+                    error = ex,
+                ))
+                error_count += 1
+                continue
+            if verbosity >= 1:
+                self.stdout.write("Completed {action} of {count} instances in {duration:.1f}s.".format(
+                    action = bulk_action.action,
+                    count = bulk_action.instance_count,
+                    duration = time.time() - start_time,
+                ))
+        if error_count:
+            raise CommandError("{count} bulk actions failed.".format(
+                count = error_count,
+            ))
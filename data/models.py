@@ -1,12 +1,37 @@
 import posixpath
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed, post_syncdb
+from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 
-from jsonfield import JSONField
+import jsonfield
 
 from data.fields import fields
-from data import uuid
+from data import uuid, cache, sync, codec, index, publication, search, bulk, importer
+
+
+# JSON fields.
+
+class JSONField(jsonfield.JSONField):
+
+    """A JSONField that decodes values loaded from the database with the DATA_JSON_CODEC."""
+
+    def pre_init(self, value, obj):
+        if obj._state.adding and getattr(obj, "pk", True) is not None and isinstance(value, basestring):
+            try:
+                return codec.loads(value)
+            except ValueError:
+                raise ValidationError("Enter valid JSON")
+        return value
+
+    def south_field_triple(self):
+        # Freeze as a plain JSONField, since the database representation is the same.
+        from south.modelsinspector import introspector
+        args, kwargs = introspector(self)
+        return ("jsonfield.fields.JSONField", args, kwargs)
 
 
 # Base classes.
@@ -88,12 +113,17 @@ class File(NamedMixin, MetaMixin):
 
     file = models.FileField(
         upload_to = file_upload_to,
+        db_index = True,
     )
 
     class Meta:
         ordering = ("-date_modified",)
 
 
+# The number of instances whose published data is updated in each batch.
+PUBLISHED_DATA_CHUNK_SIZE = 500
+
+
 class Model(NamedMixin, ExternalIdMixin, OnlineMixin, MetaMixin):
 
     admin_users = models.ManyToManyField(
@@ -113,6 +143,49 @@ class Model(NamedMixin, ExternalIdMixin, OnlineMixin, MetaMixin):
         blank = True,
     )
 
+    schema_version = models.CharField(
+        max_length = 32,
+        default = uuid.generate,
+        editable = False,
+    )
+
+    def save(self, *args, **kwargs):
+        external_id_changed = self.pk is not None and not Model.objects.filter(
+            pk = self.pk,
+            external_id = self.external_id,
+        ).exists()
+        is_online_changed = self.pk is not None and not Model.objects.filter(
+            pk = self.pk,
+            is_online = self.is_online,
+        ).exists()
+        # The schema version is changed by saving fields, so don't overwrite it with a stale value.
+        if self.pk is not None:
+            self.schema_version = Model.objects.filter(
+                pk = self.pk,
+            ).values_list("schema_version", flat=True).first() or self.schema_version
+        super(Model, self).save(*args, **kwargs)
+        # The published data of each instance contains the model external ID.
+        if external_id_changed:
+            instance_list = []
+            for instance in self.instance_set.defer("published_data").iterator():
+                instance.model = self
+                instance.published_data = codec.dumps(instance.get_published_data())
+                instance_list.append(instance)
+                if len(instance_list) >= PUBLISHED_DATA_CHUNK_SIZE:
+                    importer.update_instances(instance_list, ("published_data",))
+                    instance_list = []
+            importer.update_instances(instance_list, ("published_data",))
+        # Only the instances of online models are published.
+        if is_online_changed:
+            publication.update_model(self)
+
+    def delete(self, *args, **kwargs):
+        # Delete the instances in bulk, rather than recording tombstones, touching the
+        # model and invalidating cached responses for each instance.
+        with transaction.atomic():
+            bulk.delete_model_instances(self.pk)
+            super(Model, self).delete(*args, **kwargs)
+
     class Meta:
         ordering = ("-date_modified",)
         unique_together = (
@@ -165,8 +238,482 @@ class Instance(NamedMixin, ExternalIdMixin, OnlineMixin, MetaMixin):
         editable = False,
     )
 
+    published_data = models.TextField(
+        default = "",
+        editable = False,
+    )
+
+    def get_published_data(self):
+        """Returns the instance data, as published by the API."""
+        published_data = dict(self.data)
+        published_data["_id"] = self.external_id
+        published_data["_date_created"] = self.date_created.isoformat()
+        published_data["_date_modified"] = self.date_modified.isoformat()
+        published_data["_model"] = self.model.external_id
+        return published_data
+
+    def save_published_data(self):
+        """
+        Renders the published JSON for this instance, and stores it in the database.
+
+        This is called automatically when the instance is saved. Instances updated in
+        bulk via the queryset API must have this called manually.
+        """
+        self.published_data = codec.dumps(self.get_published_data())
+        Instance.objects.filter(pk=self.pk).update(
+            published_data = self.published_data,
+        )
+
     class Meta:
         ordering = ("-date_modified",)
         unique_together = (
             ("model", "external_id",),
         )
+        index_together = (
+            ("model", "date_modified", "id",),
+        )
+
+
+# Incremental sync.
+
+class Tombstone(models.Model):
+
+    """
+    A record of published instances being removed from the API.
+
+    Tombstones without an application record the removal of a single instance. Tombstones
+    with an application record a change to the models published in that application,
+    and have no instance external ID.
+    """
+
+    application = models.ForeignKey(
+        Application,
+        blank = True,
+        null = True,
+    )
+
+    model_external_id = models.CharField(
+        max_length = 255,
+    )
+
+    instance_external_id = models.CharField(
+        max_length = 255,
+        blank = True,
+    )
+
+    date_created = models.DateTimeField(
+        auto_now_add = True,
+        db_index = True,
+    )
+
+    class Meta:
+        ordering = ("date_created",)
+
+
+# Field value index.
+
+class FieldValue(models.Model):
+
+    """
+    An indexed value of an instance field.
+
+    Each value is stored in the typed column chosen by the field implementation.
+    Fields with multiple values have one row per value.
+    """
+
+    instance = models.ForeignKey(
+        Instance,
+    )
+
+    model = models.ForeignKey(
+        Model,
+    )
+
+    field_name = models.CharField(
+        max_length = 200,
+    )
+
+    text_value = models.CharField(
+        max_length = 255,
+        null = True,
+    )
+
+    number_value = models.FloatField(
+        null = True,
+    )
+
+    datetime_value = models.DateTimeField(
+        null = True,
+    )
+
+    class Meta:
+        index_together = (
+            ("model", "field_name", "text_value",),
+            ("model", "field_name", "number_value",),
+            ("model", "field_name", "datetime_value",),
+        )
+
+
+# Publication.
+
+class Publication(models.Model):
+
+    """
+    A published instance within an application.
+
+    Publications are maintained automatically when instances, models and application
+    memberships change, and can be rebuilt using the rebuild_publications command.
+    """
+
+    application = models.ForeignKey(
+        Application,
+    )
+
+    model = models.ForeignKey(
+        Model,
+    )
+
+    instance = models.ForeignKey(
+        Instance,
+    )
+
+    class Meta:
+        unique_together = (
+            ("application", "instance",),
+        )
+
+
+# Search.
+
+class SearchDocument(models.Model):
+
+    """The searchable text of an instance, indexed by the database full-text search."""
+
+    instance = models.OneToOneField(
+        Instance,
+        primary_key = True,
+    )
+
+    model = models.ForeignKey(
+        Model,
+    )
+
+    text = models.TextField(
+        blank = True,
+    )
+
+
+# Bulk actions.
+
+class BulkAction(MetaMixin):
+
+    """
+    An admin action on many instances, run in chunks by the run_bulk_actions command.
+
+    The instance IDs are processed in order, and the number processed is saved with
+    each chunk, so an interrupted action can be resumed.
+    """
+
+    STATUS_PENDING = "pending"
+
+    STATUS_RUNNING = "running"
+
+    STATUS_COMPLETE = "complete"
+
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETE, "Complete"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    action = models.CharField(
+        max_length = 50,
+    )
+
+    model = models.ForeignKey(
+        Model,
+        blank = True,
+        null = True,
+        on_delete = models.SET_NULL,
+    )
+
+    params = JSONField(
+        default = {},
+        editable = False,
+    )
+
+    instance_ids = JSONField(
+        default = [],
+        editable = False,
+    )
+
+    instance_count = models.PositiveIntegerField(
+        default = 0,
+        editable = False,
+    )
+
+    processed = models.PositiveIntegerField(
+        default = 0,
+    )
+
+    status = models.CharField(
+        max_length = 20,
+        choices = STATUS_CHOICES,
+        default = STATUS_PENDING,
+        db_index = True,
+    )
+
+    error = models.TextField(
+        blank = True,
+    )
+
+    user = models.ForeignKey(
+        User,
+        blank = True,
+        null = True,
+        on_delete = models.SET_NULL,
+    )
+
+    def __unicode__(self):
+        return u"{action} {count} instances".format(
+            action = self.action,
+            count = self.instance_count,
+        )
+
+    class Meta:
+        ordering = ("-date_created",)
+
+
+# Signal handlers.
+
+@receiver(post_save, sender=Instance)
+def update_instance_published_data(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.save_published_data()
+
+
+@receiver(post_save, sender=Instance)
+def update_instance_field_values(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index.update_instance(instance)
+
+
+@receiver(post_save, sender=Instance)
+def update_instance_publications(sender, instance, raw=False, **kwargs):
+    if not raw:
+        publication.update_instance(instance)
+
+
+@receiver(m2m_changed, sender=Model.applications.through)
+def update_application_publications(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        model_ids, application_ids = pk_set, (instance.pk,)
+    else:
+        model_ids, application_ids = (instance.pk,), pk_set
+    if action == "post_add":
+        publication.publish(model_ids, application_ids)
+    elif action == "post_remove":
+        publication.unpublish(model_ids, application_ids)
+    elif action == "pre_clear":
+        if reverse:
+            publication.unpublish(application_ids=application_ids)
+        else:
+            publication.unpublish(model_ids=model_ids)
+
+
+@receiver(post_save, sender=Instance)
+def update_instance_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.update_instance(instance)
+
+
+@receiver(post_save, sender=Instance)
+def record_migrated_instance(sender, instance, raw=False, **kwargs):
+    # Instances edited before a field migration reaches them are saved migrated.
+    if not raw:
+        bulk.record_migrated_instance(instance)
+
+
+@receiver(pre_save, sender=Field)
+def record_previous_field(sender, instance, raw=False, **kwargs):
+    instance._previous_field = None
+    if not raw and instance.pk is not None:
+        instance._previous_field = Field.objects.filter(pk=instance.pk).first()
+
+
+def field_needs_migration(field):
+    previous_field = getattr(field, "_previous_field", None)
+    return previous_field is not None and (previous_field.name, previous_field.type) != (field.name, field.type)
+
+
+@receiver(post_save, sender=Field)
+def queue_field_migration(sender, instance, raw=False, **kwargs):
+    # Renaming or retyping a field moves its values in the instance data, in the background.
+    if not raw and field_needs_migration(instance):
+        bulk.create_field_migration(instance._previous_field, instance)
+
+
+@receiver(post_delete, sender=Field)
+def update_model_search_documents(sender, instance, **kwargs):
+    # Deleting a searchable field changes the searchable text of the instances of its model.
+    # Renamed and retyped fields are updated by their migration, and new fields have no values.
+    if instance.get_field_implementation().searchable:
+        bulk.create_reindex(instance.model_id)
+
+
+@receiver(post_save, sender=Field)
+@receiver(post_delete, sender=Field)
+def update_model_schema_version(sender, instance, raw=False, **kwargs):
+    # Changing a field invalidates the compiled schema of its model.
+    if not raw:
+        Model.objects.filter(pk=instance.model_id).update(
+            schema_version = uuid.generate(),
+        )
+
+
+@receiver(post_syncdb)
+def install_search(sender, app=None, **kwargs):
+    if app is not None and app.__name__ == __name__:
+        search.install()
+
+
+def field_needs_reindex(field):
+    # Changing the type params of an indexed field can change how its values are indexed.
+    # New fields have no values yet, and migrated fields are indexed by the migration.
+    previous_field = getattr(field, "_previous_field", None)
+    return (
+        previous_field is not None and
+        not field_needs_migration(field) and
+        previous_field.type_params != field.type_params and
+        field.get_field_implementation().index_column is not None
+    )
+
+
+@receiver(post_save, sender=Field)
+def update_field_values(sender, instance, raw=False, **kwargs):
+    # Reindex the instances of the model in the background.
+    if not raw and field_needs_reindex(instance):
+        bulk.create_reindex(instance.model_id)
+
+
+@receiver(post_delete, sender=Field)
+def remove_field_values(sender, instance, **kwargs):
+    index.remove_field(instance)
+
+
+@receiver(pre_save, sender=Application)
+@receiver(pre_save, sender=Model)
+@receiver(pre_save, sender=Instance)
+def invalidate_previous_cached_responses(sender, instance, **kwargs):
+    # Invalidate responses for the previous external ID of a changed object.
+    if cache.is_enabled() and instance.pk is not None:
+        previous_instance = sender.objects.filter(pk=instance.pk).first()
+        if previous_instance is not None:
+            cache.invalidate(cache.get_dependencies(previous_instance))
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_save, sender=Model)
+@receiver(post_save, sender=Field)
+@receiver(post_save, sender=Instance)
+@receiver(pre_delete, sender=Application)
+@receiver(pre_delete, sender=Model)
+@receiver(pre_delete, sender=Field)
+@receiver(pre_delete, sender=Instance)
+@receiver(post_delete, sender=Application)
+@receiver(post_delete, sender=Model)
+@receiver(post_delete, sender=Field)
+@receiver(post_delete, sender=Instance)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    if cache.is_enabled():
+        cache.invalidate(cache.get_dependencies(instance))
+
+
+@receiver(post_delete, sender=Instance)
+def touch_deleted_instance_model(sender, instance, **kwargs):
+    # Deleting an instance modifies the published data of its model.
+    Model.objects.filter(pk=instance.model_id).update(
+        date_modified = timezone.now(),
+    )
+
+
+@receiver(pre_save, sender=Instance)
+def touch_unpublished_instance_model(sender, instance, raw=False, **kwargs):
+    # Taking an instance offline, or moving it to another model, modifies the published
+    # data of its previous model, without changing the latest date modified of its
+    # online instances.
+    if not raw and instance.pk is not None:
+        previous_model_id = Instance.objects.filter(pk=instance.pk, is_online=True).values_list("model_id", flat=True).first()
+        if previous_model_id is not None and (not instance.is_online or previous_model_id != instance.model_id):
+            Model.objects.filter(pk=previous_model_id).update(
+                date_modified = timezone.now(),
+            )
+
+
+@receiver(pre_save, sender=Model)
+def touch_unpublished_model_applications(sender, instance, raw=False, **kwargs):
+    # Taking a model offline modifies the published data of its applications.
+    if not raw and instance.pk is not None and not instance.is_online:
+        if Model.objects.filter(pk=instance.pk, is_online=True).exists():
+            Application.objects.filter(model__id=instance.pk).update(
+                date_modified = timezone.now(),
+            )
+
+
+@receiver(pre_save, sender=Instance)
+def record_previous_instance_tombstone(sender, instance, raw=False, **kwargs):
+    # Changing the model or external ID of an instance removes it from the API.
+    if not raw and instance.pk is not None:
+        previous_instance = Instance.objects.filter(pk=instance.pk).values_list("model_id", "external_id").first()
+        if previous_instance is not None and previous_instance != (instance.model_id, instance.external_id):
+            sync.record_instance_removed(*previous_instance)
+
+
+@receiver(post_delete, sender=Instance)
+def record_deleted_instance_tombstone(sender, instance, **kwargs):
+    sync.record_instance_removed(instance.model_id, instance.external_id)
+
+
+@receiver(pre_save, sender=Model)
+def record_previous_model_tombstones(sender, instance, raw=False, **kwargs):
+    # Changing the external ID or online state of a model changes the published models.
+    if not raw and instance.pk is not None:
+        previous_model = Model.objects.filter(pk=instance.pk).values_list("external_id", "is_online").first()
+        if previous_model is not None and previous_model != (instance.external_id, instance.is_online):
+            sync.record_model_changed(instance.pk, (previous_model[0], instance.external_id))
+
+
+@receiver(pre_delete, sender=Model)
+def record_deleted_model_tombstones(sender, instance, **kwargs):
+    sync.record_model_changed(instance.pk, (instance.external_id,))
+
+
+@receiver(m2m_changed, sender=Model.applications.through)
+def model_applications_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove", "pre_clear"):
+        if reverse:
+            application_ids = (instance.pk,)
+            if action == "pre_clear":
+                model_external_ids = list(instance.model_set.values_list("external_id", flat=True))
+            else:
+                model_external_ids = list(Model.objects.filter(id__in=pk_set).values_list("external_id", flat=True))
+        else:
+            if action == "pre_clear":
+                application_ids = list(instance.applications.values_list("id", flat=True))
+            else:
+                application_ids = pk_set
+            model_external_ids = (instance.external_id,)
+        # Changing the models in an application modifies its published data.
+        Application.objects.filter(id__in=application_ids).update(
+            date_modified = timezone.now(),
+        )
+        sync.record_models_changed(
+            (application_id, model_external_id)
+            for application_id in application_ids
+            for model_external_id in model_external_ids
+        )
+        if cache.is_enabled():
+            cache.invalidate(cache.get_application_dependencies(cache.get_applications(application_ids)))
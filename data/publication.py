@@ -0,0 +1,122 @@
+"""
+Denormalized publication of instances within applications.
+
+A Publication row exists for each online instance of an online model in each
+of the model's applications, so the published instances of an application can
+be loaded without joining through models and application memberships.
+"""
+
+
+PUBLISH_CHUNK_SIZE = 1000
+
+
+def update_instance(instance):
+    """Updates the publications of an instance, after it has been saved."""
+    from data.models import Model, Publication
+    if instance.is_online:
+        publications = frozenset(
+            (application_id, instance.model_id)
+            for application_id
+            in Model.applications.through.objects.filter(
+                model_id = instance.model_id,
+                model__is_online = True,
+            ).values_list("application_id", flat=True)
+        )
+    else:
+        publications = frozenset()
+    previous_publications = frozenset(Publication.objects.filter(
+        instance = instance,
+    ).values_list("application_id", "model_id"))
+    if previous_publications - publications:
+        Publication.objects.filter(
+            instance = instance,
+        ).delete()
+        previous_publications = frozenset()
+    Publication.objects.bulk_create([
+        Publication(
+            application_id = application_id,
+            model_id = model_id,
+            instance_id = instance.pk,
+        )
+        for application_id, model_id
+        in publications - previous_publications
+    ])
+
+
+def update_instances(model, instance_list):
+    """Updates the publications of the given instances of a model, after they have been saved in bulk."""
+    from data.models import Publication
+    Publication.objects.filter(
+        instance_id__in = [instance.pk for instance in instance_list],
+    ).delete()
+    if model.is_online:
+        application_ids = list(model.applications.values_list("id", flat=True))
+        Publication.objects.bulk_create([
+            Publication(
+                application_id = application_id,
+                model_id = model.pk,
+                instance_id = instance.pk,
+            )
+            for instance
+            in instance_list
+            if instance.is_online
+            for application_id
+            in application_ids
+        ])
+
+
+def publish(model_ids, application_ids):
+    """Publishes the online instances of the given models within the given applications."""
+    from data.models import Instance, Publication
+    unpublish(model_ids, application_ids)
+    instance_list = Instance.objects.filter(
+        model_id__in = model_ids,
+        model__is_online = True,
+        is_online = True,
+    ).values_list("id", "model_id").order_by()
+    publications = []
+    for instance_id, model_id in instance_list.iterator():
+        publications.extend(
+            Publication(
+                application_id = application_id,
+                model_id = model_id,
+                instance_id = instance_id,
+            )
+            for application_id
+            in application_ids
+        )
+        if len(publications) >= PUBLISH_CHUNK_SIZE:
+            Publication.objects.bulk_create(publications)
+            publications = []
+    Publication.objects.bulk_create(publications)
+
+
+def unpublish(model_ids=None, application_ids=None):
+    """Removes the publications of the given models and/or applications."""
+    from data.models import Publication
+    publications = Publication.objects.all()
+    if model_ids is not None:
+        publications = publications.filter(model_id__in=model_ids)
+    if application_ids is not None:
+        publications = publications.filter(application_id__in=application_ids)
+    publications.delete()
+
+
+def update_model(model):
+    """Updates the publications of a model, after its online state has changed."""
+    application_ids = list(model.applications.values_list("id", flat=True))
+    if model.is_online:
+        publish((model.pk,), application_ids)
+    else:
+        unpublish(model_ids=(model.pk,))
+
+
+def rebuild():
+    """Rebuilds all publications from the current models, applications and instances."""
+    from data.models import Model
+    unpublish()
+    memberships = {}
+    for model_id, application_id in Model.applications.through.objects.values_list("model_id", "application_id"):
+        memberships.setdefault(model_id, []).append(application_id)
+    for model_id, application_ids in memberships.iteritems():
+        publish((model_id,), application_ids)
@@ -0,0 +1,158 @@
+"""
+Compiled model schemas.
+
+A Schema holds the field implementations of a model, and the form fields used
+to validate their values, so instance data can be validated, serialized and
+unserialized in bulk without building a form. Schemas are cached in each
+process, and rebuilt when the schema version of their model changes.
+"""
+
+import collections
+
+from django.core.exceptions import ValidationError
+
+from data.fields import load_many_references
+
+
+class Schema(object):
+
+    """The compiled fields of a model, at a schema version."""
+
+    def __init__(self, model_id, version, field_list):
+        self.model_id = model_id
+        self.version = version
+        self.field_list = list(field_list)
+        self.field_implementations = [
+            (field, field.get_field_implementation())
+            for field
+            in self.field_list
+        ]
+        self.form_fields = [
+            field_implementation.form_field(label=field.name)
+            for field, field_implementation
+            in self.field_implementations
+        ]
+
+    def get_references(self, values_list):
+        """Loads the objects referenced by a list of dicts of json values."""
+        return load_many_references(
+            (field_implementation, values.get(field.name))
+            for values in values_list
+            for field, field_implementation in self.field_implementations
+        )
+
+    def clean(self, values, references):
+        """
+        Validates a dict of json values, returning the instance data.
+
+        Referenced objects are looked up in a dict returned by get_references().
+        Raises ValidationError if a value is invalid.
+        """
+        instance_data = collections.OrderedDict()
+        for (field, field_implementation), form_field in zip(self.field_implementations, self.form_fields):
+            instance_data[field.name] = self.clean_field_value(field, field_implementation, form_field, values.get(field.name), references)
+        return instance_data
+
+    def clean_field_value(self, field, field_implementation, form_field, value, references):
+        try:
+            reference_keys = field_implementation.get_references(value)
+            if reference_keys:
+                for reference_key in reference_keys:
+                    if reference_key not in references:
+                        raise ValidationError(u"Unknown reference '{key}'.".format(
+                            key = reference_key[2],
+                        ))
+                return field_implementation.serialize(field_implementation.deserialize_references(value, references))
+            return field_implementation.clean(value, form_field)
+        except ValidationError as ex:
+            raise ValidationError(u"{name}: {message}".format(
+                name = field.name,
+                message = u" ".join(ex.messages),
+            ))
+
+    def clean_value(self, field_name, value):
+        """
+        Validates the json value of a single field, returning its value in the instance data.
+
+        Raises KeyError if the model has no such field, or ValidationError if the value is invalid.
+        """
+        for (field, field_implementation), form_field in zip(self.field_implementations, self.form_fields):
+            if field.name == field_name:
+                references = self.get_references([{field_name: value}])
+                return self.clean_field_value(field, field_implementation, form_field, value, references)
+        raise KeyError(field_name)
+
+    def parse_text_value(self, field_name, value):
+        """
+        Parses and validates a string value of a single field, as supplied in a CSV file
+        or admin form, returning its value in the instance data.
+
+        Raises KeyError if the model has no such field, or ValidationError if the value is invalid.
+        """
+        for field, field_implementation in self.field_implementations:
+            if field.name == field_name:
+                try:
+                    value = field_implementation.parse_text_value(value)
+                except ValidationError as ex:
+                    raise ValidationError(u"{name}: {message}".format(
+                        name = field.name,
+                        message = u" ".join(ex.messages),
+                    ))
+                return self.clean_value(field_name, value)
+        raise KeyError(field_name)
+
+    def clean_many(self, values_list):
+        """
+        Validates a list of dicts of json values, loading referenced objects in bulk.
+
+        Returns a list containing the instance data, or a ValidationError, for each dict.
+        """
+        values_list = list(values_list)
+        references = self.get_references(values_list)
+        results = []
+        for values in values_list:
+            try:
+                results.append(self.clean(values, references))
+            except ValidationError as ex:
+                results.append(ex)
+        return results
+
+    def serialize(self, python_values):
+        """Serializes a dict of python values, as cleaned by the form fields, into instance data."""
+        return collections.OrderedDict(
+            (field.name, field_implementation.serialize(python_values.get(field.name)))
+            for field, field_implementation
+            in self.field_implementations
+        )
+
+    def deserialize_many(self, instance_data_list):
+        """Unserializes a list of instance data into dicts of python values, loading referenced objects in bulk."""
+        instance_data_list = list(instance_data_list)
+        references = self.get_references(instance_data_list)
+        return [
+            dict(
+                (field.name, field_implementation.deserialize_references(instance_data.get(field.name), references))
+                for field, field_implementation
+                in self.field_implementations
+            )
+            for instance_data
+            in instance_data_list
+        ]
+
+
+# The cached schemas, keyed by (model ID, schema version).
+schemas = {}
+
+
+def get_schema(model):
+    """Returns the compiled schema of a model, building it if the schema version has changed."""
+    from data.models import Field
+    schema = schemas.get((model.pk, model.schema_version))
+    if schema is None:
+        schema = Schema(model.pk, model.schema_version, Field.objects.filter(model_id=model.pk))
+        # Evict the schemas of previous versions. The cache is shared between threads.
+        for key in list(schemas):
+            if key[0] == model.pk:
+                schemas.pop(key, None)
+        schemas[(model.pk, model.schema_version)] = schema
+    return schema
@@ -0,0 +1,172 @@
+"""
+Full-text search of instance data.
+
+The searchable text of each instance is stored as a SearchDocument, and kept up
+to date when instances are saved. Changes to fields are applied to existing
+documents in the background, by bulk actions. Where the database supports it, the
+documents are indexed using the database full-text search: an FTS5 table on SQLite,
+or a GIN expression index on PostgreSQL. Other databases fall back to a
+case-insensitive match on each search term.
+"""
+
+from django.db import connection
+
+# The maximum number of results returned by a search.
+MAX_SEARCH_RESULTS = 1000
+
+
+# Documents.
+
+def get_search_text(instance, field_list):
+    """Returns the searchable text of the instance data, using the given fields of its model."""
+    text = []
+    for field in field_list:
+        if field.get_field_implementation().searchable:
+            value = instance.data.get(field.name)
+            if isinstance(value, basestring) and value:
+                text.append(value)
+    return u"\n".join(text)
+
+
+def update_instance(instance):
+    """Updates the search document of the instance."""
+    from data.models import Field, SearchDocument
+    text = get_search_text(instance, Field.objects.filter(model_id=instance.model_id))
+    updated = SearchDocument.objects.filter(instance_id=instance.pk).update(
+        model = instance.model_id,
+        text = text,
+    )
+    if not updated:
+        SearchDocument.objects.create(
+            instance_id = instance.pk,
+            model_id = instance.model_id,
+            text = text,
+        )
+
+
+def update_instances(instance_list, field_list):
+    """Replaces the search documents of the given instances, using the given fields of their model."""
+    from data.models import SearchDocument
+    SearchDocument.objects.filter(instance_id__in=[instance.pk for instance in instance_list]).delete()
+    SearchDocument.objects.bulk_create([
+        SearchDocument(
+            instance_id = instance.pk,
+            model_id = instance.model_id,
+            text = get_search_text(instance, field_list),
+        )
+        for instance
+        in instance_list
+    ])
+
+
+# Backends.
+
+def quote_search_term(term):
+    return u'"{term}"'.format(
+        term = term.replace(u'"', u'""'),
+    )
+
+
+class SearchBackend(object):
+
+    """Matches each search term case-insensitively, ordering results by date modified."""
+
+    def install(self, cursor):
+        pass
+
+    def search(self, cursor, query, model_ids, limit, online_only):
+        from data.models import SearchDocument
+        documents = SearchDocument.objects.filter(
+            model_id__in = model_ids,
+        )
+        for term in query.split():
+            documents = documents.filter(
+                text__icontains = term,
+            )
+        if online_only:
+            documents = documents.filter(
+                instance__is_online = True,
+            )
+        return list(documents.order_by("-instance__date_modified").values_list("instance_id", flat=True)[:limit])
+
+
+def format_model_ids(model_ids):
+    return u",".join(str(int(model_id)) for model_id in model_ids)
+
+
+class SqliteSearchBackend(SearchBackend):
+
+    """Searches using an FTS5 table, ordering results by relevance."""
+
+    def install(self, cursor):
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS data_searchdocument_fts USING fts5(text, content='data_searchdocument', content_rowid='instance_id')")
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS data_searchdocument_ai AFTER INSERT ON data_searchdocument BEGIN INSERT INTO data_searchdocument_fts(rowid, text) VALUES (new.instance_id, new.text); END")
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS data_searchdocument_ad AFTER DELETE ON data_searchdocument BEGIN INSERT INTO data_searchdocument_fts(data_searchdocument_fts, rowid, text) VALUES ('delete', old.instance_id, old.text); END")
+        cursor.execute("CREATE TRIGGER IF NOT EXISTS data_searchdocument_au AFTER UPDATE ON data_searchdocument BEGIN INSERT INTO data_searchdocument_fts(data_searchdocument_fts, rowid, text) VALUES ('delete', old.instance_id, old.text); INSERT INTO data_searchdocument_fts(rowid, text) VALUES (new.instance_id, new.text); END")
+
+    def search(self, cursor, query, model_ids, limit, online_only):
+        # Quote each term, so the query is matched as plain text.
+        cursor.execute(
+            u"SELECT d.instance_id FROM data_searchdocument_fts f "
+            u"INNER JOIN data_searchdocument d ON d.instance_id = f.rowid "
+            u"INNER JOIN data_instance i ON i.id = d.instance_id "
+            u"WHERE data_searchdocument_fts MATCH %s AND d.model_id IN ({model_ids}){online_only} "
+            u"ORDER BY f.rank LIMIT %s".format(
+                model_ids = format_model_ids(model_ids),
+                online_only = u" AND i.is_online" if online_only else u"",
+            ),
+            [u" ".join(quote_search_term(term) for term in query.split()), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+
+    """Searches using a GIN expression index, ordering results by relevance."""
+
+    search_config = "english"
+
+    def install(self, cursor):
+        cursor.execute("CREATE INDEX IF NOT EXISTS data_searchdocument_text_fts ON data_searchdocument USING gin(to_tsvector('{search_config}', text))".format(
+            search_config = self.search_config,
+        ))
+
+    def search(self, cursor, query, model_ids, limit, online_only):
+        cursor.execute(
+            u"SELECT d.instance_id FROM data_searchdocument d "
+            u"INNER JOIN data_instance i ON i.id = d.instance_id "
+            u"WHERE to_tsvector('{search_config}', d.text) @@ plainto_tsquery('{search_config}', %s) AND d.model_id IN ({model_ids}){online_only} "
+            u"ORDER BY ts_rank(to_tsvector('{search_config}', d.text), plainto_tsquery('{search_config}', %s)) DESC LIMIT %s".format(
+                search_config = self.search_config,
+                model_ids = format_model_ids(model_ids),
+                online_only = u" AND i.is_online" if online_only else u"",
+            ),
+            [query, query, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend():
+    return SEARCH_BACKENDS.get(connection.vendor, SearchBackend)()
+
+
+def install():
+    """Installs the database full-text index. This is idempotent."""
+    from data.models import SearchDocument
+    # With migrations, syncdb runs before the search document table exists.
+    if SearchDocument._meta.db_table in connection.introspection.table_names():
+        get_backend().install(connection.cursor())
+
+
+def search_instance_ids(query, model_ids, limit=MAX_SEARCH_RESULTS, online_only=True):
+    """Returns the IDs of instances of the given models matching the search query, most relevant first."""
+    model_ids = list(model_ids)
+    if not model_ids or not query.split():
+        return []
+    return get_backend().search(connection.cursor(), query, model_ids, min(limit, MAX_SEARCH_RESULTS), online_only)
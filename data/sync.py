@@ -0,0 +1,167 @@
+"""
+Incremental sync of application instances.
+
+Sync tokens encode the time of a previous sync. Instances modified since then
+are found using their date_modified, and removed instances are found using
+tombstones. Tombstones are kept for a retention period, after which clients
+with older tokens must sync the entire application again.
+"""
+
+import base64, datetime
+
+from django.conf import settings
+from django.utils import dateparse, timezone
+
+
+# The default number of seconds tokens are issued in the past, so that changes
+# from transactions in progress during a sync are included in the next sync.
+# Changes from transactions committed more than this long after their instances
+# were modified are missed by incremental syncs.
+DEFAULT_SYNC_TOKEN_OVERLAP = 60
+
+
+# The default number of days tombstones are kept.
+DEFAULT_TOMBSTONE_RETENTION_DAYS = 30
+
+
+def get_token_overlap():
+    return datetime.timedelta(seconds=getattr(settings, "DATA_SYNC_TOKEN_OVERLAP", DEFAULT_SYNC_TOKEN_OVERLAP))
+
+
+def get_tombstone_retention():
+    return datetime.timedelta(days=getattr(settings, "DATA_TOMBSTONE_RETENTION_DAYS", DEFAULT_TOMBSTONE_RETENTION_DAYS))
+
+
+def issue_token():
+    """Returns a new sync token, for the next sync."""
+    return encode_token(timezone.now() - get_token_overlap())
+
+
+def encode_token(date):
+    return base64.urlsafe_b64encode(date.isoformat()).rstrip("=")
+
+
+def decode_token(token):
+    """Returns the date encoded in the sync token, or None if the token is invalid."""
+    try:
+        since = dateparse.parse_datetime(base64.urlsafe_b64decode(token.encode("ascii") + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    # Tokens are issued with a time zone if time zone support is enabled, and can't be compared otherwise.
+    if since is not None and timezone.is_aware(since) != settings.USE_TZ:
+        return None
+    return since
+
+
+def record_instance_removed(model_id, instance_external_id):
+    """Records that an instance has been removed from the API."""
+    from data.models import Model, Tombstone
+    model_external_id = Model.objects.filter(pk=model_id).values_list("external_id", flat=True).first()
+    if model_external_id is not None:
+        Tombstone.objects.create(
+            model_external_id = model_external_id,
+            instance_external_id = instance_external_id,
+        )
+
+
+def record_instances_removed(instance_keys):
+    """
+    Records that instances have been removed from the API.
+
+    The instance keys are an iterable of (model_external_id, instance_external_id) pairs.
+    """
+    from data.models import Tombstone
+    Tombstone.objects.bulk_create([
+        Tombstone(
+            model_external_id = model_external_id,
+            instance_external_id = instance_external_id,
+        )
+        for model_external_id, instance_external_id
+        in instance_keys
+    ])
+
+
+def record_models_changed(memberships):
+    """
+    Records that the published models in an application have changed.
+
+    The memberships are an iterable of (application_id, model_external_id) pairs.
+    """
+    from data.models import Tombstone
+    Tombstone.objects.bulk_create([
+        Tombstone(
+            application_id = application_id,
+            model_external_id = model_external_id,
+        )
+        for application_id, model_external_id
+        in memberships
+    ])
+
+
+def record_model_changed(model_id, model_external_ids):
+    """Records that a model has changed in all of its applications."""
+    from data.models import Application
+    application_ids = list(Application.objects.filter(model__id=model_id).values_list("id", flat=True))
+    record_models_changed(
+        (application_id, model_external_id)
+        for application_id in application_ids
+        for model_external_id in model_external_ids
+    )
+
+
+def prune_tombstones():
+    """Deletes the tombstones older than the retention period, returning the number deleted."""
+    from data.models import Tombstone
+    tombstones = Tombstone.objects.filter(
+        date_created__lt = timezone.now() - get_tombstone_retention(),
+    )
+    count = tombstones.count()
+    tombstones.delete()
+    return count
+
+
+def get_changes(application, since):
+    """
+    Returns the changes to the application since the given date.
+
+    The return value is a tuple of (changed_model_external_ids, tombstones). All instances
+    of the changed models should be sent to the client, as well as any instances modified
+    since the given date. Clients should apply the tombstones before the instances.
+
+    Returns None if the date is older than the tombstone retention period, in which
+    case the client must sync the entire application again.
+    """
+    from data.models import Instance, Tombstone
+    if since < timezone.now() - get_tombstone_retention():
+        return None
+    published_model_external_ids = frozenset(application.model_set.filter(
+        is_online = True,
+    ).values_list("external_id", flat=True))
+    # Find changes to the models in the application.
+    changed_model_external_ids = frozenset(Tombstone.objects.filter(
+        application = application,
+        date_created__gt = since,
+    ).values_list("model_external_id", flat=True))
+    tombstones = [
+        {"_model": model_external_id}
+        for model_external_id
+        in sorted(changed_model_external_ids)
+    ]
+    # Find removed instances.
+    instance_tombstones = set(Tombstone.objects.filter(
+        application = None,
+        date_created__gt = since,
+        model_external_id__in = published_model_external_ids - changed_model_external_ids,
+    ).values_list("model_external_id", "instance_external_id"))
+    instance_tombstones.update(Instance.objects.filter(
+        model__applications = application,
+        model__is_online = True,
+        is_online = False,
+        date_modified__gt = since,
+    ).values_list("model__external_id", "external_id"))
+    tombstones.extend(
+        {"_model": model_external_id, "_id": instance_external_id}
+        for model_external_id, instance_external_id
+        in sorted(instance_tombstones)
+    )
+    return published_model_external_ids & changed_model_external_ids, tombstones
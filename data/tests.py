@@ -1,10 +1,25 @@
-import random
+import random, json, gzip, tempfile, shutil, os, datetime, base64
+from io import BytesIO
 
 from django.test import TestCase
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.test.client import RequestFactory
+from django.db import connection
+from django.contrib import admin
+from django.contrib.auth.models import User, Permission
+from django.contrib.messages.storage.cookie import CookieStorage
 from django.conf.urls import url, patterns, include
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
 
-from data.models import Model, Application
+from data.models import Model, Application, File, Instance, Publication, BulkAction, Tombstone, FieldValue, SearchDocument
+from data.forms import form_for_model, form_classes
+from data.admin import InstanceAdmin
+from data.schema import get_schema, schemas
+from data import sync, codec, bulk, admin as data_admin
 
 
 urlpatterns = patterns("",
@@ -59,10 +74,15 @@ class TestData(TestCase):
         instance_data["_model"] = instance.model.external_id
         return instance_data
 
+    def getResponseContent(self, response):
+        if response.streaming:
+            return "".join(response.streaming_content)
+        return response.content
+
     def assertJsonResponse(self, url, expected_data, status=200):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status)
-        self.assertJSONEqual(response.content, expected_data)
+        self.assertJSONEqual(self.getResponseContent(response), expected_data)
 
     def assertNotFoundResponse(self, url):
         self.assertJsonResponse(url, {
@@ -84,6 +104,103 @@ class TestData(TestCase):
             "message": "Instances within application Test Application were successfully loaded.",
         })
 
+    def testApplicationInstanceListApiViewSync(self):
+        url = "/a/{}.json?since=".format(self.application.external_id)
+        response = json.loads(self.client.get(url).content)
+        self.assertEqual(response["instances"], [self.getJsonForInstance(self.instance2)])
+        self.assertEqual(response["tombstones"], [])
+        self.assertTrue(response["reset"])
+        self.assertTrue(response["token"])
+        # Make some changes. Tokens are issued with an overlap, so create a new one without.
+        token = sync.encode_token(timezone.now())
+        instance3 = self.model2.instance_set.create(name="Test Instance 3")
+        instance3.is_online = False
+        instance3.save()
+        self.instance2.delete()
+        self.model.applications.add(self.application)
+        # Sync the changes.
+        response = json.loads(self.client.get(url + token).content)
+        self.assertFalse(response["reset"])
+        self.assertEqual(response["instances"], [self.getJsonForInstance(self.instance)])
+        self.assertEqual(sorted(response["tombstones"]), sorted([
+            {"_model": self.model.external_id},
+            {"_model": self.model2.external_id, "_id": self.instance2.external_id},
+            {"_model": self.model2.external_id, "_id": instance3.external_id},
+        ]))
+
+    def testApplicationInstanceListApiViewSyncExpired(self):
+        url = "/a/{}.json?since=".format(self.application.external_id)
+        self.instance2.delete()
+        expired_count = Tombstone.objects.update(date_created=timezone.now() - datetime.timedelta(days=31))
+        instance3 = self.model2.instance_set.create(name="Test Instance 3")
+        instance3.delete()
+        # Tokens older than the tombstone retention period require a full sync.
+        token = sync.encode_token(timezone.now() - datetime.timedelta(days=31))
+        response = json.loads(self.client.get(url + token).content)
+        self.assertTrue(response["reset"])
+        self.assertEqual(response["tombstones"], [])
+        self.assertEqual(response["instances"], [])
+        # Prune the expired tombstones.
+        stdout = BytesIO()
+        call_command("prune_tombstones", stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), "Pruned {} tombstones.".format(expired_count))
+        self.assertEqual(list(Tombstone.objects.values_list("instance_external_id", flat=True)), [instance3.external_id])
+        # Recent tokens still sync incrementally.
+        with self.settings(DATA_TOMBSTONE_RETENTION_DAYS=60):
+            response = json.loads(self.client.get(url + token).content)
+        self.assertFalse(response["reset"])
+        self.assertEqual(response["tombstones"], [{"_model": self.model2.external_id, "_id": instance3.external_id}])
+
+    def testDeleteModel(self):
+        def delete_model(instance_count):
+            model = Model.objects.create(name="Deleted Model")
+            model.field_set.create(name="Name", type="text")
+            model.applications.add(self.application)
+            for n in range(instance_count):
+                model.instance_set.create(name="Instance", data={"Name": "Instance"})
+            Tombstone.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                Model.objects.get(pk=model.pk).delete()
+            self.assertFalse(Instance.objects.filter(model_id=model.pk).exists())
+            # Only the model is recorded as removed.
+            self.assertEqual(list(Tombstone.objects.values_list("model_external_id", "instance_external_id")), [(model.external_id, "")])
+            return len(queries)
+        # Deleting a model doesn't send signals for each instance.
+        self.assertEqual(delete_model(1), delete_model(10))
+
+    def testApplicationInstanceListApiViewSyncBadRequest(self):
+        # Tokens without a time zone are rejected.
+        naive_token = sync.encode_token(datetime.datetime(2026, 10, 18))
+        for query in ("since=foo", "since=&limit=10", "since=" + naive_token):
+            response = self.client.get("/a/{}.json?{}".format(self.application.external_id, query))
+            self.assertEqual(response.status_code, 400)
+
+    def testApplicationInstanceListApiViewPublications(self):
+        url = "/a/{}.json".format(self.application.external_id)
+        def assertPublishedInstances(*instances):
+            self.assertJsonResponse(url, {
+                "instances": [self.getJsonForInstance(instance) for instance in instances],
+                "status": "OK",
+                "message": "Instances within application Test Application were successfully loaded.",
+            })
+        # Taking a model offline unpublishes its instances.
+        self.model2.is_online = False
+        self.model2.save()
+        assertPublishedInstances()
+        self.model2.is_online = True
+        self.model2.save()
+        assertPublishedInstances(self.instance2)
+        # Taking an instance offline unpublishes it.
+        self.instance2.is_online = False
+        self.instance2.save()
+        assertPublishedInstances()
+        # Rebuilding the publications gives the same result.
+        self.model.applications.add(self.application)
+        publications = sorted(Publication.objects.values_list("application_id", "model_id", "instance_id"))
+        call_command("rebuild_publications", verbosity=0)
+        self.assertEqual(sorted(Publication.objects.values_list("application_id", "model_id", "instance_id")), publications)
+        assertPublishedInstances(self.instance)
+
     def testApplicationInstanceListApiViewNotFound(self):
         self.assertNotFoundResponse("/a/bad_id.json")
 
@@ -94,6 +211,288 @@ class TestData(TestCase):
             "message": "Instances of Test Model were successfully loaded.",
         })
 
+    @override_settings(DATA_STREAMING_RESPONSES=True)
+    def testInstanceListApiViewStreaming(self):
+        response = self.client.get("/{}.json".format(self.model.external_id))
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.has_header("Content-Length"))
+        self.assertEqual(response["Access-Control-Allow-Origin"], "*")
+        self.assertJSONEqual(self.getResponseContent(response), {
+            "instances": [self.getJsonForInstance(self.instance)],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+
+    @override_settings(DATA_STREAMING_RESPONSES=True)
+    def testApplicationInstanceListApiViewStreamingJsonp(self):
+        response = self.client.get("/a/{}.json?callback=foo".format(self.application.external_id))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/javascript; charset=utf-8")
+        content = self.getResponseContent(response)
+        self.assertTrue(content.startswith("foo("))
+        self.assertTrue(content.endswith(");"))
+        self.assertJSONEqual(content[4:-2], {
+            "instances": [self.getJsonForInstance(self.instance2)],
+            "status": "OK",
+            "message": "Instances within application Test Application were successfully loaded.",
+        })
+
+    def testInstanceListApiViewConditional(self):
+        url = "/{}.json".format(self.model.external_id)
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Deleting an instance changes the ETag.
+        self.model.instance_set.create(name="Deleted instance").delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def testApplicationInstanceListApiViewConditional(self):
+        url = "/a/{}.json".format(self.application.external_id)
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Adding a model to the application changes the ETag.
+        self.model.applications.add(self.application)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testInstanceListApiViewConditionalUnpublished(self):
+        self.model.applications.add(self.application)
+        newest_instance = self.model.instance_set.create(name="Newest instance")
+        url = "/{}.json".format(self.model.external_id)
+        application_url = "/a/{}.json".format(self.application.external_id)
+        etag = self.client.get(url)["ETag"]
+        application_etag = self.client.get(application_url)["ETag"]
+        # Taking an instance that is not the newest offline changes the ETag.
+        self.instance.is_online = False
+        self.instance.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(application_url, HTTP_IF_NONE_MATCH=application_etag).status_code, 200)
+        # Taking a model offline changes the application ETag.
+        application_etag = self.client.get(application_url)["ETag"]
+        self.model.is_online = False
+        self.model.save()
+        self.assertEqual(self.client.get(application_url, HTTP_IF_NONE_MATCH=application_etag).status_code, 200)
+        self.assertTrue(newest_instance.is_online)
+        # Moving an instance to another model changes the ETag of its previous model.
+        moved_instance = self.model2.instance_set.create(name="Moved instance")
+        self.model2.instance_set.create(name="Newest instance")
+        url = "/{}.json".format(self.model2.external_id)
+        etag = self.client.get(url)["ETag"]
+        moved_instance.model = self.model
+        moved_instance.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testInstanceListApiViewPaginated(self):
+        instances = [self.instance] + [
+            self.model.instance_set.create(
+                name = "Test Instance {}".format(n),
+                data = {"Name": "Test Instance {}".format(n)},
+            )
+            for n in range(4)
+        ]
+        url = "/{}.json?limit=2".format(self.model.external_id)
+        loaded_instances = []
+        while url:
+            response = json.loads(self.client.get(url).content)
+            self.assertLessEqual(len(response["instances"]), 2)
+            loaded_instances.extend(response["instances"])
+            url = response["next"] and "/{}.json?limit=2&cursor={}".format(self.model.external_id, response["next"])
+        self.assertEqual(loaded_instances, [self.getJsonForInstance(instance) for instance in instances])
+
+    def testInstanceListApiViewPaginatedBadRequest(self):
+        # Cursors without a time zone are rejected.
+        naive_cursor = base64.urlsafe_b64encode("2026-10-18T00:00:00|1")
+        for query in ("limit=0", "limit=foo", "limit=2&cursor=foo", "cursor=foo", "cursor=" + naive_cursor):
+            response = self.client.get("/{}.json?{}".format(self.model.external_id, query))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content)["status"], "Bad request")
+
+    def testInstanceListApiViewFiltered(self):
+        self.model.field_set.create(
+            name = "Count",
+            type = "integer",
+        )
+        instance = self.model.instance_set.create(
+            name = "Test Instance Filtered",
+            data = {"Name": "Test Instance Filtered", "Count": 3},
+        )
+        instance_data = self.getJsonForInstance(instance)
+        del instance_data["Name"]
+        self.assertJsonResponse("/{}.json?where[Count]=3&fields=Count".format(self.model.external_id), {
+            "instances": [instance_data],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+
+    def testInstanceListApiViewFilteredRange(self):
+        self.model.field_set.create(
+            name = "Count",
+            type = "integer",
+        )
+        instance = self.model.instance_set.create(
+            name = "Test Instance Filtered",
+            data = {"Name": "Test Instance Filtered", "Count": 3},
+        )
+        for query, instances in (
+            ("where[Count][gt]=2", [instance]),
+            ("where[Count][lte]=2", []),
+            ("where[Count]=", [self.instance]),
+        ):
+            self.assertJsonResponse("/{}.json?{}".format(self.model.external_id, query), {
+                "instances": [self.getJsonForInstance(expected_instance) for expected_instance in instances],
+                "status": "OK",
+                "message": "Instances of Test Model were successfully loaded.",
+            })
+
+    def testInstanceListApiViewFilteredLongText(self):
+        long_name = "x" * 300
+        instance = self.model.instance_set.create(
+            name = "Test Instance Long",
+            data = {"Name": long_name},
+        )
+        # Values too long to index are not matched as missing values.
+        self.assertJsonResponse("/{}.json?where[Name]=".format(self.model.external_id), {
+            "instances": [],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        self.assertJsonResponse("/{}.json?aggregate=count_by(Name)".format(self.model.external_id), {
+            "aggregates": {"count_by(Name)": [{"value": "Test Instance", "count": 1}]},
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        self.assertEqual(instance.data["Name"], long_name)
+
+    def testInstanceListApiViewFilteredBadRequest(self):
+        for query in ("fields=Bad", "where[Bad]=1", "where[Name][bad]=1", "where[Name]=1&fields=Name,Bad"):
+            response = self.client.get("/{}.json?{}".format(self.model.external_id, query))
+            self.assertEqual(response.status_code, 400)
+
+    def testApplicationInstanceListApiViewFiltered(self):
+        self.model.applications.add(self.application)
+        self.assertJsonResponse("/a/{}.json?where[Name]=Test%20Instance%202".format(self.application.external_id), {
+            "instances": [self.getJsonForInstance(self.instance2)],
+            "status": "OK",
+            "message": "Instances within application Test Application were successfully loaded.",
+        })
+
+    def testInstanceListApiViewExpanded(self):
+        self.model.field_set.create(
+            name = "Related",
+            type = "model",
+            type_params = {"model_id": self.model2.id},
+        )
+        self.model.field_set.create(
+            name = "Related List",
+            type = "multi model",
+            type_params = {"model_id": self.model2.id},
+        )
+        instance3 = self.model2.instance_set.create(
+            name = "Test Instance 3",
+            data = {"Name": "Test Instance 3"},
+            is_online = False,
+        )
+        self.instance.data = {
+            "Name": "Test Instance",
+            "Related": self.instance2.external_id,
+            "Related List": [instance3.external_id, self.instance2.external_id],
+        }
+        self.instance.save()
+        instance_data = self.getJsonForInstance(self.instance)
+        instance_data["Related"] = self.getJsonForInstance(self.instance2)
+        instance_data["Related List"] = [self.getJsonForInstance(self.instance2)]
+        self.assertJsonResponse("/{}.json?expand=Related,Related%20List".format(self.model.external_id), {
+            "instances": [instance_data],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        self.assertJsonResponse("/{}/{}.json?expand=Related".format(self.model.external_id, self.instance.external_id), {
+            "instance": dict(instance_data, **{"Related List": [instance3.external_id, self.instance2.external_id]}),
+            "status": "OK",
+            "message": "Instance of Test Model was successfully loaded.",
+        })
+
+    def testInstanceListApiViewExpandedBadRequest(self):
+        for query in ("expand=Bad", "expand=Name", "expand=Name.Name.Name.Name"):
+            response = self.client.get("/{}.json?{}".format(self.model.external_id, query))
+            self.assertEqual(response.status_code, 400)
+
+    def testInstanceListApiViewSearch(self):
+        self.model.field_set.create(
+            name = "Body",
+            type = "long text",
+        )
+        instance = self.model.instance_set.create(
+            name = "Test Instance Searched",
+            data = {"Name": "Test Instance Searched", "Body": "The quick brown fox jumps over the lazy dog."},
+        )
+        self.model.instance_set.create(
+            name = "Test Instance Offline",
+            data = {"Name": "Test Instance Offline", "Body": "The quick brown fox."},
+            is_online = False,
+        )
+        self.assertJsonResponse("/{}.json?search=brown%20FOX".format(self.model.external_id), {
+            "instances": [self.getJsonForInstance(instance)],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        self.assertJsonResponse("/a/{}.json?search=fox".format(self.application.external_id), {
+            "instances": [],
+            "status": "OK",
+            "message": "Instances within application Test Application were successfully loaded.",
+        })
+        for bad_url in ("/{}.json?search=fox&limit=1&cursor=foo".format(self.model.external_id), "/a/{}.json?search=fox&since=".format(self.application.external_id)):
+            self.assertEqual(self.client.get(bad_url).status_code, 400)
+
+    def testInstanceListApiViewAggregated(self):
+        self.model.field_set.create(
+            name = "Price",
+            type = "integer",
+            type_params = {"required": False},
+        )
+        self.model.field_set.create(
+            name = "Date",
+            type = "datetime",
+            type_params = {"required": False},
+        )
+        self.instance.data = {"Name": "Test Instance", "Price": 1, "Date": "2014-01-01T10:00:00+00:00"}
+        self.instance.save()
+        for name, price in (("Test Instance 3", 4), ("Test Instance 3", 6), ("Test Instance Offline", 100)):
+            self.model.instance_set.create(
+                name = name,
+                data = {"Name": name, "Price": price, "Date": "2014-02-01T10:00:00+00:00"},
+                is_online = price < 100,
+            )
+        self.assertJsonResponse("/{}.json?aggregate=count,sum(Price),avg(Price),min(Date),max(Price),count_by(Name)".format(self.model.external_id), {
+            "aggregates": {
+                "count": 3,
+                "sum(Price)": 11,
+                "avg(Price)": 11 / 3.0,
+                "min(Date)": "2014-01-01T10:00:00+00:00",
+                "max(Price)": 6,
+                "count_by(Name)": [
+                    {"value": "Test Instance 3", "count": 2},
+                    {"value": "Test Instance", "count": 1},
+                ],
+            },
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        self.assertJsonResponse("/{}.json?aggregate=count,sum(Price)&where[Price][gt]=5".format(self.model.external_id), {
+            "aggregates": {
+                "count": 1,
+                "sum(Price)": 6,
+            },
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+        for query in ("aggregate=total", "aggregate=sum(Name)", "aggregate=min(Missing)", "aggregate=count&limit=10"):
+            self.assertEqual(self.client.get("/{}.json?{}".format(self.model.external_id, query)).status_code, 400)
+
     def testInstanceListApiViewNotFound(self):
         self.assertNotFoundResponse("/bad_id.json")
 
@@ -104,6 +503,525 @@ class TestData(TestCase):
             "message": "Instance of Test Model was successfully loaded.",
         })
 
+    def testInstancePublishedDataUpdatedOnModelChange(self):
+        for n in range(3):
+            self.model.instance_set.create(name="Test Instance {}".format(n))
+        self.model.external_id = "new_id"
+        # The published data is updated in a batch.
+        with CaptureQueriesContext(connection) as queries:
+            self.model.save()
+        self.assertEqual(len([query for query in queries if 'UPDATE "data_instance"' in query["sql"]]), 1)
+        instance = self.model.instance_set.get(pk=self.instance.pk)
+        self.assertJSONEqual(instance.published_data, self.getJsonForInstance(instance))
+        self.assertJsonResponse("/new_id/{}.json".format(self.instance.external_id), {
+            "instance": self.getJsonForInstance(instance),
+            "status": "OK",
+            "message": "Instance of Test Model was successfully loaded.",
+        })
+
+    def testInstanceBatchApiView(self):
+        url = "/i.json?ids={}/{},{}/bad_id,{}/{}".format(
+            self.model2.external_id, self.instance2.external_id,
+            self.model.external_id,
+            self.model.external_id, self.instance.external_id,
+        )
+        # Two queries for the Last-Modified header, and one to load the instances.
+        with self.assertNumQueries(3):
+            self.assertJsonResponse(url, {
+                "instances": [self.getJsonForInstance(self.instance2), self.getJsonForInstance(self.instance)],
+                "status": "OK",
+                "message": "Instances were successfully loaded.",
+            })
+
+    def testInstanceBatchApiViewBadRequest(self):
+        for query in ("", "?ids=", "?ids=foo", "?ids=foo/"):
+            response = self.client.get("/i.json{}".format(query))
+            self.assertEqual(response.status_code, 400)
+
     def testInstanceDetailApiViewNotFound(self):
         self.assertNotFoundResponse("/{}/bad_id.json".format(self.model.external_id))
         self.assertNotFoundResponse("/bad_id/bad_id.json")
+
+    def testInstanceFormDeserializesReferencesInBulk(self):
+        self.model.field_set.create(
+            name = "Related",
+            type = "model",
+            type_params = {"model_id": self.model2.id},
+        )
+        self.model.field_set.create(
+            name = "Related List",
+            type = "multi model",
+            type_params = {"model_id": self.model2.id},
+        )
+        instance3 = self.model2.instance_set.create(
+            name = "Test Instance 3",
+            data = {"Name": "Test Instance 3"},
+        )
+        self.instance.data = {
+            "Name": "Test Instance",
+            "Related": self.instance2.external_id,
+            "Related List": [instance3.external_id, "missing", self.instance2.external_id],
+        }
+        form_cls = form_for_model(self.model)
+        with self.assertNumQueries(1):
+            initial = form_cls.deserialize_instance_data(self.instance)
+        self.assertEqual(initial["_field_Related"], self.instance2)
+        self.assertEqual(initial["_field_Related List"], [instance3, self.instance2])
+
+    def testInstanceFormDeserializesFilesInBulk(self):
+        self.model.field_set.create(
+            name = "Image",
+            type = "file",
+        )
+        self.model.field_set.create(
+            name = "Document",
+            type = "file",
+        )
+        image = File.objects.create(name="Image", file="files/image.png")
+        document = File.objects.create(name="Document", file="files/document.pdf")
+        self.instance.data = {
+            "Name": "Test Instance",
+            "Image": image.file.url,
+            "Document": document.file.url,
+        }
+        form_cls = form_for_model(self.model)
+        with self.assertNumQueries(1):
+            initial = form_cls.deserialize_instance_data(self.instance)
+        self.assertEqual(initial["_field_Image"], image)
+        self.assertEqual(initial["_field_Document"], document)
+
+    def testModelSchema(self):
+        model = Model.objects.get(pk=self.model.pk)
+        schema = get_schema(model)
+        self.assertIs(get_schema(model), schema)
+        # Changing a field rebuilds the schema.
+        self.model.field_set.create(
+            name = "Related",
+            type = "model",
+            type_params = {"model_id": self.model2.id, "required": False},
+        )
+        model = Model.objects.get(pk=self.model.pk)
+        schema = get_schema(model)
+        self.assertEqual([field.name for field in schema.field_list], ["Name", "Related"])
+        # Values are validated in bulk.
+        with self.assertNumQueries(1):
+            results = schema.clean_many([
+                {"Name": "Test", "Related": self.instance2.external_id},
+                {"Name": "Test"},
+                {"Name": "", "Related": self.instance2.external_id},
+                {"Name": "Test", "Related": "missing"},
+            ])
+        self.assertEqual(results[:2], [
+            {"Name": "Test", "Related": self.instance2.external_id},
+            {"Name": "Test", "Related": None},
+        ])
+        self.assertEqual(results[2].messages, ["Name: This field is required."])
+        self.assertEqual(results[3].messages, ["Related: Unknown reference 'missing'."])
+        # Saving the model doesn't revert the schema version.
+        self.model.save()
+        self.assertEqual(Model.objects.get(pk=self.model.pk).schema_version, model.schema_version)
+
+    def testInstanceFormCached(self):
+        model = Model.objects.get(pk=self.model.pk)
+        form_cls = form_for_model(model)
+        with self.assertNumQueries(0):
+            self.assertIs(form_for_model(model), form_cls)
+        # Changing a field creates a new form class.
+        self.model.field_set.create(
+            name = "Description",
+            type = "long text",
+        )
+        model = Model.objects.get(pk=self.model.pk)
+        self.assertIsNot(form_for_model(model), form_cls)
+        self.assertIn("_field_Description", form_for_model(model).base_fields)
+        # Previous versions are evicted.
+        self.assertEqual([key[1] for key in form_classes if key[0] == model.pk], [model.schema_version])
+        self.assertEqual([key[1] for key in schemas if key[0] == model.pk], [model.schema_version])
+        # Forms use the model they are created with, rather than the model the class was built from.
+        self.model.name = "Renamed Model"
+        self.model.save()
+        model = Model.objects.get(pk=self.model.pk)
+        instance = self.model.instance_set.create(name="Test Instance 3")
+        form = form_for_model(model)(instance=instance, model=model, data={
+            "name": "Test Instance 3",
+            "external_id": self.instance.external_id,
+            "is_online": "on",
+            "_field_Name": "Test Instance 3",
+        })
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors["__all__"], [u"Renamed Model with ID {} already exists.".format(self.instance.external_id)])
+        # Forms created without a model load it.
+        instance = Instance.objects.get(pk=instance.pk)
+        form = form_for_model(model)(instance=instance, data={
+            "model": model.pk,
+            "name": "Test Instance 3",
+            "external_id": instance.external_id,
+            "is_online": "on",
+            "_field_Name": "Changed",
+            "_field_Description": "Description",
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().data, {"Name": "Changed", "Description": "Description"})
+
+    def testInstanceAdminPermissionsMemoized(self):
+        user = User.objects.create_user("editor", "editor@example.com", "password")
+        user.user_permissions.add(*Permission.objects.filter(codename__in=("add_instance", "change_instance")))
+        self.model.admin_users.add(user)
+        model_admin = InstanceAdmin(Instance, admin.site)
+        def count_queries(checks):
+            request = RequestFactory().get("/admin/data/instance/", {"model": self.model.id})
+            request.user = User.objects.get(pk=user.pk)
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(checks):
+                    self.assertTrue(model_admin.has_add_permission(request))
+                    self.assertTrue(model_admin.has_change_permission(request, self.instance))
+                    self.assertFalse(model_admin.has_change_permission(request, self.instance2))
+                    self.assertEqual(model_admin.get_model_for_request(request, None), self.model)
+                    self.assertEqual(list(model_admin.get_queryset(request)), [self.instance])
+            return len(queries) - checks
+        self.assertEqual(count_queries(1), count_queries(10))
+
+    def testInstanceAdminChangeList(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        Instance.objects.filter(pk=self.instance.pk).update(date_modified=timezone.make_aware(datetime.datetime(2013, 11, 5), timezone.utc))
+        Instance.objects.filter(pk=self.instance2.pk).update(date_modified=timezone.make_aware(datetime.datetime(2014, 2, 10), timezone.utc))
+        model_admin = InstanceAdmin(Instance, admin.site)
+        def get_changelist(params):
+            request = RequestFactory().get("/admin/data/instance/", params)
+            request.user = user
+            return model_admin.changelist_view(request).context_data["cl"]
+        cl = get_changelist({"application": self.application.id})
+        self.assertEqual(list(cl.result_list), [self.instance2])
+        self.assertEqual(cl.result_count, 1)
+        self.assertEqual(cl.full_result_count, 2)
+        cl = get_changelist({})
+        self.assertEqual(list(cl.result_list), [self.instance2, self.instance])
+        # The date hierarchy lists every period in the range of dates.
+        self.assertEqual([value.year for value in cl.queryset.datetimes("date_modified", "year")], [2013, 2014])
+        self.assertEqual(
+            [(value.year, value.month) for value in cl.queryset.datetimes("date_modified", "month")],
+            [(2013, 11), (2013, 12), (2014, 1), (2014, 2)],
+        )
+        cl = get_changelist({"model": self.model.id, "date_modified__year": 2013})
+        self.assertEqual(list(cl.result_list), [self.instance])
+        self.assertEqual([value.day for value in cl.queryset.datetimes("date_modified", "day")], [5])
+        # Only large unfiltered result sets use the count estimate.
+        estimate_count = data_admin.estimate_count
+        data_admin.estimate_count = lambda queryset: 20000
+        try:
+            self.assertEqual(get_changelist({}).full_result_count, 20000)
+            self.assertEqual(get_changelist({"model": self.model.id}).result_count, 1)
+        finally:
+            data_admin.estimate_count = estimate_count
+
+    def testBulkActions(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.model2.field_set.create(
+            name = "Count",
+            type = "integer",
+            order = 1,
+        )
+        model_admin = InstanceAdmin(Instance, admin.site)
+        def post_action(action, data):
+            request = RequestFactory().post("/admin/data/instance/", data)
+            request.user = user
+            request._messages = CookieStorage(request)
+            getattr(model_admin, action)(request, Instance.objects.all())
+            return [message.message for message in request._messages]
+        # Invalid values are rejected before the action is queued.
+        self.assertEqual(post_action("set_field_value", {"field_name": "Count", "field_value": "foo"}), [
+            "Test Model 2: Count: Enter a whole number.",
+        ])
+        self.assertEqual(post_action("set_field_value", {"field_name": "Count", "field_value": "5"}), [
+            "1 instances were queued to set Count. Progress is shown in bulk actions.",
+        ])
+        post_action("unpublish_instances", {})
+        self.assertFalse(BulkAction.objects.exclude(status=BulkAction.STATUS_PENDING).exists())
+        application_url = "/a/{}.json".format(self.application.external_id)
+        application_etag = self.client.get(application_url)["ETag"]
+        stdout = BytesIO()
+        call_command("run_bulk_actions", chunk_size=1, stdout=stdout)
+        self.assertIn("Completed set_field of 1 instances", stdout.getvalue())
+        self.assertIn("Completed unpublish of 2 instances", stdout.getvalue())
+        self.assertEqual(list(BulkAction.objects.values_list("status", "processed")), [(BulkAction.STATUS_COMPLETE, 2), (BulkAction.STATUS_COMPLETE, 1)])
+        # The instances are updated, indexed and published.
+        instance2 = Instance.objects.get(pk=self.instance2.pk)
+        self.assertEqual(instance2.data, {"Name": "Test Instance 2", "Count": 5})
+        self.assertFalse(instance2.is_online)
+        self.assertEqual(codec.loads(instance2.published_data), instance2.get_published_data())
+        self.assertFalse(Publication.objects.exists())
+        self.assertEqual(self.client.get(application_url, HTTP_IF_NONE_MATCH=application_etag).status_code, 200)
+        self.assertGreater(Application.objects.get(pk=self.application.pk).date_modified, self.application.date_modified)
+        self.assertJsonResponse("/{}.json?where[Count]=5".format(self.model2.external_id), {
+            "instances": [],
+            "status": "OK",
+            "message": "Instances of Test Model 2 were successfully loaded.",
+        })
+        # Interrupted actions are resumed from the last chunk.
+        bulk_action = bulk.create_bulk_action("delete", [self.instance.pk, self.instance2.pk])
+        BulkAction.objects.filter(pk=bulk_action.pk).update(status=BulkAction.STATUS_RUNNING, processed=1)
+        call_command("run_bulk_actions", stdout=BytesIO())
+        self.assertEqual(BulkAction.objects.get(pk=bulk_action.pk).status, BulkAction.STATUS_RUNNING)
+        call_command("run_bulk_actions", resume=True, stdout=BytesIO())
+        self.assertEqual(BulkAction.objects.get(pk=bulk_action.pk).status, BulkAction.STATUS_COMPLETE)
+        self.assertEqual(list(Instance.objects.all()), [self.instance])
+        self.assertTrue(Tombstone.objects.filter(instance_external_id=self.instance2.external_id).exists())
+
+    def testFieldReindex(self):
+        field = self.model.field_set.get(name="Name")
+        FieldValue.objects.all().delete()
+        field.type_params = {"required": False}
+        field.save()
+        # The index is rebuilt in the background.
+        self.assertFalse(FieldValue.objects.exists())
+        call_command("run_bulk_actions", stdout=BytesIO())
+        self.assertEqual(list(FieldValue.objects.values_list("instance_id", "text_value")), [(self.instance.pk, "Test Instance")])
+        # Saving a field doesn't scan the instances of its model.
+        def count_queries():
+            field.type_params = {"required": not field.type_params["required"]}
+            with CaptureQueriesContext(connection) as queries:
+                field.save()
+            return len(queries)
+        query_count = count_queries()
+        for n in range(5):
+            self.model.instance_set.create(name="Test Instance {}".format(n), data={"Name": "Test Instance {}".format(n)})
+        self.assertEqual(count_queries(), query_count)
+        # Deleting a searchable field updates the search documents in the background.
+        field.delete()
+        call_command("run_bulk_actions", stdout=BytesIO())
+        self.assertEqual(list(SearchDocument.objects.filter(model=self.model).values_list("text", flat=True).distinct()), [""])
+
+    def testFieldMigration(self):
+        field = self.model2.field_set.create(
+            name = "Count",
+            type = "text",
+            order = 1,
+        )
+        instance3 = self.model2.instance_set.create(
+            name = "Test Instance 3",
+            data = {
+                "Name": "Test Instance 3",
+                "Count": "foo",
+            },
+        )
+        Instance.objects.filter(pk=self.instance2.pk).update(data={"Name": "Test Instance 2", "Count": "5"})
+        # Renaming and retyping the field queues a migration of the instance data.
+        field.name = "Total"
+        field.type = "integer"
+        field.save()
+        bulk_action = BulkAction.objects.get()
+        self.assertEqual((bulk_action.action, bulk_action.instance_ids), ("migrate_field", sorted([self.instance2.pk, instance3.pk])))
+        self.assertEqual(Instance.objects.get(pk=self.instance2.pk).data, {"Name": "Test Instance 2", "Count": "5"})
+        # Instances edited before the migration reaches them are migrated by the form.
+        form = form_for_model(self.model2)(instance=Instance.objects.get(pk=self.instance2.pk), model=self.model2)
+        self.assertEqual(form.initial["_field_Total"], 5)
+        form = form_for_model(self.model2)(instance=Instance.objects.get(pk=self.instance2.pk), model=self.model2, data={
+            "model": self.model2.pk,
+            "name": "Test Instance 2",
+            "external_id": self.instance2.external_id,
+            "is_online": "on",
+            "_field_Name": "Test Instance 2",
+            "_field_Total": "6",
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        call_command("run_bulk_actions", chunk_size=1, stdout=BytesIO())
+        # Values are moved and converted, or left unchanged and recorded if they cannot be converted.
+        instance2 = Instance.objects.get(pk=self.instance2.pk)
+        self.assertEqual(instance2.data, {"Name": "Test Instance 2", "Total": 6})
+        self.assertEqual(Instance.objects.get(pk=instance3.pk).data, {"Name": "Test Instance 3", "Count": "foo"})
+        bulk_action = BulkAction.objects.get()
+        self.assertEqual(bulk_action.status, BulkAction.STATUS_COMPLETE)
+        self.assertEqual(bulk_action.params["failed_instance_ids"], [instance3.pk])
+        self.assertEqual(bulk_action.model_id, self.model2.pk)
+        self.assertJsonResponse("/{}.json?where[Total]=6".format(self.model2.external_id), {
+            "instances": [self.getJsonForInstance(instance2)],
+            "status": "OK",
+            "message": "Instances of Test Model 2 were successfully loaded.",
+        })
+        # Changing other field options reindexes the instance data, without migrating it.
+        field.type_params = {"required": False}
+        field.save()
+        self.assertEqual(list(BulkAction.objects.order_by("id").values_list("action", flat=True)), ["migrate_field", "reindex"])
+        # Saves that don't change the indexing are not queued.
+        field.order = 2
+        field.save()
+        self.model2.field_set.create(
+            name = "New",
+            type = "text",
+            order = 3,
+        )
+        self.assertEqual(BulkAction.objects.count(), 2)
+
+    def testFieldMigrationReferences(self):
+        field = self.model2.field_set.create(
+            name = "Related",
+            type = "model",
+            type_params = {"model_id": self.model.id, "required": False},
+            order = 1,
+        )
+        Instance.objects.filter(pk=self.instance2.pk).update(data={"Name": "Test Instance 2", "Related": self.instance.external_id})
+        # References are converted to their external ID.
+        field.type = "text"
+        field.type_params = {"required": False}
+        field.save()
+        call_command("run_bulk_actions", stdout=BytesIO())
+        self.assertEqual(Instance.objects.get(pk=self.instance2.pk).data["Related"], self.instance.external_id)
+        # And back again, failing for unknown references.
+        instance3 = self.model2.instance_set.create(name="Test Instance 3", data={"Name": "Test Instance 3", "Related": "missing"})
+        field.type = "multi model"
+        field.type_params = {"model_id": self.model.id, "required": False}
+        field.save()
+        # Instances migrated by the form are not migrated again.
+        form = form_for_model(self.model2)(instance=Instance.objects.get(pk=self.instance2.pk), model=self.model2)
+        self.assertEqual(form.initial["_field_Related"], [self.instance])
+        instance2 = form.instance
+        instance2.save()
+        self.assertEqual(instance2.data["Related"], [self.instance.external_id])
+        call_command("run_bulk_actions", stdout=BytesIO())
+        self.assertEqual(Instance.objects.get(pk=self.instance2.pk).data["Related"], [self.instance.external_id])
+        bulk_action = BulkAction.objects.filter(action="migrate_field").order_by("-id")[0]
+        self.assertEqual(bulk_action.params["migrated_instance_ids"], [self.instance2.pk])
+        self.assertEqual(bulk_action.params["failed_instance_ids"], [instance3.pk])
+
+    def testImportInstancesCommand(self):
+        self.model2.field_set.create(
+            name = "Count",
+            type = "integer",
+        )
+        self.model2.field_set.create(
+            name = "Related",
+            type = "model",
+            type_params = {"model_id": self.model.id, "required": False},
+            order = 1,
+        )
+        import_file = tempfile.NamedTemporaryFile(suffix=".csv")
+        import_file.write(
+            "_id,Name,Count,Related\n"
+            "{},Test Instance 2 Updated,5,\n"
+            "new-instance,Test Instance 3,3,{}\n"
+            "bad-count,Test Instance 4,foo,\n"
+            "bad-related,Test Instance 5,1,missing\n".format(self.instance2.external_id, self.instance.external_id)
+        )
+        import_file.flush()
+        stdout, stderr = BytesIO(), BytesIO()
+        call_command("import_instances", self.model2.external_id, import_file.name, chunk_size=2, stdout=stdout, stderr=stderr)
+        self.assertIn("2 instances (1 created, 1 updated, 2 invalid)", stdout.getvalue())
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            "Line 4: Count: Enter a whole number.",
+            "Line 5: Related: Unknown reference 'missing'.",
+        ])
+        # The instances are published, indexed and searchable.
+        instance2 = Instance.objects.get(pk=self.instance2.pk)
+        instance3 = Instance.objects.get(external_id="new-instance")
+        self.assertEqual(instance2.data, {"Name": "Test Instance 2 Updated", "Count": 5, "Related": None})
+        self.assertEqual(instance3.data, {"Name": "Test Instance 3", "Count": 3, "Related": self.instance.external_id})
+        self.assertEqual(instance3.name, "Test Instance 3")
+        self.assertJsonResponse("/a/{}.json?where[Count][gt]=4".format(self.application.external_id), {
+            "instances": [self.getJsonForInstance(instance2)],
+            "status": "OK",
+            "message": "Instances within application Test Application were successfully loaded.",
+        })
+        self.assertJsonResponse("/{}.json?search=updated".format(self.model2.external_id), {
+            "instances": [self.getJsonForInstance(instance2)],
+            "status": "OK",
+            "message": "Instances of Test Model 2 were successfully loaded.",
+        })
+
+    def testExportInstancesCommand(self):
+        self.model.applications.add(self.application)
+        output_dir = tempfile.mkdtemp()
+        try:
+            call_command("export_instances", self.model.external_id, "a/{}".format(self.application.external_id), output_dir=output_dir, chunk_size=1, verbosity=0)
+            with open(os.path.join(output_dir, "{}.jsonl".format(self.model.external_id)), "rb") as handle:
+                self.assertEqual([json.loads(line) for line in handle], [self.getJsonForInstance(self.instance)])
+            with open(os.path.join(output_dir, "a-{}.jsonl".format(self.application.external_id)), "rb") as handle:
+                self.assertEqual([json.loads(line) for line in handle], [self.getJsonForInstance(self.instance), self.getJsonForInstance(self.instance2)])
+            call_command("export_instances", self.model.external_id, output_dir=output_dir, format="csv", gzip=True, verbosity=0)
+            with gzip.open(os.path.join(output_dir, "{}.csv.gz".format(self.model.external_id)), "rb") as handle:
+                self.assertEqual(handle.read().splitlines(), [
+                    "_id,_model,_date_created,_date_modified,Name",
+                    "{},{},{},{},Test Instance".format(
+                        self.instance.external_id,
+                        self.model.external_id,
+                        self.instance.date_created.isoformat(),
+                        self.instance.date_modified.isoformat(),
+                    ),
+                ])
+            self.assertRaises(CommandError, call_command, "export_instances", "bad_id", output_dir=output_dir, stderr=BytesIO())
+        finally:
+            shutil.rmtree(output_dir)
+
+    def testInstanceDataLoadedWithCodec(self):
+        self.assertEqual(Instance.objects.get(pk=self.instance.pk).data, self.instance.data)
+
+    @override_settings(DATA_JSON_CODEC="unknown")
+    def testJsonCodecImproperlyConfigured(self):
+        self.assertRaises(ImproperlyConfigured, codec.dumps, {})
+
+    @override_settings(DATA_RESPONSE_CACHE="default")
+    def testInstanceListApiViewCached(self):
+        cache.clear()
+        url = "/{}.json".format(self.model.external_id)
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            self.assertJsonResponse(url, {
+                "instances": [self.getJsonForInstance(self.instance)],
+                "status": "OK",
+                "message": "Instances of Test Model were successfully loaded.",
+            })
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Changing an instance invalidates the cache.
+        self.instance.data = {"Name": "Changed"}
+        self.instance.save()
+        self.assertJsonResponse(url, {
+            "instances": [self.getJsonForInstance(self.instance)],
+            "status": "OK",
+            "message": "Instances of Test Model were successfully loaded.",
+        })
+
+    @override_settings(DATA_RESPONSE_CACHE="default")
+    def testInstanceListApiViewCachedCompressed(self):
+        cache.clear()
+        url = "/{}.json".format(self.model.external_id)
+        content = self.client.get(url).content
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(response.content)).read(), content)
+        # Clients that refuse gzip get the uncompressed response.
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.content, content)
+        # Each encoding has its own ETag.
+        etag = response["ETag"]
+        gzip_etag = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        self.assertNotEqual(gzip_etag, etag)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=gzip_etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=gzip_etag).status_code, 200)
+
+    @override_settings(DATA_RESPONSE_CACHE="default")
+    def testApplicationInstanceListApiViewCachedApplicationsChanged(self):
+        cache.clear()
+        url = "/a/{}.json".format(self.application.external_id)
+        self.client.get(url)
+        self.model.applications.add(self.application)
+        response = self.client.get(url)
+        self.assertEqual(len(json.loads(response.content)["instances"]), 2)
+        self.model2.applications.clear()
+        self.assertJsonResponse(url, {
+            "instances": [self.getJsonForInstance(self.instance)],
+            "status": "OK",
+            "message": "Instances within application Test Application were successfully loaded.",
+        })
+
+    @override_settings(DATA_RESPONSE_CACHE="default")
+    def testInstanceDetailApiViewCachedDeleted(self):
+        cache.clear()
+        url = "/{}/{}.json".format(self.model.external_id, self.instance.external_id)
+        self.client.get(url)
+        self.instance.delete()
+        self.assertNotFoundResponse(url)
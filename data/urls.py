@@ -9,6 +9,8 @@ urlpatterns = patterns("data.views",
 
     url(r"^a/(?P<application_external_id>[^/]{,255})\.json$", views.ApplicationInstanceListView.as_view()),
 
+    url(r"^i\.json$", views.InstanceBatchView.as_view()),
+
     url(r"^(?P<model_external_id>[^/]{,255})\.json$", views.InstanceListView.as_view()),
 
     url(r"^(?P<model_external_id>[^/]{,255})/(?P<instance_external_id>[^/]{,255})\.json", views.InstanceDetailView.as_view()),
@@ -1,45 +1,147 @@
-import json, random
+import random, collections, hashlib, base64
 from functools import wraps
+from itertools import islice
 
+from django.conf import settings
 from django.views import generic
-from django.http import HttpResponse, Http404
-from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, Http404
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.shortcuts import get_object_or_404
 from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.db.models import Max, Q
+from django.utils import dateparse, timezone
+from django.utils.functional import cached_property
+from django.utils.cache import patch_vary_headers
 
 from cross_origin.views import AccessControlMixin
 
-from data.models import Application, Model, Instance
+from data.models import Application, Model, Field, Instance
+from data.fields import ModelField, MultiModelField
+from data import cache, sync, codec, index, search, aggregation
 
 
 cached_view = cache_control(max_age=60*5)
 
 
-def json_response(request, data, status=200):
-    encoded_data = json.dumps(data, separators=(u",", u":")).encode("utf-8")
+STREAMING_CHUNK_SIZE = 1024 * 64
+
+
+def streaming_enabled():
+    """Returns whether list responses should be streamed to the client."""
+    return getattr(settings, "DATA_STREAMING_RESPONSES", False)
+
+
+def encode_json(data):
+    return codec.dumps(data).encode("utf-8")
+
+
+class RawJson(str):
+
+    """A pre-encoded JSON byte string, to be included verbatim in a response."""
+
+
+def is_lazy_json(data):
+    """Returns whether the data contains an iterator or pre-encoded JSON."""
+    if isinstance(data, (collections.Iterator, RawJson)):
+        return True
+    if isinstance(data, dict):
+        return any(is_lazy_json(value) for value in data.itervalues())
+    if isinstance(data, (list, tuple)):
+        return any(is_lazy_json(value) for value in data)
+    return False
+
+
+def iterencode_json(data):
+    """
+    Encodes the data as a series of JSON byte strings.
+
+    Iterators are encoded as JSON arrays, and consumed one item at a time. Any
+    RawJson values are included verbatim.
+    """
+    if isinstance(data, RawJson):
+        yield data
+    elif isinstance(data, collections.Iterator) or (isinstance(data, (list, tuple)) and is_lazy_json(data)):
+        yield "["
+        for i, item in enumerate(data):
+            if i:
+                yield ","
+            for chunk in iterencode_json(item):
+                yield chunk
+        yield "]"
+    elif isinstance(data, dict) and is_lazy_json(data):
+        yield "{"
+        for i, (key, value) in enumerate(data.iteritems()):
+            if i:
+                yield ","
+            yield encode_json(key)
+            yield ":"
+            for chunk in iterencode_json(value):
+                yield chunk
+        yield "}"
+    else:
+        yield encode_json(data)
+
+
+def buffer_chunks(chunks, chunk_size=STREAMING_CHUNK_SIZE):
+    """Joins a series of small byte strings into chunks of around chunk_size bytes."""
+    buf = []
+    buf_size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        buf_size += len(chunk)
+        if buf_size >= chunk_size:
+            yield "".join(buf)
+            buf = []
+            buf_size = 0
+    if buf:
+        yield "".join(buf)
+
+
+def jsonp_chunks(jsonp_callback, chunks):
+    yield jsonp_callback.encode("utf-8")
+    yield "("
+    for chunk in chunks:
+        yield chunk
+    yield ");"
+
+
+def json_response(request, data, status=200, streaming=False):
+    chunks = iterencode_json(data)
     mime_type = "application/json"
     # Allow JSONP.
     jsonp_callback = request.GET.get("callback")
     if jsonp_callback:
-        encoded_data = "{jsonp_callback}({encoded_data});".format(
-            jsonp_callback = jsonp_callback.encode("utf-8"),
-            encoded_data = encoded_data,
-        )
+        chunks = jsonp_chunks(jsonp_callback, chunks)
         mime_type = "application/javascript"
     # Write the response.
-    response = HttpResponse(encoded_data, status=status)
+    if streaming:
+        response = StreamingHttpResponse(buffer_chunks(chunks), status=status)
+    else:
+        encoded_data = "".join(chunks)
+        response = HttpResponse(encoded_data, status=status)
+        response["Content-Length"] = str(len(encoded_data))
     response["Content-Type"] = "{mime_type}; charset=utf-8".format(
         mime_type = mime_type,
     )
-    response["Content-Length"] = str(len(encoded_data))
     return response
 
 
+class BadRequest(Exception):
+
+    """Raised when an API request has invalid parameters."""
+
+
 def json_error_response(func):
     @wraps(func)
     def do_json_error_response(self, request, *args, **kwargs):
         try:
             return func(self, request, *args, **kwargs)
+        except BadRequest as ex:
+            return json_response(request, {
+                "status": "Bad request",
+                "message": unicode(ex),
+            }, status=400)
         except PermissionDenied:
             return json_response(request, {
                 "status": "Permission denied",
@@ -53,6 +155,120 @@ def json_error_response(func):
     return do_json_error_response
 
 
+def is_not_modified(request, headers):
+    """Checks the request conditional headers against the given response headers."""
+    headers = dict(headers)
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        return if_none_match == headers.get("ETag")
+    if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+    if if_modified_since is not None:
+        return if_modified_since == headers.get("Last-Modified")
+    return False
+
+
+def cached_response(func):
+    """
+    Caches successful responses on the server, if DATA_RESPONSE_CACHE is set.
+
+    Compressed copies of each response are cached too, and served to clients
+    that accept them.
+
+    The view should implement get_cache_dependencies().
+    """
+    @wraps(func)
+    def do_cached_response(self, request, *args, **kwargs):
+        response_cache = cache.get_response_cache()
+        if response_cache is None:
+            return func(self, request, *args, **kwargs)
+        # Try to load the response from the cache.
+        key = cache.get_response_key(request, response_cache, self.get_cache_dependencies())
+        encoding = cache.get_response_encoding(request)
+        cached_response = cache.get_cached_response(response_cache, key, encoding)
+        if cached_response is not None:
+            status, headers, content = cached_response
+            if is_not_modified(request, headers):
+                response = HttpResponseNotModified()
+                headers = [(header, value) for header, value in headers if header in ("ETag", "Last-Modified")]
+            else:
+                response = HttpResponse(content, status=status)
+                response["Content-Length"] = str(len(content))
+            for header, value in headers:
+                response[header] = value
+        else:
+            # Generate and cache the response.
+            response = func(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                encoded_contents = cache.set_cached_response(response_cache, key, response)
+                if encoding in encoded_contents:
+                    response.content = encoded_contents[encoding]
+                    for header, value in cache.get_encoded_headers(response.items(), encoding):
+                        response[header] = value
+                    response["Content-Length"] = str(len(response.content))
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+    return do_cached_response
+
+
+def conditional_response(func):
+    """
+    Answers conditional GET requests with a 304 response where possible.
+
+    The view should implement get_last_modified(), which is used to generate
+    the ETag and Last-Modified headers without rendering the response.
+    """
+    @wraps(func)
+    def do_conditional_response(self, request, *args, **kwargs):
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            etag = None
+        else:
+            etag = hashlib.md5(last_modified.isoformat()).hexdigest()
+        return condition(
+            etag_func = lambda request, *args, **kwargs: etag,
+            last_modified_func = lambda request, *args, **kwargs: last_modified,
+        )(lambda request, *args, **kwargs: func(self, request, *args, **kwargs))(request, *args, **kwargs)
+    return do_conditional_response
+
+
+def max_date(*dates):
+    """Returns the latest of the given dates, ignoring None."""
+    return max([date for date in dates if date is not None] or [None])
+
+
+MAX_PAGE_SIZE = 1000
+
+META_KEYS = frozenset(("_id", "_date_created", "_date_modified", "_model",))
+
+MAX_EXPAND_DEPTH = 3
+
+# The number of instances expanded together, and the maximum number of referenced instances loaded in one query.
+EXPAND_CHUNK_SIZE = 100
+EXPAND_QUERY_SIZE = 500
+
+
+def encode_cursor(date_modified, pk):
+    return base64.urlsafe_b64encode("{date_modified}|{pk}".format(
+        date_modified = date_modified.isoformat(),
+        pk = pk,
+    )).rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns the (date_modified, pk) tuple encoded in the cursor."""
+    try:
+        cursor = base64.urlsafe_b64decode(cursor.encode("ascii") + "=" * (-len(cursor) % 4))
+        date_modified, pk = cursor.split("|")
+        date_modified = dateparse.parse_datetime(date_modified)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeError):
+        date_modified = None
+    # Cursors are issued with a time zone if time zone support is enabled, and can't be compared otherwise.
+    if date_modified is None or timezone.is_aware(date_modified) != settings.USE_TZ:
+        raise BadRequest("Parameter 'cursor' is invalid.")
+    return date_modified, pk
+
+
 INDEX_MESSAGES = (
     "Any fool can use a computer. Many do.",
     "There are 10 types of people in the world: those who understand binary, and those who don't.",
@@ -75,94 +291,514 @@ class IndexView(AccessControlMixin, generic.View):
 
 class InstanceApiView(AccessControlMixin, generic.View):
 
-    def get_instance_set(self):
+    """
+    Base class for instance API views.
+
+    Subclasses define get_field_set(), which returns the fields that can be used to
+    filter and project instances.
+    """
+
+    def get_instance_queryset(self):
         return Instance.objects.filter(
             model__is_online = True,
             is_online = True,
-        ).values_list(
-            "external_id",
-            "date_created",
-            "date_modified",
-            "data",
-            "model__external_id",
         ).order_by()  # Don't apply any ordering, to speed up access.
 
-    def format_instance_data(self, instance_tuple):
-        # Pull apart the instance tuple.
-        external_id, date_created, date_modified, instance_data, model_external_id = instance_tuple
-        # Coerce the instance dict.
-        if isinstance(instance_data, basestring):
-            instance_data = json.loads(instance_data)
-        # Create the instance dict.
-        instance_data["_id"] = external_id
-        instance_data["_date_created"] = date_created.isoformat()
-        instance_data["_date_modified"] = date_modified.isoformat()
-        instance_data["_model"] = model_external_id
-        return instance_data
+    instance_set_fields = ("published_data", "model_id", "date_modified", "id",)
 
+    def get_instance_set(self):
+        return self.get_instance_queryset().values_list(*self.instance_set_fields)
+
+    @cached_property
+    def field_list(self):
+        return list(self.get_field_set())
+
+    @cached_property
+    def instance_projection(self):
+        """Returns the set of field names requested by the fields parameter, or None."""
+        field_names = self.request.GET.get("fields")
+        if field_names is None:
+            return None
+        field_names = frozenset(field_names.split(","))
+        known_field_names = frozenset(field.name for field in self.field_list)
+        for field_name in field_names:
+            if field_name not in known_field_names:
+                raise BadRequest(u"Unknown field '{field_name}' in parameter 'fields'.".format(
+                    field_name = field_name,
+                ))
+        return field_names
+
+    @cached_property
+    def instance_filters(self):
+        """Returns the filters requested by the where[<field>] parameters, as parsed by index.parse_filters()."""
+        try:
+            return index.parse_filters(self.request.GET, self.get_field_set())
+        except ValidationError as ex:
+            raise BadRequest(u" ".join(ex.messages))
+
+    def get_filtered_instance_set(self):
+        """Returns the instance set, filtered by field value using the field value index."""
+        return index.filter_instances(self.get_instance_set(), self.instance_filters)
+
+    @cached_property
+    def instance_expansion(self):
+        """
+        Returns the relations requested by the expand parameter, or None.
+
+        The expansion is a nested dict of {field_name: expansion}, where dotted field
+        names in the parameter expand the relations of the referenced instances.
+        """
+        paths = self.request.GET.get("expand")
+        if paths is None:
+            return None
+        expansion = {}
+        for path in paths.split(","):
+            field_names = path.split(".")
+            if len(field_names) > MAX_EXPAND_DEPTH:
+                raise BadRequest(u"Relation '{path}' in parameter 'expand' is nested more than {max_expand_depth} levels deep.".format(
+                    path = path,
+                    max_expand_depth = MAX_EXPAND_DEPTH,
+                ))
+            field_expansion = expansion
+            for field_name in field_names:
+                field_expansion = field_expansion.setdefault(field_name, {})
+        return expansion
+
+    def get_expansion_model_ids(self, expansion, field_list, prefix=u""):
+        """Validates the expansion against the fields, returning the IDs of all expanded models."""
+        model_ids = set()
+        for field_name, field_expansion in expansion.iteritems():
+            path = prefix + field_name
+            field_list_for_name = [field for field in field_list if field.name == field_name]
+            if not field_list_for_name:
+                raise BadRequest(u"Unknown field '{path}' in parameter 'expand'.".format(
+                    path = path,
+                ))
+            field_model_ids = set()
+            for field in field_list_for_name:
+                field_implementation = field.get_field_implementation()
+                if not isinstance(field_implementation, ModelField):
+                    raise BadRequest(u"Field '{path}' in parameter 'expand' is not a model field.".format(
+                        path = path,
+                    ))
+                field_model_ids.add(field_implementation.model_id)
+            model_ids.update(field_model_ids)
+            if field_expansion:
+                model_ids.update(self.get_expansion_model_ids(
+                    field_expansion,
+                    Field.objects.filter(model_id__in=field_model_ids),
+                    path + u".",
+                ))
+        return model_ids
+
+    @cached_property
+    def expansion_model_ids(self):
+        """Returns the IDs of the models expanded by the expand parameter."""
+        if self.instance_expansion is None:
+            return frozenset()
+        return frozenset(self.get_expansion_model_ids(self.instance_expansion, self.field_list))
+
+    def get_expansion_cache_dependencies(self):
+        return [
+            ("model", model_external_id)
+            for model_external_id
+            in Model.objects.filter(
+                id__in = self.expansion_model_ids,
+            ).values_list("external_id", flat=True)
+        ]
+
+    def get_expansion_last_modified(self):
+        if not self.expansion_model_ids:
+            return None
+        return max_date(
+            Model.objects.filter(
+                id__in = self.expansion_model_ids,
+            ).aggregate(
+                last_modified = Max("date_modified"),
+            )["last_modified"],
+            Instance.objects.filter(
+                model_id__in = self.expansion_model_ids,
+            ).aggregate(
+                last_modified = Max("date_modified"),
+            )["last_modified"],
+        )
 
-class ApplicationInstanceListView(InstanceApiView):
+    @cached_property
+    def expansion_field_implementations(self):
+        """A dict of {model_id: {field_name: field_implementation}}, loaded as instances are expanded."""
+        return {}
+
+    def get_expansion_field_implementations(self, model_ids):
+        missing_model_ids = set(model_ids).difference(self.expansion_field_implementations)
+        if missing_model_ids:
+            for model_id in missing_model_ids:
+                self.expansion_field_implementations[model_id] = {}
+            for field in Field.objects.filter(model_id__in=missing_model_ids):
+                self.expansion_field_implementations[field.model_id][field.name] = field.get_field_implementation()
+        return self.expansion_field_implementations
+
+    def expand_instance_data(self, instance_data_list, expansion):
+        """
+        Replaces references in a list of (model_id, instance_data) pairs with the published
+        data of the referenced instances.
+
+        Referenced instances are loaded with one query for each referenced model.
+        Unpublished instances are omitted.
+        """
+        field_implementations = self.get_expansion_field_implementations(model_id for model_id, _ in instance_data_list)
+        for field_name, field_expansion in expansion.iteritems():
+            # Collect the referenced external IDs for each model.
+            external_ids = collections.defaultdict(set)
+            for model_id, instance_data in instance_data_list:
+                field_implementation = field_implementations[model_id].get(field_name)
+                if isinstance(field_implementation, ModelField):
+                    for _, reference_model_id, external_id in field_implementation.get_references(instance_data.get(field_name)):
+                        external_ids[reference_model_id].add(external_id)
+            # Load the published referenced instances.
+            references = {}
+            for reference_model_id, model_external_ids in external_ids.iteritems():
+                model_external_ids = list(model_external_ids)
+                for start in xrange(0, len(model_external_ids), EXPAND_QUERY_SIZE):
+                    for external_id, published_data in Instance.objects.filter(
+                        model_id = reference_model_id,
+                        model__is_online = True,
+                        is_online = True,
+                        external_id__in = model_external_ids[start:start + EXPAND_QUERY_SIZE],
+                    ).values_list("external_id", "published_data"):
+                        references[(reference_model_id, external_id)] = codec.loads(published_data)
+            # Replace the references.
+            expanded_instance_data_list = []
+            def expand_reference(reference_model_id, external_id):
+                reference_data = references.get((reference_model_id, external_id))
+                if reference_data is None:
+                    return None
+                reference_data = dict(reference_data)
+                expanded_instance_data_list.append((reference_model_id, reference_data))
+                return reference_data
+            for model_id, instance_data in instance_data_list:
+                field_implementation = field_implementations[model_id].get(field_name)
+                value = instance_data.get(field_name)
+                if isinstance(field_implementation, MultiModelField):
+                    instance_data[field_name] = filter(None, (
+                        expand_reference(field_implementation.model_id, external_id)
+                        for external_id
+                        in value or ()
+                    ))
+                elif isinstance(field_implementation, ModelField) and value is not None:
+                    instance_data[field_name] = expand_reference(field_implementation.model_id, value)
+            # Expand the referenced instances.
+            if field_expansion and expanded_instance_data_list:
+                self.expand_instance_data(expanded_instance_data_list, field_expansion)
+
+    def format_instance_data(self, instance_tuple, instance_data=None):
+        projection = self.instance_projection
+        # The published data is rendered when the instance is saved.
+        if projection is None and instance_data is None:
+            return RawJson(instance_tuple[0])
+        if instance_data is None:
+            instance_data = codec.loads(instance_tuple[0])
+        if projection is None:
+            return instance_data
+        # Project the requested fields.
+        return dict(
+            (key, value)
+            for key, value
+            in instance_data.iteritems()
+            if key in projection or key in META_KEYS
+        )
 
-    def get_instance_set(self):
-        return super(ApplicationInstanceListView, self).get_instance_set().filter(
-            model__applications = self.application,
+    def format_instance_list(self, instance_tuples):
+        """Yields the formatted data of each instance, expanding relations in chunks."""
+        expansion = self.instance_expansion
+        if expansion is None:
+            for instance_tuple in instance_tuples:
+                yield self.format_instance_data(instance_tuple)
+            return
+        instance_tuples = iter(instance_tuples)
+        while True:
+            chunk = list(islice(instance_tuples, EXPAND_CHUNK_SIZE))
+            if not chunk:
+                break
+            instance_data_list = [
+                (instance_tuple[1], codec.loads(instance_tuple[0]))
+                for instance_tuple
+                in chunk
+            ]
+            self.expand_instance_data(instance_data_list, expansion)
+            for instance_tuple, (_, instance_data) in zip(chunk, instance_data_list):
+                yield self.format_instance_data(instance_tuple, instance_data)
+
+    def get_page_size(self):
+        """Returns the requested page size, or None if pagination was not requested."""
+        limit = self.request.GET.get("limit")
+        if limit is None:
+            if "cursor" in self.request.GET:
+                raise BadRequest("Parameter 'cursor' requires parameter 'limit'.")
+            return None
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise BadRequest("Parameter 'limit' should be a number between 1 and {max_page_size}.".format(
+                max_page_size = MAX_PAGE_SIZE,
+            ))
+        return limit
+
+    def get_instance_page(self, page_size):
+        """
+        Returns a page of instance tuples, and the cursor for the next page.
+
+        Instances are paginated on (date_modified, id), so each page is loaded with
+        an indexed range query, regardless of its position in the instance set.
+        """
+        instance_set = self.get_filtered_instance_set().order_by("date_modified", "id")
+        cursor = self.request.GET.get("cursor")
+        if cursor:
+            date_modified, pk = decode_cursor(cursor)
+            instance_set = instance_set.filter(
+                Q(date_modified__gt=date_modified) |
+                Q(date_modified=date_modified, id__gt=pk)
+            )
+        page = list(instance_set[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            _, _, date_modified, pk = page[-1]
+            next_cursor = encode_cursor(date_modified, pk)
+        else:
+            next_cursor = None
+        return page, next_cursor
+
+    def get_search_results(self, search_query, page_size):
+        """
+        Returns the instance tuples matching the search query, most relevant first.
+
+        Results are found using the database full-text search, and then filtered. Views
+        listing instances define get_search_model_ids(), which returns the IDs of the
+        models searched.
+        """
+        instance_ids = search.search_instance_ids(search_query, self.get_search_model_ids())
+        instance_set = dict(
+            (instance_tuple[3], instance_tuple)
+            for instance_tuple
+            in self.get_filtered_instance_set().filter(id__in=instance_ids).iterator()
         )
+        return [
+            instance_set[instance_id]
+            for instance_id
+            in instance_ids
+            if instance_id in instance_set
+        ][:page_size]
+
+    @cached_property
+    def instance_aggregates(self):
+        """Returns the aggregates requested by the aggregate parameter, as parsed by aggregation.parse_aggregates()."""
+        try:
+            return aggregation.parse_aggregates(self.request.GET["aggregate"], self.get_field_set())
+        except ValidationError as ex:
+            raise BadRequest(u" ".join(ex.messages))
+
+    def aggregate_response(self, request, message):
+        for param in ("limit", "cursor", "search", "fields", "expand"):
+            if param in request.GET:
+                raise BadRequest("Parameter 'aggregate' cannot be combined with parameter '{param}'.".format(
+                    param = param,
+                ))
+        return json_response(request, {
+            "status": "OK",
+            "message": message,
+            "aggregates": aggregation.aggregate_instances(self.get_filtered_instance_set(), self.instance_aggregates),
+        })
 
-    @json_error_response
-    def dispatch(self, request, application_external_id, **kwargs):
+    def instance_list_response(self, request, message):
+        if "aggregate" in request.GET:
+            return self.aggregate_response(request, message)
+        # Validate the request parameters before rendering the response.
+        self.instance_projection
+        self.instance_filters
+        self.expansion_model_ids
+        data = {
+            "status": "OK",
+            "message": message,
+        }
+        search_query = request.GET.get("search")
+        if search_query is not None:
+            if "cursor" in request.GET:
+                raise BadRequest("Parameter 'search' cannot be combined with parameter 'cursor'.")
+            instance_set = self.get_search_results(search_query, self.get_page_size())
+        else:
+            page_size = self.get_page_size()
+            if page_size is None:
+                instance_set = self.get_filtered_instance_set().iterator()
+            else:
+                instance_set, data["next"] = self.get_instance_page(page_size)
+        data["instances"] = self.format_instance_list(instance_set)
+        return json_response(request, data, streaming=streaming_enabled())
+
+    def get_instances_last_modified(self):
+        return self.get_instance_queryset().aggregate(
+            last_modified = Max("date_modified"),
+        )["last_modified"]
+
+
+class ApplicationInstanceListView(InstanceApiView):
+
+    @cached_property
+    def application(self):
         # Check the application exists.
-        self.application = get_object_or_404(Application,
+        return get_object_or_404(Application,
             is_online = True,
-            external_id = application_external_id,
+            external_id = self.kwargs["application_external_id"],
         )
-        # Dispatch the response.
-        return super(ApplicationInstanceListView, self).dispatch(request, application_external_id=application_external_id, **kwargs)
 
-    @cached_view
-    def get(self, request, application_external_id):
+    def get_instance_queryset(self):
+        # Published instances are denormalized, to avoid joining through models and applications.
+        return Instance.objects.filter(
+            publication__application = self.application,
+        ).order_by()
+
+    def get_field_set(self):
+        return Field.objects.filter(
+            model__applications = self.application,
+            model__is_online = True,
+        )
+
+    def get_search_model_ids(self):
+        return self.application.model_set.filter(
+            is_online = True,
+        ).values_list("id", flat=True)
+
+    def get_last_modified(self):
+        models_last_modified = self.application.model_set.filter(
+            is_online = True,
+        ).aggregate(
+            last_modified = Max("date_modified"),
+        )["last_modified"]
+        return max_date(self.application.date_modified, models_last_modified, self.get_instances_last_modified(), self.get_expansion_last_modified())
+
+    def get_cache_dependencies(self):
+        return [
+            ("application", self.kwargs["application_external_id"]),
+        ] + self.get_expansion_cache_dependencies()
+
+    @json_error_response
+    def dispatch(self, request, *args, **kwargs):
+        return super(ApplicationInstanceListView, self).dispatch(request, *args, **kwargs)
+
+    def sync_response(self, request, message):
+        # Validate the request parameters before rendering the response.
+        if "limit" in request.GET or "cursor" in request.GET:
+            raise BadRequest("Parameter 'since' cannot be combined with pagination.")
+        if "search" in request.GET:
+            raise BadRequest("Parameter 'since' cannot be combined with parameter 'search'.")
+        if "aggregate" in request.GET:
+            raise BadRequest("Parameter 'since' cannot be combined with parameter 'aggregate'.")
+        since = request.GET["since"]
+        if since:
+            since = sync.decode_token(since)
+            if since is None:
+                raise BadRequest("Parameter 'since' is invalid.")
+        self.instance_projection
+        self.instance_filters
+        self.expansion_model_ids
+        # Issue the new token before loading any changes.
+        token = sync.issue_token()
+        # Load the changes.
+        instance_set = self.get_filtered_instance_set()
+        changes = sync.get_changes(self.application, since) if since else None
+        if changes is not None:
+            changed_model_external_ids, tombstones = changes
+            instance_set = instance_set.filter(
+                Q(date_modified__gt=since) |
+                Q(model__external_id__in=changed_model_external_ids)
+            )
+        else:
+            tombstones = []
         return json_response(request, {
             "status": "OK",
-            "message": u"Instances within application {application} were successfully loaded.".format(
-                application = self.application,
-            ),
-            "instances": map(self.format_instance_data, self.get_instance_set().iterator()),
-        })
+            "message": message,
+            "token": token,
+            "reset": changes is None,
+            "tombstones": tombstones,
+            "instances": self.format_instance_list(instance_set.iterator()),
+        }, streaming=streaming_enabled())
+
+    @cached_view
+    @cached_response
+    @conditional_response
+    def get(self, request, application_external_id):
+        message = u"Instances within application {application} were successfully loaded.".format(
+            application = self.application,
+        )
+        if "since" in request.GET:
+            return self.sync_response(request, message)
+        return self.instance_list_response(request, message)
 
 
 class ModelApiView(InstanceApiView):
 
-    def get_instance_set(self):
-        return super(ModelApiView, self).get_instance_set().filter(
+    @cached_property
+    def model(self):
+        # Check the model exists.
+        return get_object_or_404(Model,
+            is_online = True,
+            external_id = self.kwargs["model_external_id"],
+        )
+
+    def get_instance_queryset(self):
+        return super(ModelApiView, self).get_instance_queryset().filter(
             model = self.model,
         )
 
+    def get_field_set(self):
+        return self.model.field_set.all()
+
+    def get_search_model_ids(self):
+        return (self.model.pk,)
+
     @json_error_response
-    def dispatch(self, request, model_external_id, **kwargs):
-        # Check the model exists.
-        self.model = get_object_or_404(Model,
-            is_online = True,
-            external_id = model_external_id,
-        )
-        # Dispatch the response.
-        return super(ModelApiView, self).dispatch(request, model_external_id=model_external_id, **kwargs)
+    def dispatch(self, request, *args, **kwargs):
+        return super(ModelApiView, self).dispatch(request, *args, **kwargs)
 
 
 class InstanceListView(ModelApiView):
 
+    def get_cache_dependencies(self):
+        return [
+            ("model", self.kwargs["model_external_id"]),
+        ] + self.get_expansion_cache_dependencies()
+
+    def get_last_modified(self):
+        return max_date(self.model.date_modified, self.get_instances_last_modified(), self.get_expansion_last_modified())
+
     @cached_view
+    @cached_response
+    @conditional_response
     def get(self, request, model_external_id):
-        return json_response(request, {
-            "status": "OK",
-            "message": u"Instances of {model} were successfully loaded.".format(
-                model = self.model,
-            ),
-            "instances": map(self.format_instance_data, self.get_instance_set().iterator()),
-        })
+        return self.instance_list_response(request, u"Instances of {model} were successfully loaded.".format(
+            model = self.model,
+        ))
 
 
 class InstanceDetailView(ModelApiView):
 
+    def get_cache_dependencies(self):
+        return [
+            ("schema", self.kwargs["model_external_id"]),
+            ("instance", self.kwargs["model_external_id"], self.kwargs["instance_external_id"]),
+        ] + self.get_expansion_cache_dependencies()
+
+    def get_last_modified(self):
+        instance_last_modified = self.get_instance_queryset().filter(
+            external_id = self.kwargs["instance_external_id"],
+        ).values_list("date_modified", flat=True).first()
+        if instance_last_modified is None:
+            return None
+        return max_date(self.model.date_modified, instance_last_modified, self.get_expansion_last_modified())
+
     @cached_view
+    @cached_response
+    @conditional_response
     def get(self, request, model_external_id, instance_external_id):
         # Load the instance.
         instance = get_object_or_404(self.get_instance_set(),
@@ -174,5 +810,94 @@ class InstanceDetailView(ModelApiView):
             "message": u"Instance of {model} was successfully loaded.".format(
                 model = self.model,
             ),
-            "instance": self.format_instance_data(instance),
+            "instance": next(self.format_instance_list((instance,))),
+        })
+
+
+class InstanceBatchView(InstanceApiView):
+
+    instance_set_fields = InstanceApiView.instance_set_fields + ("model__external_id", "external_id",)
+
+    @cached_property
+    def instance_keys(self):
+        """Returns the (model_external_id, instance_external_id) pairs requested by the ids parameter."""
+        ids = self.request.GET.get("ids")
+        if not ids:
+            raise BadRequest("Parameter 'ids' is required.")
+        instance_keys = []
+        for instance_key in ids.split(","):
+            model_external_id, sep, instance_external_id = instance_key.partition("/")
+            if not (model_external_id and sep and instance_external_id):
+                raise BadRequest(u"Invalid ID '{instance_key}' in parameter 'ids'. IDs should be given as <model_id>/<instance_id>.".format(
+                    instance_key = instance_key,
+                ))
+            if (model_external_id, instance_external_id) not in instance_keys:
+                instance_keys.append((model_external_id, instance_external_id))
+        if len(instance_keys) > MAX_PAGE_SIZE:
+            raise BadRequest("Parameter 'ids' should contain at most {max_page_size} IDs.".format(
+                max_page_size = MAX_PAGE_SIZE,
+            ))
+        return instance_keys
+
+    @cached_property
+    def model_external_ids(self):
+        return frozenset(model_external_id for model_external_id, _ in self.instance_keys)
+
+    def get_instance_queryset(self):
+        # Load all instances in a single query, possibly matching some instances that weren't requested.
+        return super(InstanceBatchView, self).get_instance_queryset().filter(
+            model__external_id__in = self.model_external_ids,
+            external_id__in = frozenset(instance_external_id for _, instance_external_id in self.instance_keys),
+        )
+
+    def get_field_set(self):
+        return Field.objects.filter(
+            model__external_id__in = self.model_external_ids,
+            model__is_online = True,
+        )
+
+    def get_last_modified(self):
+        models_last_modified = Model.objects.filter(
+            external_id__in = self.model_external_ids,
+            is_online = True,
+        ).aggregate(
+            last_modified = Max("date_modified"),
+        )["last_modified"]
+        return max_date(models_last_modified, self.get_instances_last_modified(), self.get_expansion_last_modified())
+
+    def get_cache_dependencies(self):
+        return [
+            ("schema", model_external_id)
+            for model_external_id
+            in self.model_external_ids
+        ] + [
+            ("instance", model_external_id, instance_external_id)
+            for model_external_id, instance_external_id
+            in self.instance_keys
+        ] + self.get_expansion_cache_dependencies()
+
+    @json_error_response
+    def dispatch(self, request, *args, **kwargs):
+        return super(InstanceBatchView, self).dispatch(request, *args, **kwargs)
+
+    @cached_view
+    @cached_response
+    @conditional_response
+    def get(self, request):
+        # Index the loaded instances by their keys.
+        instance_set = dict(
+            (instance_tuple[-2:], instance_tuple)
+            for instance_tuple
+            in self.get_filtered_instance_set().iterator()
+        )
+        # Render the instances in the requested order.
+        return json_response(request, {
+            "status": "OK",
+            "message": "Instances were successfully loaded.",
+            "instances": list(self.format_instance_list(
+                instance_set[instance_key]
+                for instance_key
+                in self.instance_keys
+                if instance_key in instance_set
+            )),
         })
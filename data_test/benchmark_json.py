@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Benchmarks the JSON codecs available for DATA_JSON_CODEC.
+
+Usage: python benchmark_json.py [iterations]
+"""
+
+import os, sys, timeit
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "data_test.settings")
+
+    from data.codec import CODECS, load_codec
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    # A published instance, with a typical mix of field types.
+    instance_data = {
+        "_id": u"cH4mPv1bR5y5QnXW0vD2Vg",
+        "_model": u"article",
+        "_date_created": u"2014-04-04T12:30:00.123456+00:00",
+        "_date_modified": u"2014-04-05T09:15:00.654321+00:00",
+        "Title": u"An example article title",
+        "Summary": u"A short summary of the article, with some non-ASCII text \u2013 caf\xe9.",
+        "Body": u"<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 20,
+        "Published": True,
+        "Rank": 42,
+        "Rating": 4.5,
+        "Image": u"uploads/2014/04/example-image.jpg",
+        "Author": u"mD8qL0cVSkq9wX1v2YB7eA",
+        "Tags": [u"tag-{}".format(n) for n in range(10)],
+        "Date": u"2014-04-04",
+        "Link": u"http://www.example.com/articles/an-example-article/",
+    }
+    print "{:<12} {:>14} {:>14}".format("codec", "encode/s", "decode/s")
+    for name in sorted(CODECS):
+        try:
+            codec = load_codec(name)
+        except ImportError:
+            print "{:<12} {:>14}".format(name, "not installed")
+            continue
+        encoded_data = codec.dumps(instance_data)
+        encode_time = timeit.timeit(lambda: codec.dumps(instance_data), number=iterations)
+        decode_time = timeit.timeit(lambda: codec.loads(encoded_data), number=iterations)
+        print "{:<12} {:>14.0f} {:>14.0f}".format(name, iterations / encode_time, iterations / decode_time)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Benchmarks loading the published instances of an application, using the
+publication table and using the join through models and applications.
+
+Usage: python benchmark_publication.py [models] [instances_per_model] [iterations]
+"""
+
+import os, sys, timeit
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "data_test.settings")
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    model_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    instance_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    iterations = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    setup_test_environment()
+    test_database_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        from data.models import Application, Model, Instance
+        from data import publication
+        # Create the data, split between two applications.
+        applications = [
+            Application.objects.create(name="Application {}".format(n))
+            for n in range(2)
+        ]
+        for model_index in range(model_count):
+            model = Model.objects.create(
+                name = "Model {}".format(model_index),
+                is_online = model_index % 10 != 0,
+            )
+            model.applications.add(applications[model_index % 2])
+            Instance.objects.bulk_create([
+                Instance(
+                    model = model,
+                    name = "Instance {}".format(instance_index),
+                    external_id = "{}-{}".format(model_index, instance_index),
+                    is_online = instance_index % 10 != 0,
+                    published_data = "{}",
+                )
+                for instance_index
+                in range(instance_count)
+            ])
+        publication.rebuild()
+        # Compare the queries.
+        application = applications[0]
+        instance_set_fields = ("published_data", "model_id", "date_modified", "id",)
+        joined_instance_set = Instance.objects.filter(
+            model__is_online = True,
+            model__applications = application,
+            is_online = True,
+        ).order_by().values_list(*instance_set_fields)
+        published_instance_set = Instance.objects.filter(
+            publication__application = application,
+        ).order_by().values_list(*instance_set_fields)
+        assert sorted(joined_instance_set) == sorted(published_instance_set)
+        print "{} models, {} instances per model, {} published instances".format(
+            model_count,
+            instance_count,
+            published_instance_set.count(),
+        )
+        for name, instance_set in (("join", joined_instance_set), ("publication", published_instance_set)):
+            query_time = timeit.timeit(lambda: list(instance_set.all()), number=iterations)
+            print "{:<12} {:>10.2f} ms/query".format(name, query_time / iterations * 1000)
+    finally:
+        connection.creation.destroy_test_db(test_database_name, verbosity=0)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Benchmarks validating and serializing instance data, using the compiled model
+schema and using a form created by form_for_model.
+
+Usage: python benchmark_schema.py [rows] [iterations]
+"""
+
+import os, sys, timeit
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "data_test.settings")
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    setup_test_environment()
+    test_database_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        from data.models import Model
+        from data.forms import form_for_model
+        from data.schema import get_schema
+        # Create a model with a field of each simple type.
+        model = Model.objects.create(name="Model")
+        for order, (name, type) in enumerate((
+            ("Name", "text"),
+            ("Description", "long text"),
+            ("Count", "integer"),
+            ("Price", "float"),
+            ("Date", "date"),
+            ("Published", "datetime"),
+            ("Featured", "boolean"),
+        )):
+            model.field_set.create(name=name, type=type, order=order)
+        model = Model.objects.get(pk=model.pk)
+        rows = [
+            {
+                "Name": u"Instance {}".format(n),
+                "Description": u"The description of instance {}.".format(n),
+                "Count": n,
+                "Price": n * 0.5,
+                "Date": "2014-01-01",
+                "Published": "2014-01-01T10:00:00+00:00",
+                "Featured": n % 2 == 0,
+            }
+            for n
+            in range(row_count)
+        ]
+        # Compare the validation paths.
+        def clean_with_form():
+            form_cls = form_for_model(model)
+            results = []
+            for row in rows:
+                form = form_cls(data={
+                    "model": model.pk,
+                    "name": row["Name"],
+                    "external_id": row["Name"],
+                    "_field_Name": row["Name"],
+                    "_field_Description": row["Description"],
+                    "_field_Count": str(row["Count"]),
+                    "_field_Price": str(row["Price"]),
+                    "_field_Date": row["Date"],
+                    "_field_Published_0": "2014-01-01",
+                    "_field_Published_1": "10:00:00",
+                    "_field_Featured": "on" if row["Featured"] else "",
+                })
+                assert form.is_valid(), form.errors
+                results.append(form.instance_data)
+            return results
+        def clean_with_schema():
+            results = get_schema(model).clean_many(rows)
+            assert not any(isinstance(result, Exception) for result in results)
+            return results
+        print "{} rows".format(row_count)
+        for name, func in (("form", clean_with_form), ("schema", clean_with_schema)):
+            clean_time = timeit.timeit(func, number=iterations)
+            print "{:<8} {:>10.2f} us/row".format(name, clean_time / iterations / row_count * 1000000)
+    finally:
+        connection.creation.destroy_test_db(test_database_name, verbosity=0)
@@ -16,6 +16,8 @@ setup(
     url = "http://github.com/mohawkhq/mohawk-data-platform",
     packages = [
         "data",
+        "data.management",
+        "data.management.commands",
         "data.migrations",
     ],
     package_data = {